@@ -3,12 +3,13 @@ import { PaRequestsController } from './controllers/pa-requests.controller';
 import { PaRequestsService } from './services/pa-requests.service';
 import { DbService } from './services/db.service';
 import { QueueService } from './services/queue.service';
+import { PolicyCatalogService } from './services/policy-catalog.service';
 import { AuditController } from './controllers/audit.controller';
 import { AuditService } from './services/audit.service';
 import { ApiKeyGuard } from './guards/api-key.guard';
 
 @Module({
   controllers: [PaRequestsController, AuditController],
-  providers: [PaRequestsService, DbService, QueueService, AuditService, ApiKeyGuard],
+  providers: [PaRequestsService, DbService, QueueService, PolicyCatalogService, AuditService, ApiKeyGuard],
 })
 export class AppModule {}
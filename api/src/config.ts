@@ -1,3 +1,4 @@
+import * as path from 'path';
 import * as process from 'process';
 
 export const config = {
@@ -6,5 +7,15 @@ export const config = {
   redisUrl: process.env.REDIS_URL || 'redis://localhost:6379',
   apiKey: process.env.API_KEY || 'dev-api-key',
   queueName: process.env.QUEUE_NAME || 'document_uploaded',
+  // Same settings as the worker: lane names from QUEUE_LANES ("urgent:8,standard:3"), and the
+  // default lane, which lives in QUEUE_NAME itself.
+  queueLanes: (process.env.QUEUE_LANES || '')
+    .split(',')
+    .map((part) => part.split(':')[0].trim())
+    .filter((name) => name.length > 0),
+  queueDefaultLane: process.env.QUEUE_DEFAULT_LANE || 'standard',
   dlqName: process.env.DLQ_NAME || 'document_uploaded_dlq',
+  // The worker's policy rule files (POLICY_DIR there too); uploads may only name these policies.
+  policyDir: process.env.POLICY_DIR || path.join(__dirname, '..', '..', 'worker', 'app', 'policies'),
+  policyRefreshSeconds: parseFloat(process.env.POLICY_REFRESH_SECONDS || '30'),
 };
@@ -35,6 +35,8 @@ export class PaRequestsController {
       requestId,
       idempotencyKey: key,
       text: body.text,
+      lane: body.lane,
+      policyId: body.policy_id,
       actor: req.actor,
     });
   }
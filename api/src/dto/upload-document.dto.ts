@@ -1,7 +1,18 @@
-import { IsNotEmpty, IsString } from 'class-validator';
+import { IsNotEmpty, IsOptional, IsString } from 'class-validator';
 
 export class UploadDocumentDto {
   @IsString()
   @IsNotEmpty()
   text!: string;
+
+  // Queue lane (one of QUEUE_LANES); omitted = the default lane.
+  @IsOptional()
+  @IsString()
+  lane?: string;
+
+  // Procedure policy (a policy_id in POLICY_DIR); omitted = the worker's DEFAULT_POLICY.
+  @IsOptional()
+  @IsString()
+  @IsNotEmpty()
+  policy_id?: string;
 }
@@ -1,6 +1,7 @@
 import { BadRequestException, Injectable, NotFoundException } from '@nestjs/common';
 import { DbService } from './db.service';
 import { QueueService } from './queue.service';
+import { PolicyCatalogService } from './policy-catalog.service';
 import { AuditService } from './audit.service';
 import { logger } from '../utils/logger';
 
@@ -20,6 +21,7 @@ export class PaRequestsService {
     private readonly db: DbService,
     private readonly queue: QueueService,
     private readonly audit: AuditService,
+    private readonly policies: PolicyCatalogService,
   ) {}
 
   async createRequest(actor: string) {
@@ -36,12 +38,20 @@ export class PaRequestsService {
     requestId: string;
     idempotencyKey: string;
     text: string;
+    lane?: string;
+    policyId?: string;
     actor: string;
   }) {
-    const { requestId, idempotencyKey, text, actor } = params;
+    const { requestId, idempotencyKey, text, lane, policyId, actor } = params;
     if (!text || text.trim().length === 0) {
       throw new BadRequestException('text is required');
     }
+    if (lane && !this.queue.hasLane(lane)) {
+      throw new BadRequestException(`unknown lane: ${lane}`);
+    }
+    if (policyId && !this.policies.has(policyId)) {
+      throw new BadRequestException(`unknown policy: ${policyId}`);
+    }
     if (!idempotencyKey || idempotencyKey.trim().length === 0) {
       throw new BadRequestException('Idempotency-Key header is required');
     }
@@ -91,6 +101,8 @@ export class PaRequestsService {
         job_id: job.job_id,
         request_id: requestId,
         trace_id: job.trace_id,
+        lane,
+        policy_id: policyId,
       });
 
       return { job_id: job.job_id, request_id: requestId };
@@ -0,0 +1,47 @@
+import { Injectable } from '@nestjs/common';
+import * as fs from 'fs';
+import * as path from 'path';
+import { config } from '../config';
+import { logger } from '../utils/logger';
+
+@Injectable()
+export class PolicyCatalogService {
+  // Policy ids of the rule files in POLICY_DIR, the directory the worker loads its policies from.
+  // The directory is re-read at most every POLICY_REFRESH_SECONDS, so a procedure onboarded by
+  // dropping a file in can be selected without an API change or restart. A directory that
+  // cannot be read keeps the previous catalog.
+  private policies = new Set<string>();
+  private checkedAt = 0;
+
+  has(policyId: string): boolean {
+    this.refresh();
+    return this.policies.has(policyId);
+  }
+
+  private refresh() {
+    const now = Date.now();
+    if (this.checkedAt && now - this.checkedAt < config.policyRefreshSeconds * 1000) {
+      return;
+    }
+    this.checkedAt = now;
+    let files: string[];
+    try {
+      files = fs.readdirSync(config.policyDir).filter((name) => name.endsWith('.json'));
+    } catch (err: any) {
+      logger.error('Failed to list policies', { dir: config.policyDir, error: err.message });
+      return;
+    }
+    const policies = new Set<string>();
+    for (const file of files) {
+      try {
+        const spec = JSON.parse(fs.readFileSync(path.join(config.policyDir, file), 'utf8'));
+        if (typeof spec.policy_id === 'string' && spec.policy_id.length > 0) {
+          policies.add(spec.policy_id);
+        }
+      } catch (err: any) {
+        logger.warn('Skipping unreadable policy file', { file, error: err.message });
+      }
+    }
+    this.policies = policies;
+  }
+}
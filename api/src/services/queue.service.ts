@@ -18,8 +18,35 @@ export class QueueService implements OnModuleDestroy {
     await this.redis.quit();
   }
 
-  async publishDocument(job: { job_id: string; request_id: string; trace_id: string }) {
-    await this.redis.lpush(this.queueName, JSON.stringify(job));
-    logger.info('Enqueued document job', { job_id: job.job_id, request_id: job.request_id });
+  hasLane(lane: string): boolean {
+    return lane === config.queueDefaultLane || config.queueLanes.includes(lane);
+  }
+
+  async publishDocument(job: {
+    job_id: string;
+    request_id: string;
+    trace_id: string;
+    lane?: string;
+    policy_id?: string;
+  }) {
+    // Lanes other than the default one are "<QUEUE_NAME>:<lane>", as in the worker; the payload
+    // keeps its lane so retries, reclaims and redrives return to it. Without policy_id the worker
+    // uses its DEFAULT_POLICY.
+    const { lane, policy_id, ...payload } = job;
+    const key = lane && lane !== config.queueDefaultLane ? `${this.queueName}:${lane}` : this.queueName;
+    // enqueued_at (epoch seconds) lets the worker measure queue dwell time.
+    const message = {
+      ...payload,
+      ...(lane ? { lane } : {}),
+      ...(policy_id ? { policy_id } : {}),
+      enqueued_at: Date.now() / 1000,
+    };
+    await this.redis.lpush(key, JSON.stringify(message));
+    logger.info('Enqueued document job', {
+      job_id: job.job_id,
+      request_id: job.request_id,
+      lane: lane ?? null,
+      policy_id: policy_id ?? null,
+    });
   }
 }
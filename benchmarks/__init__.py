@@ -0,0 +1 @@
+# Worker benchmarks and load-test tooling (not shipped in the worker image).
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from benchmarks.fakes import InMemoryQueue, InMemoryRepository
+from benchmarks.synthetic import PLACEMENTS, generate_note
+
+# Worker modules log to stdout on import (policy catalog load); keep stdout for the JSON report.
+with contextlib.redirect_stdout(sys.stderr):
+    from worker.app import main
+    from worker.app.cache import ResultCache
+    from worker.app.logger import logger
+    from worker.app.policy import policy_registry
+    from worker.app.processor import evaluate_policy, extract_evidence, stage_ocr
+    logger.flush()
+
+
+def summarize(name: str, samples: List[float], size_chars: int, placement: str) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    mean = statistics.fmean(ordered)
+    return {
+        "name": name,
+        "size_chars": size_chars,
+        "placement": placement,
+        "repeat": len(ordered),
+        "mean_ms": round(mean * 1000, 4),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        "min_ms": round(ordered[0] * 1000, 4),
+        "ops_per_s": round(1 / mean, 2) if mean else None,
+        "mb_per_s": round(size_chars / mean / 1e6, 2) if mean else None,
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> List[float]:
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def measure_process_message(note: str, repeat: int) -> List[float]:
+    # Full process_message against in-memory Redis/Postgres stand-ins; every job carries a
+    # distinct document so the result cache never short-circuits the pipeline.
+    main.repo = InMemoryRepository()  # type: ignore[assignment]
+    main.queue = InMemoryQueue()  # type: ignore[assignment]
+    main.result_cache = ResultCache(0, 0)
+    samples = []
+    for idx in range(repeat + 1):
+        payload = main.repo.add_job(f"{note}\nRef {idx}")  # type: ignore[union-attr]
+        start = time.perf_counter()
+        await main.process_message(payload)
+        if idx:
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def line_scan_extract(note: str, fields: Dict[str, List[str]]) -> Dict[str, int]:
+    # The baseline extractor's scan, kept as the floor extract_evidence is gated against: strip
+    # the lines, then per field the first line whose lowercased text contains one of its patterns.
+    lines = [ln.strip() for ln in note.splitlines() if ln.strip()]
+    found = {}
+    for name, patterns in fields.items():
+        for idx, line in enumerate(lines):
+            if any(pat in line.lower() for pat in patterns):
+                found[name] = idx + 1
+                break
+    return found
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+BENCHMARKS = ("stage_ocr", "extract_evidence", "extract_line_scan", "evaluate_policy", "process_message")
+
+
+def run(
+    sizes: List[int], placements: List[str], repeat: int, policy_id: str, benchmarks: Sequence[str] = BENCHMARKS
+) -> Dict[str, Any]:
+    plan = policy_registry.get(policy_id)
+    patterns = [p for field_patterns in plan.matcher.fields.values() for p in field_patterns]
+    results = []
+    for size in sizes:
+        for placement in placements:
+            note = generate_note(size, PLACEMENTS[placement], patterns=patterns)
+            evidence, _, missing = extract_evidence(note, plan)
+            timed: Dict[str, Callable[[], Any]] = {
+                "stage_ocr": lambda: stage_ocr(note),
+                "extract_evidence": lambda: extract_evidence(note, plan),
+                "extract_line_scan": lambda: line_scan_extract(note, plan.matcher.fields),
+                "evaluate_policy": lambda: evaluate_policy(evidence, list(missing), plan),
+            }
+            for name in BENCHMARKS:
+                if name not in benchmarks:
+                    continue
+                if name == "process_message":
+                    samples = asyncio.run(measure_process_message(note, repeat))
+                else:
+                    samples = measure(timed[name], repeat)
+                results.append(summarize(name, samples, size, placement))
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "policy": plan.key,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def _keyed(report: Dict[str, Any]) -> Dict[Tuple[str, int, str], Dict[str, Any]]:
+    return {(r["name"], r["size_chars"], r["placement"]): r for r in report["results"]}
+
+
+def below_floor(current: Dict[str, Any], threshold: float) -> List[str]:
+    # Returns one line per note where extract_evidence is slower than `threshold` x the baseline
+    # line scan timed on the same note in the same run, so the check holds on any machine.
+    results = _keyed(current)
+    regressions = []
+    for (name, size, placement), result in results.items():
+        floor = results.get(("extract_line_scan", size, placement))
+        if name != "extract_evidence" or not floor or not floor["mean_ms"]:
+            continue
+        ratio = result["mean_ms"] / floor["mean_ms"]
+        if ratio > threshold:
+            regressions.append(
+                f"extract_evidence size={size} placement={placement}: {result['mean_ms']}ms vs line scan "
+                f"{floor['mean_ms']}ms (x{ratio:.2f})"
+            )
+    return regressions
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    # Returns one line per benchmark whose mean got slower than `threshold` x the baseline.
+    old = _keyed(baseline)
+    regressions = []
+    for key, result in _keyed(current).items():
+        before = old.get(key)
+        if not before or not before["mean_ms"]:
+            continue
+        ratio = result["mean_ms"] / before["mean_ms"]
+        if ratio > threshold:
+            name, size, placement = key
+            regressions.append(
+                f"{name} size={size} placement={placement}: {before['mean_ms']}ms -> {result['mean_ms']}ms (x{ratio:.2f})"
+            )
+    return regressions
+
+
+def main_cli(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the worker pipeline on synthetic notes.")
+    parser.add_argument("--sizes", default="10000,200000,2000000", help="comma-separated note sizes in characters")
+    parser.add_argument("--placements", default="start,middle,end", help=f"evidence placement: {','.join(PLACEMENTS)}")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--policy", default=policy_registry.default_policy)
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma-separated benchmarks to run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument(
+        "--compare",
+        nargs="?",
+        const="",
+        help="baseline JSON report to check for regressions; extract_evidence is also checked against the "
+        "baseline line scan on the same notes (alone when no report is given)",
+    )
+    parser.add_argument("--threshold", type=float, default=1.2, help="mean-time ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    placements = [p for p in args.placements.split(",") if p]
+    benchmarks = [name for name in args.benchmarks.split(",") if name]
+    unknown = sorted(set(benchmarks) - set(BENCHMARKS))
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    # The worker logs JSON to stdout on every job; keep it out of the report.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        report = run(sizes, placements, args.repeat, args.policy, benchmarks)
+        logger.flush()
+
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(encoded + "\n")
+    else:
+        print(encoded)
+
+    if args.compare is not None:
+        regressions = below_floor(report, args.threshold)
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as fh:
+                regressions += compare(report, json.load(fh), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
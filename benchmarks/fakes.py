@@ -0,0 +1,165 @@
+import asyncio
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+
+class InMemoryRepository:
+    # Stand-in for worker.app.repository.Repository with the methods process_message uses.
+    # `latency` (seconds, plus up to `jitter` more) is awaited on every call to mimic a database
+    # round-trip. Each claim hands back a failing document with probability `retryable_rate`
+    # (OCR fails, so the job is retried) or `fatal_rate` (empty document, so it fails for good);
+    # the real document is returned again on the next claim.
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        retryable_rate: float = 0.0,
+        fatal_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.retryable_rate = retryable_rate
+        self.fatal_rate = fatal_rate
+        self.random = random.Random(seed)
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.documents: Dict[str, str] = {}
+        self.requests: Dict[str, str] = {}
+        self.packs: List[Dict[str, Any]] = []
+        self.audit: List[str] = []
+        self.calls: Dict[str, int] = {}
+
+    async def _round_trip(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def add_job(self, text: str, request_id: Optional[str] = None) -> Dict[str, Any]:
+        job_id = str(uuid.uuid4())
+        request_id = request_id or str(uuid.uuid4())
+        self.jobs[job_id] = {
+            "job_id": job_id,
+            "request_id": request_id,
+            "status": "queued",
+            "attempts": 0,
+            "trace_id": str(uuid.uuid4()),
+            "last_error": None,
+            "created_at": time.monotonic(),
+            "finished_at": None,
+        }
+        self.documents[job_id] = text
+        self.requests[request_id] = "pending"
+        return {"job_id": job_id, "request_id": request_id}
+
+    async def claim_job(self, job_id: str, request_id: str):
+        await self._round_trip("claim_job")
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        content = self.documents.get(job_id)
+        if job["status"] != "completed" and (self.retryable_rate or self.fatal_rate):
+            roll = self.random.random()
+            if roll < self.fatal_rate:
+                content = ""
+            elif roll < self.fatal_rate + self.retryable_rate:
+                content = "FAIL_OCR"
+        row = dict(job, content=content, content_bytes=len(content.encode()) if content is not None else None)
+        if job["status"] != "completed":
+            job["attempts"] += 1
+            job["status"] = "processing"
+            self.requests[request_id] = "processing"
+        return row
+
+    async def complete_job(
+        self, job_id, request_id, decision, explanation, metadata, evidence, sources, missing_fields,
+        audit_action="EVIDENCE_PACK_CREATED", merge=None,
+    ):
+        # Packs are not kept, so there is never a prior to merge into.
+        await self._round_trip("complete_job")
+        pack_id = str(uuid.uuid4())
+        self.packs.append({"pack_id": pack_id, "request_id": request_id, "decision": decision})
+        self.jobs[job_id].update(status="completed", finished_at=time.monotonic())
+        self.requests[request_id] = "completed"
+        self.audit.append(audit_action)
+        return pack_id
+
+    async def iter_document(self, job_id: str, chunk_chars: int = 262144):
+        text = self.documents.get(job_id) or ""
+        for start in range(0, len(text), chunk_chars):
+            await self._round_trip("iter_document")
+            yield text[start : start + chunk_chars]
+
+    async def mark_failed(self, job_id: str, error: str):
+        await self._round_trip("mark_failed")
+        self.jobs[job_id].update(status="failed", last_error=error, finished_at=time.monotonic())
+
+    async def reset_to_queue(self, job_id: str, error: str):
+        await self._round_trip("reset_to_queue")
+        self.jobs[job_id]["status"] = "queued"
+        self.jobs[job_id]["last_error"] = error
+
+    async def set_request_status(self, request_id: str, status: str):
+        await self._round_trip("set_request_status")
+        self.requests[request_id] = status
+
+    async def append_audit(self, request_id: str, actor: str, action: str, metadata=None):
+        await self._round_trip("append_audit")
+        self.audit.append(action)
+
+
+class InMemoryQueue:
+    # Stand-in for worker.app.queue.QueueClient: FIFO main queue, DLQ and delayed retries that
+    # promote_due moves back once due. A blocked pop wakes as soon as something is pushed.
+
+    def __init__(self):
+        self.items: List[Dict[str, Any]] = []
+        self.dlq: List[Dict[str, Any]] = []
+        self.delayed: List[Any] = []
+        self.reliable = False
+        self._pushed = asyncio.Event()
+
+    def lane_of(self, payload: Dict[str, Any]) -> str:
+        return payload.get("lane", "standard")
+
+    async def push(self, payload: Dict[str, Any]):
+        self.items.append({**payload, "enqueued_at": time.time()})
+        self._pushed.set()
+
+    async def pop_batch(self, count: int, timeout: float = 5) -> List[Dict[str, Any]]:
+        if not self.items:
+            self._pushed.clear()
+            try:
+                await asyncio.wait_for(self._pushed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        batch, self.items = self.items[:count], self.items[count:]
+        return batch
+
+    async def requeue_unstarted(self, payloads: List[Dict[str, Any]]):
+        self.items[:0] = payloads
+        self._pushed.set()
+
+    async def pop(self, timeout: int = 5) -> Optional[Dict[str, Any]]:
+        batch = await self.pop_batch(1, timeout)
+        return batch[0] if batch else None
+
+    async def schedule_retry(self, payload: Dict[str, Any], delay: float):
+        self.delayed.append((time.monotonic() + delay, payload))
+
+    async def promote_due(self) -> int:
+        now = time.monotonic()
+        due = [payload for at, payload in self.delayed if at <= now]
+        self.delayed = [(at, payload) for at, payload in self.delayed if at > now]
+        for payload in due:
+            await self.push(payload)
+        return len(due)
+
+    async def push_dlq(self, payload: Dict[str, Any]):
+        self.dlq.append(payload)
+
+    async def ack(self, payload: Dict[str, Any]):
+        return None
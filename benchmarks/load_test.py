@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.bench_worker import git_revision
+from benchmarks.fakes import InMemoryQueue, InMemoryRepository
+from benchmarks.synthetic import PLACEMENTS, generate_note
+
+with contextlib.redirect_stdout(sys.stderr):
+    from worker.app import main
+    from worker.app.cache import ResultCache
+    from worker.app.concurrency import AdaptiveLimiter
+    from worker.app.config import CONCURRENCY_MAX, CONCURRENCY_MIN, MAX_CONCURRENCY, PIPELINE_WORKERS
+    from worker.app.executor import PipelineExecutor
+    from worker.app.logger import logger
+    from worker.app.policy import policy_registry
+    from worker.app.prefetch import Prefetcher
+    from worker.app.processor import run_timed_pipeline
+    from worker.app.ratelimit import TokenBucket
+    logger.flush()
+
+
+def percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 2)
+
+
+async def run_load(
+    rate: float,
+    duration: float,
+    doc_chars: int = 5000,
+    concurrency: int = MAX_CONCURRENCY,
+    adaptive: bool = False,
+    executor: str = "inline",
+    workers: int = PIPELINE_WORKERS,
+    rate_limit: float = 0.0,
+    db_latency: float = 0.002,
+    db_jitter: float = 0.0,
+    retryable_rate: float = 0.0,
+    fatal_rate: float = 0.0,
+    sample_interval: float = 0.5,
+    drain_timeout: float = 30.0,
+    seed: Optional[int] = 1,
+) -> Dict[str, Any]:
+    # Runs the real worker_loop / process_message against in-memory Redis and Postgres stand-ins:
+    # jobs arrive open-loop at `rate` per second for `duration` seconds, then the worker drains
+    # (for at most `drain_timeout`). Latency is arrival to completion, so it includes queueing.
+    plan = policy_registry.get()
+    patterns = [p for field_patterns in plan.matcher.fields.values() for p in field_patterns]
+    note = generate_note(doc_chars, PLACEMENTS["middle"], patterns=patterns)
+
+    repo = InMemoryRepository(db_latency, db_jitter, retryable_rate, fatal_rate, seed)
+    queue = InMemoryQueue()
+    main.repo = repo  # type: ignore[assignment]
+    main.queue = queue  # type: ignore[assignment]
+    # A short pop wait: stopping lets a pending pop finish, and the run ends with an idle queue.
+    main.prefetcher = Prefetcher(queue, wait_seconds=0.1)  # type: ignore[arg-type]
+    main.result_cache = ResultCache(0, 0)
+    main.rate_limiter = TokenBucket(rate_limit, max(1, int(rate_limit)))  # type: ignore[assignment]
+    main.limiter = AdaptiveLimiter(
+        concurrency,
+        CONCURRENCY_MIN if adaptive else concurrency,
+        CONCURRENCY_MAX if adaptive else concurrency,
+    )
+    main.pipeline_executor = PipelineExecutor(executor, workers, inline_max_chars=0)
+    main.pipeline_executor.start()
+    if executor != "inline":
+        # Spawn and warm every pool worker before the clock starts.
+        warm = [
+            main.pipeline_executor.run(run_timed_pipeline, note, plan.policy_id, plan.version)
+            for _ in range(workers or os.cpu_count() or 1)
+        ]
+        await asyncio.gather(*warm)
+
+    depth: List[Dict[str, Any]] = []
+    started = time.monotonic()
+
+    async def arrivals():
+        submitted = 0
+        while time.monotonic() - started < duration:
+            due = int((time.monotonic() - started) * rate) + 1
+            while submitted < due:
+                # A distinct document per job keeps any result cache out of the measurement.
+                await queue.push(repo.add_job(f"{note}\nRef {submitted}"))
+                submitted += 1
+            await asyncio.sleep(max(0.0, submitted / rate - (time.monotonic() - started)))
+
+    async def sampler():
+        while True:
+            depth.append(
+                {
+                    "t": round(time.monotonic() - started, 2),
+                    "queued": len(queue.items),
+                    "delayed": len(queue.delayed),
+                    "in_flight": main.limiter.in_flight,
+                    "limit": int(main.limiter.limit),
+                }
+            )
+            await asyncio.sleep(sample_interval)
+
+    def unfinished() -> int:
+        return sum(1 for job in repo.jobs.values() if job["finished_at"] is None)
+
+    tasks = [asyncio.create_task(main.worker_loop()), asyncio.create_task(main.retry_promoter())]
+    tasks.append(asyncio.create_task(sampler()))
+    try:
+        await arrivals()
+        arrivals_done = time.monotonic()
+        while unfinished() and time.monotonic() - arrivals_done < drain_timeout:
+            await asyncio.sleep(0.05)
+        finished = time.monotonic()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await main.prefetcher.stop()
+        main.pipeline_executor.shutdown()
+
+    jobs = list(repo.jobs.values())
+    completed = [job for job in jobs if job["status"] == "completed"]
+    latencies = sorted(job["finished_at"] - job["created_at"] for job in completed)
+    in_window = sum(1 for job in completed if job["finished_at"] - started <= duration)
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "policy": plan.key,
+            "rate": rate,
+            "duration_s": duration,
+            "doc_chars": doc_chars,
+            "concurrency": concurrency,
+            "adaptive": adaptive,
+            "executor": executor,
+            "rate_limit": rate_limit,
+            "db_latency_s": db_latency,
+            "db_jitter_s": db_jitter,
+            "retryable_rate": retryable_rate,
+            "fatal_rate": fatal_rate,
+        },
+        "submitted": len(jobs),
+        "completed": len(completed),
+        "failed": sum(1 for job in jobs if job["status"] == "failed"),
+        "dead_lettered": len(queue.dlq),
+        "retries": repo.calls.get("reset_to_queue", 0),
+        "unfinished": unfinished(),
+        # Throughput while load was offered, and overall including the drain.
+        "sustained_jobs_per_s": round(in_window / duration, 2) if duration else None,
+        "overall_jobs_per_s": round(len(completed) / (finished - started), 2),
+        "drain_s": round(finished - started - duration, 2),
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": round(latencies[-1] * 1000, 2) if latencies else None,
+        },
+        "max_queue_depth": max((sample["queued"] for sample in depth), default=0),
+        "queue_depth": depth,
+    }
+
+
+def main_cli(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the worker loop against in-memory Redis/Postgres.")
+    parser.add_argument("--rate", type=float, default=50, help="job arrivals per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of offered load")
+    parser.add_argument("--doc-chars", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY, help="(starting) concurrency limit")
+    parser.add_argument("--adaptive", action="store_true", help="let the limit move between CONCURRENCY_MIN/MAX")
+    parser.add_argument("--executor", default="inline", help="pipeline executor: inline, thread or process")
+    parser.add_argument("--workers", type=int, default=PIPELINE_WORKERS, help="pipeline pool size (0 = one per CPU)")
+    parser.add_argument("--rate-limit", type=float, default=0, help="token bucket jobs/s (0 = unlimited)")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="seconds per repository call")
+    parser.add_argument("--db-jitter", type=float, default=0.0, help="extra random seconds per repository call")
+    parser.add_argument("--retryable-rate", type=float, default=0.0, help="share of claims that fail OCR")
+    parser.add_argument("--fatal-rate", type=float, default=0.0, help="share of claims with a missing document")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="seconds between queue depth samples")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    # The worker logs JSON to stdout on every job; keep it out of the report.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        report = asyncio.run(
+            run_load(
+                args.rate,
+                args.duration,
+                args.doc_chars,
+                args.concurrency,
+                args.adaptive,
+                args.executor,
+                args.workers,
+                args.rate_limit,
+                args.db_latency,
+                args.db_jitter,
+                args.retryable_rate,
+                args.fatal_rate,
+                args.sample_interval,
+                args.drain_timeout,
+            )
+        )
+        logger.flush()
+
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(encoded + "\n")
+    else:
+        print(encoded)
+    return 0 if not report["unfinished"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,59 @@
+import random
+from typing import Dict, Iterable, List, Optional
+
+# Filler is screened against every pattern of the active policy at generation time, so the only
+# matches in a generated note are the evidence lines placed on purpose.
+FILLER_SENTENCES = [
+    "Vitals within normal limits; afebrile.",
+    "Reviewed home medications with the nurse.",
+    "Follow up in four weeks or sooner as needed.",
+    "No new complaints since the last visit.",
+    "Lungs clear to auscultation bilaterally.",
+    "Heart regular rate and rhythm, no murmurs.",
+    "Patient was seen with family member present.",
+    "Skin warm and dry, no lesions noted.",
+    "Abdomen soft, non-tender, bowel sounds normal.",
+    "Discussed diet and sleep hygiene.",
+    "Blood pressure rechecked and unchanged.",
+    "Labs from the prior admission were reviewed.",
+]
+
+EVIDENCE_LINES: Dict[str, str] = {
+    "diagnosis": "Dx: Right knee osteoarthritis, Kellgren-Lawrence grade 4.",
+    "conservative_therapy": "Completed 12 weeks of physical therapy with minimal relief.",
+    "imaging_evidence": "X-ray shows joint space narrowing and osteophytes.",
+    "functional_limitation": "Difficulty climbing stairs; cannot walk more than one block.",
+}
+
+PLACEMENTS = {"start": 0.0, "middle": 0.5, "end": 1.0}
+
+
+def clean_filler(patterns: Iterable[str]) -> List[str]:
+    lowered = [p.lower() for p in patterns]
+    filler = [s for s in FILLER_SENTENCES if not any(p in s.lower() for p in lowered)]
+    if not filler:
+        raise ValueError("every filler sentence matches a policy pattern")
+    return filler
+
+
+def generate_note(
+    size_chars: int,
+    placement: float = 0.0,
+    fields: Optional[Iterable[str]] = None,
+    patterns: Iterable[str] = (),
+    seed: int = 0,
+) -> str:
+    # A note of roughly `size_chars` characters with one evidence line per field in `fields`
+    # (all fields by default) clustered at `placement` (0.0 = first line, 1.0 = last lines).
+    rng = random.Random(seed)
+    filler = clean_filler(patterns)
+    evidence = [EVIDENCE_LINES[name] for name in (EVIDENCE_LINES if fields is None else fields)]
+    lines: List[str] = ["Patient: Synthetic Record"]
+    size = len(lines[0]) + 1 + sum(len(line) + 1 for line in evidence)
+    while size < size_chars:
+        line = rng.choice(filler)
+        lines.append(line)
+        size += len(line) + 1
+    at = min(len(lines), max(1, int(round(placement * len(lines)))))
+    lines[at:at] = evidence
+    return "\n".join(lines)
@@ -0,0 +1,2 @@
+-- Request-ordered document scans for the offline backfill
+CREATE INDEX IF NOT EXISTS idx_documents_request ON phi.documents(request_id, created_at, job_id);
@@ -1,7 +1,36 @@
 import asyncio
+import json
+import re
+import threading
+import time
 
-from worker.app import main
-from worker.app.processor import rate_limiter
+import pytest
+from prometheus_client import REGISTRY
+
+from worker.app import main, processor, redrive
+from worker.app.backfill import Backfiller
+from worker.app.concurrency import AdaptiveLimiter
+from worker.app.errors import RetryableError
+from worker.app.evidence import dumps
+from worker.app.executor import PipelineExecutor
+from worker.app.lanes import LaneScheduler
+from worker.app.logger import Logger, LogWriter
+from worker.app.metrics import JobTrace
+from worker.app.ocr import FakeBackend, PageOCR
+from worker.app.policy import PolicyRegistry, policy_registry
+from worker.app.prefetch import Prefetcher
+from worker.app.processor import (
+    evaluate_policy,
+    extract_evidence,
+    extract_with_guardrails,
+    run_pipeline,
+    run_streaming_pipeline,
+    run_timed_pipeline,
+)
+from worker.app.queue import QueueClient
+from worker.app.ratelimit import TokenBucket
+from worker.app.redrive import Redriver
+from worker.app.repository import Completion, Repository, WriteBatcher, merge_into_latest
 
 
 class FakeRepo:
@@ -12,29 +41,36 @@ class FakeRepo:
         self.packs = []
         self.audit = []
         self.request_status = None
+        self.pack_ids = []
+        self.metadata = None
+        # Stands in for the database behind merge_into_latest; priors holds the latest pack.
+        self.pool = FakePool()
 
-    async def get_job(self, job_id: str):
-        return self.job
-
-    async def ensure_request_processing(self, request_id: str):
-        self.request_status = "processing"
-
-    async def increment_attempt(self, job_id: str):
-        self.job["attempts"] += 1
-        self.job["status"] = "processing"
-
-    async def load_document(self, job_id: str):
-        return self.doc
+    async def claim_job(self, job_id: str, request_id: str):
+        # Same columns as Repository.claim_job; the latest pack is read at write time.
+        row = dict(self.job, content=self.doc, content_bytes=len(self.doc.encode()) if self.doc else None)
+        if self.job["status"] != "completed":
+            self.job["attempts"] += 1
+            self.job["status"] = "processing"
+            self.request_status = "processing"
+        return row
 
-    async def write_evidence_pack(self, request_id, decision, explanation, metadata, evidence, sources, missing_fields):
-        self.packs.append(decision)
-        return "pack-1", decision
-
-    async def mark_completed(self, job_id: str):
+    async def complete_job(
+        self, job_id, request_id, decision, explanation, metadata, evidence, sources, missing_fields,
+        audit_action="EVIDENCE_PACK_CREATED", merge=None,
+    ):
+        item = Completion(
+            job_id, request_id, decision, explanation, metadata, evidence, sources, missing_fields, audit_action, merge
+        )
+        await merge_into_latest(FakeConn(self.pool), [item])
+        self.pool.priors = [dict(item.as_prior(), request_id=request_id)]
+        self.packs.append(item.decision)
+        self.pack_ids.append(str(item.pack_id))
+        self.metadata = item.metadata
         self.job["status"] = "completed"
-
-    async def append_audit(self, request_id: str, actor: str, action: str, metadata=None):
-        self.audit.append(action)
+        self.request_status = "completed"
+        self.audit.append(audit_action)
+        return str(item.pack_id)
 
     async def mark_failed(self, job_id: str, error: str):
         self.job["status"] = "failed"
@@ -52,18 +88,24 @@ class FakeQueue:
     def __init__(self):
         self.sent = []
         self.dlq = []
+        self.delayed = []
 
     async def push(self, payload):
         self.sent.append(payload)
 
+    async def schedule_retry(self, payload, delay):
+        self.delayed.append((payload, delay))
+
     async def push_dlq(self, payload):
         self.dlq.append(payload)
 
+    def lane_of(self, payload):
+        return payload.get("lane", "standard")
+
 
 def setup_globals(repo, queue):
     main.repo = repo
     main.queue = queue
-    rate_limiter.events.clear()
 
 
 def test_idempotency_skip_completed():
@@ -84,3 +126,1174 @@ def test_retry_to_dlq_after_max_attempts():
     asyncio.run(main.process_message({"job_id": "job-1", "request_id": "req-1"}))
     assert repo.job["status"] == "failed"
     assert len(queue.dlq) == 1
+
+
+SAMPLE_NOTE = (
+    "Patient: John Doe\n"
+    "Dx: Knee pain, suspected osteoarthritis.\n"
+    "Imaging: X-ray shows joint space narrowing and osteophytes.\n"
+    "Therapy: Trial of NSAIDs for 3 weeks. No documented physical therapy.\n"
+    "Function: Difficulty climbing stairs; cannot walk > 1 block; ADLs impacted.\n"
+    "Plan: Requesting total knee arthroplasty."
+)
+
+
+def line_scan_first_hits(fields, lines):
+    # The baseline extractor's loop: the first line whose lowercased text contains a pattern;
+    # abbreviations (3 alphanumerics or fewer) only as whole words, plural "s" allowed. Within
+    # that line, the leftmost occurrence and, at that offset, the longest pattern.
+    hits = {}
+    for field, patterns in fields.items():
+        for idx, line in enumerate(lines):
+            low = line.lower()
+            spans = []
+            for pat in patterns:
+                pat = pat.lower()
+                if len(pat) <= 3 and pat.isalnum():
+                    spans += [m.span() for m in re.finditer(r"\b" + re.escape(pat) + r"s?\b", low)]
+                else:
+                    at = low.find(pat)
+                    while at != -1:
+                        spans.append((at, at + len(pat)))
+                        at = low.find(pat, at + 1)
+            if spans:
+                start = min(lo for lo, _ in spans)
+                end = max(hi for lo, hi in spans if lo == start)
+                hits[field] = (idx + 1, line, start, end)
+                break
+    return hits
+
+
+MATCHER_NOTES = [
+    SAMPLE_NOTE,
+    "Symptoms reviewed at the department visit.\nAdapted gait noted.\nPT twice weekly.\nPts notes: PT again.",
+    "PHYSICAL THERAPY completed.\nPhysical Therapy repeated; physical therapy again.\nMRI and mri and Mri.\n"
+    "X-RAY of knee; xray repeated.\nDifficulty with ADLs, cannot kneel, LIMITED range.\n"
+    "OSTEOARTHRITIS of knee; knee pain; Knee Pain.\nNSAIDs and nsaid trial.",
+    "Activities of Daily Living affected.\nMri pending, CTs reviewed.\nOrthopedic consult; acts normally.",
+]
+
+
+@pytest.mark.parametrize("note", MATCHER_NOTES)
+def test_matcher_first_hits_match_line_scan(note):
+    plan = policy_registry.get("tka")
+    lines = [ln.strip() for ln in note.splitlines() if ln.strip()]
+    assert plan.matcher.first_hits(lines) == line_scan_first_hits(plan.matcher.fields, lines)
+
+
+def test_sample_note_needs_physical_therapy():
+    evidence, sources, missing = extract_with_guardrails(SAMPLE_NOTE)
+    decision, _, missing = evaluate_policy(evidence, missing)
+    assert decision == "NEEDS_MORE_INFO"
+    assert missing == ["conservative_therapy"]
+    assert sources["conservative_therapy"]["line"] == 4
+
+
+def test_negated_mentions_do_not_hide_later_evidence():
+    note = SAMPLE_NOTE.replace(
+        "Plan: Requesting total knee arthroplasty.",
+        "Update: Completed 8 weeks of physical therapy without relief.\nPlan: Requesting total knee arthroplasty.",
+    )
+    evidence, sources, missing = extract_with_guardrails(note)
+    assert evidence["conservative_therapy"]["attempted"] is True
+    assert sources["conservative_therapy"]["line"] == 6
+    assert evaluate_policy(evidence, missing)[0] == "APPROVE"
+
+    plan = policy_registry.get("tka")
+    lines = ["Knee MRI was not done.", "Mobility: denies difficulty, but cannot walk far."]
+    evidence, _, missing = plan.extract(lines)
+    assert evidence["imaging_evidence"] is False
+    assert evidence["functional_limitation"] is True
+    assert "imaging_evidence" in missing
+
+
+def test_negation_regressions_keep_baseline_decisions():
+    plan = policy_registry.get("tka")
+    # "pt" no longer matches inside "symptoms", so a negated PT note stays pending.
+    note = SAMPLE_NOTE.replace("Plan:", "Symptoms worsening over 6 months.\nPlan:")
+    evidence, _, missing = extract_with_guardrails(note)
+    assert evidence["conservative_therapy"]["attempted"] is False
+    assert evaluate_policy(evidence, missing)[0] == "NEEDS_MORE_INFO"
+
+    # Therapy that failed was still attempted.
+    for line in (
+        "No relief with physical therapy.",
+        "Did not improve with PT.",
+        "No improvement after physical therapy and NSAIDs",
+        "Knee pain not relieved by 8 weeks of PT.",
+    ):
+        evidence, _, _ = plan.extract([line])
+        assert evidence["conservative_therapy"]["attempted"] is True, line
+
+    # A comma ends the negation scope.
+    evidence, _, _ = plan.extract(["MRI: no fracture, moderate osteoarthritis"])
+    assert evidence["diagnosis"] == "osteoarthritis"
+    assert plan.matcher.first_hits(["Functional decline noted."]) == {}
+
+    # A post-negation reaches back across one label separator to the label it negates.
+    for line in ("Physical therapy: not done.", "PT - declined by patient", "PT: none"):
+        evidence, _, missing = plan.extract([line])
+        assert evidence["conservative_therapy"]["attempted"] is False, line
+        assert "conservative_therapy" in missing, line
+    evidence, _, _ = plan.extract(["Physical therapy: completed. Imaging: not done"])
+    assert evidence["conservative_therapy"]["attempted"] is True
+    assert evidence["imaging_evidence"] is False
+
+    # "without difficulty" documents the absence of a limitation.
+    evidence, _, missing = plan.extract(["Walks without difficulty."])
+    assert evidence["functional_limitation"] is False
+    assert "functional_limitation" in missing
+
+
+def test_citations_cite_the_line_and_hits_index_the_original_line():
+    note = SAMPLE_NOTE.replace("No documented physical therapy.", "Completed 6 weeks of physical therapy.")
+    evidence, sources, _ = extract_with_guardrails(note)
+    citation = sources["conservative_therapy"]
+    assert citation == {"line": 4, "text": evidence["conservative_therapy"]["detail"]}
+    assert json.loads(dumps(sources))["conservative_therapy"] == citation
+
+    # Hit offsets index the original line even where lowercasing changes its length ("İ" -> "i̇").
+    plan = policy_registry.get("tka")
+    hits = plan.matcher.first_hits(["HİSTORY: MRI shows osteoarthritis"])
+    for name, expected in (("imaging_evidence", "MRI"), ("diagnosis", "osteoarthritis")):
+        _, line, start, end = hits[name]
+        assert line[start:end] == expected
+
+
+def test_registry_loads_new_policy_without_restart(tmp_path):
+    registry = PolicyRegistry(str(tmp_path), "tka", refresh_seconds=0)
+    assert registry.keys() == []
+    spec = {
+        "policy_id": "mri_lumbar",
+        "version": 2,
+        "fields": [
+            {"name": "back_pain", "type": "flag", "patterns": ["back pain"]},
+            {"name": "therapy", "type": "flag", "patterns": ["physical therapy"]},
+            {"name": "injection", "type": "flag", "patterns": ["injection"]},
+        ],
+        "requirements": {"all_of": ["back_pain"], "any_of": [["therapy", "injection"]]},
+    }
+    (tmp_path / "mri_lumbar.v2.json").write_text(json.dumps(spec))
+    plan = registry.get("mri_lumbar")
+    assert plan.key == "mri_lumbar@v2"
+    evidence, _, missing = plan.extract(["Low back pain for 8 weeks", "Epidural injection in May"])
+    assert plan.evaluate(evidence, missing)[0] == "APPROVE"
+
+
+class FakeRedis:
+    def __init__(self):
+        self.lists = {}
+        self.zsets = {}
+
+    def register_script(self, script):
+        async def reclaim(keys, args):
+            lane_keys = dict(zip(args[2:], keys[4:]))
+            moved = self.lists.pop(keys[0], [])
+            for raw in moved:
+                lane = json.loads(raw).get("lane")
+                self.lists.setdefault(lane_keys.get(lane, keys[1]), []).append(raw)
+            self.lists.setdefault(keys[0], [])
+            return len(moved)
+
+        if "SREM" in script:
+            return reclaim
+
+        async def promote_due(keys, args):
+            retry_key, queue_key = keys
+            now, limit = args
+            members = self.zsets.get(retry_key, {})
+            due = sorted((score, member) for member, score in members.items() if score <= now)[:limit]
+            for _, member in due:
+                del members[member]
+                await self.lpush(queue_key, member)
+            return len(due)
+
+        return promote_due
+
+    async def blmove(self, source, destination, timeout, src, dest):
+        items = self.lists.get(source)
+        if not items:
+            return None
+        value = items.pop()
+        self.lists.setdefault(destination, []).insert(0, value)
+        return value
+
+    async def lmove(self, source, destination, src, dest):
+        return await self.blmove(source, destination, 0, src, dest)
+
+    async def lrem(self, name, count, value):
+        items = self.lists.get(name, [])
+        if value in items:
+            items.remove(value)
+            return 1
+        return 0
+
+    async def zadd(self, name, mapping):
+        self.zsets.setdefault(name, {}).update(mapping)
+
+    async def lpush(self, name, *values):
+        for value in values:
+            self.lists.setdefault(name, []).insert(0, value)
+
+    async def rpush(self, name, *values):
+        self.lists.setdefault(name, []).extend(values)
+
+    async def delete(self, *names):
+        for name in names:
+            self.lists.pop(name, None)
+
+    async def llen(self, name):
+        return len(self.lists.get(name, []))
+
+    async def lindex(self, name, index):
+        items = self.lists.get(name, [])
+        return items[index] if -len(items) <= index < len(items) else None
+
+    async def rpop(self, name, count=None):
+        items = self.lists.get(name, [])
+        popped = [items.pop() for _ in range(min(count or 1, len(items)))]
+        return popped if count else (popped[0] if popped else None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def blmpop(self, timeout, numkeys, *keys, direction, count=1):
+        for key in keys:
+            items = self.lists.get(key)
+            if items:
+                popped = [items.pop() for _ in range(min(count, len(items)))]
+                return [key, popped]
+        return None
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+        return lambda *args, **kwargs: self.calls.append(method(*args, **kwargs))
+
+    async def execute(self):
+        return [await call for call in self.calls]
+
+
+def test_pop_batch_returns_fifo_payloads_in_one_call():
+    client = QueueClient(FakeRedis())
+
+    async def run():
+        for idx in range(5):
+            await client.push({"job_id": f"job-{idx}"})
+        await client.redis.lpush(client.queue_name, "not-json")
+        first = await client.pop_batch(3, timeout=0)
+        rest = await client.pop_batch(10, timeout=0)
+        empty = await client.pop_batch(10, timeout=0)
+        return first, rest, empty
+
+    first, rest, empty = asyncio.run(run())
+    assert [p["job_id"] for p in first] == ["job-0", "job-1", "job-2"]
+    assert [p["job_id"] for p in rest] == ["job-3", "job-4"]
+    assert empty == []
+
+
+class FakeConn:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def transaction(self, readonly=False):
+        return FakeTransaction(self.pool)
+
+    def cursor(self, query, after, stream_threshold, prefetch):
+        self.pool.statements.append(("cursor", query, (after,)))
+        return _FakeCursor([row for row in self.pool.documents if after is None or row["request_id"] > after])
+
+    async def execute(self, query, *args):
+        if self.pool.fail_on and any(self.pool.fail_on in str(arg) for arg in args):
+            raise RuntimeError("constraint violation")
+        self.pool.statements.append(("execute", query, args))
+
+    async def executemany(self, query, rows):
+        self.pool.statements.append(("executemany", query, rows))
+
+    async def fetch(self, query, *args):
+        self.pool.statements.append(("fetch", query, args))
+        return [row for row in self.pool.priors if row["request_id"] in args[0]]
+
+
+class _FakeCursor:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeTransaction:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        self.pool.transactions += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.pool.rollbacks += 1
+
+
+class FakePool:
+    def __init__(self, fail_on=None, priors=(), documents=()):
+        self.fail_on = fail_on
+        self.priors = list(priors)
+        self.documents = list(documents)
+        self.statements = []
+        self.transactions = 0
+        self.rollbacks = 0
+
+    def acquire(self):
+        pool = self
+
+        class _Acquire:
+            async def __aenter__(self):
+                return FakeConn(pool)
+
+            async def __aexit__(self, exc_type, exc, tb):
+                return False
+
+        return _Acquire()
+
+
+def make_completion(idx):
+    return Completion(f"job-{idx}", f"req-{idx}", "APPROVE", "ok", {}, {"diagnosis": "x"}, {}, [], "EVIDENCE_PACK_CREATED")
+
+
+def test_write_batcher_coalesces_concurrent_jobs():
+    pool = FakePool()
+
+    async def run():
+        batcher = WriteBatcher(pool, max_batch=10, flush_interval=0.01)
+        batcher.start()
+        pack_ids = await asyncio.gather(*(batcher.submit(make_completion(idx)) for idx in range(3)))
+        await batcher.stop()
+        return pack_ids
+
+    pack_ids = asyncio.run(run())
+    assert len(set(pack_ids)) == 3
+    assert pool.transactions == 1
+    pack_insert = pool.statements[0]
+    assert "core.evidence_packs" in pack_insert[1]
+    assert pack_insert[2][1] == ["req-0", "req-1", "req-2"]
+
+
+def test_write_batcher_isolates_failing_job():
+    pool = FakePool(fail_on="req-1")
+
+    async def run():
+        batcher = WriteBatcher(pool, max_batch=10, flush_interval=0.01)
+        batcher.start()
+        results = await asyncio.gather(
+            *(batcher.submit(make_completion(idx)) for idx in range(3)), return_exceptions=True
+        )
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert isinstance(results[1], RuntimeError)
+    assert isinstance(results[0], str) and isinstance(results[2], str)
+    assert pool.transactions == 4
+
+
+def test_shutdown_drains_running_jobs_and_late_writes_still_land(monkeypatch):
+    monkeypatch.setattr(main, "in_flight", set())
+    pool = FakePool()
+    finished = []
+
+    async def job(seconds):
+        await asyncio.sleep(seconds)
+        finished.append(seconds)
+
+    async def run():
+        for seconds in (0.01, 5):
+            task = asyncio.create_task(job(seconds))
+            main.in_flight.add(task)
+            task.add_done_callback(main.in_flight.discard)
+        cancelled = await main.drain_in_flight(timeout=0.2)
+        batcher = WriteBatcher(pool, max_batch=10, flush_interval=0.01)
+        batcher.start()
+        await batcher.stop()
+        late = await asyncio.wait_for(batcher.submit(make_completion(0)), 1)
+        return cancelled, late
+
+    cancelled, late = asyncio.run(run())
+    assert finished == [0.01]
+    assert cancelled == 1 and not main.in_flight
+    assert isinstance(late, str) and pool.transactions == 1
+
+
+def test_concurrent_documents_of_one_request_merge_in_turn():
+    plan = policy_registry.get("tka")
+    evidence, sources, _ = plan.extract(["Dx: knee osteoarthritis.", "X-ray shows narrowing."])
+    prior = {
+        "request_id": "req-1",
+        "prior_pack_id": "pack-0",
+        "prior_policy": plan.key,
+        "prior_evidence": dumps(evidence),
+        "prior_sources": dumps(sources),
+    }
+    pool = FakePool(priors=[prior])
+
+    def completion(job_id, line):
+        evidence, sources, missing = plan.extract([line])
+        decision, explanation, missing = plan.evaluate(evidence, missing)
+        merge = main.request_merge(plan, evidence, sources, missing)
+        return Completion(
+            job_id, "req-1", decision, explanation, {"policy": plan.key}, evidence, sources, missing,
+            "EVIDENCE_PACK_CREATED", merge,
+        )
+
+    async def run():
+        batcher = WriteBatcher(pool, max_batch=10, flush_interval=0.01)
+        batcher.start()
+        pack_ids = await asyncio.gather(
+            batcher.submit(completion("job-1", "Completed 6 weeks of physical therapy.")),
+            batcher.submit(completion("job-2", "Cannot climb stairs.")),
+        )
+        await batcher.stop()
+        return pack_ids
+
+    pack_ids = asyncio.run(run())
+    queries = [statement[1] for statement in pool.statements]
+    assert "FOR UPDATE" in queries[0]
+    packs = next(args for kind, query, args in pool.statements if "INSERT INTO core.evidence_packs" in query)
+    assert packs[2] == ["NEEDS_MORE_INFO", "APPROVE"]
+    assert [json.loads(meta)["merged_from"] for meta in packs[4]] == ["pack-0", pack_ids[0]]
+    details = next(rows for kind, query, rows in pool.statements if kind == "executemany")
+    # The second document merged into the first one's pack, so the latest pack keeps both.
+    last = json.loads(details[1][1])
+    assert last["conservative_therapy"]["attempted"] is True
+    assert last["functional_limitation"] is True
+    assert last["imaging_evidence"] is True
+    assert json.loads(details[1][2])["conservative_therapy"]["pack_id"] == pack_ids[0]
+
+
+def test_pipeline_executor_offloads_large_documents_only():
+    executor = PipelineExecutor("thread", workers=1, inline_max_chars=len(SAMPLE_NOTE))
+    seen_threads = []
+
+    def record(text):
+        seen_threads.append(threading.current_thread().name)
+        return run_pipeline(text)
+
+    async def run():
+        executor.start()
+        small = await executor.run(record, SAMPLE_NOTE)
+        large = await executor.run(record, SAMPLE_NOTE + "\n" + SAMPLE_NOTE)
+        executor.shutdown()
+        return small, large
+
+    small, large = asyncio.run(run())
+    assert small[3] == large[3] == "NEEDS_MORE_INFO"
+    assert seen_threads[0] == "MainThread"
+    assert seen_threads[1].startswith("pipeline")
+
+
+def test_duplicate_document_served_from_result_cache(monkeypatch):
+    calls = []
+
+    def counting_pipeline(text, *args):
+        calls.append(text)
+        return run_timed_pipeline(text, *args)
+
+    monkeypatch.setattr(main, "run_timed_pipeline", counting_pipeline)
+    note = SAMPLE_NOTE + "\nDuplicate fax."
+    for _ in range(2):
+        repo = FakeRepo(status="queued", attempts=0, doc=note)
+        setup_globals(repo, FakeQueue())
+        asyncio.run(main.process_message({"job_id": "job-1", "request_id": "req-1"}))
+        assert repo.packs == ["NEEDS_MORE_INFO"]
+    assert len(calls) == 1
+
+
+def test_stage_timings_reach_histograms_and_trace(monkeypatch):
+    spans = []
+    monkeypatch.setattr(main, "JobTrace", lambda job_id: spans.append(JobTrace(job_id, enabled=True)) or spans[-1])
+    before = REGISTRY.get_sample_value("job_stage_seconds_count", {"stage": "extract"}) or 0
+    lane = {"lane": "standard"}
+    dwell_before = REGISTRY.get_sample_value("job_queue_dwell_seconds_count", lane) or 0
+    repo = FakeRepo(status="queued", attempts=0, doc=SAMPLE_NOTE + "\nTraced.")
+    setup_globals(repo, FakeQueue())
+    asyncio.run(main.process_message({"job_id": "job-1", "request_id": "req-1", "enqueued_at": time.time() - 2}))
+
+    trace = spans[0]
+    assert trace.trace_id == "t1"
+    stages = [span["stage"] for span in trace.spans]
+    assert stages == ["claim", "cache_lookup", "pipeline", "ocr", "extract", "policy", "write"]
+    assert REGISTRY.get_sample_value("job_stage_seconds_count", {"stage": "extract"}) == before + 1
+    assert REGISTRY.get_sample_value("job_queue_dwell_seconds_count", lane) == dwell_before + 1
+    assert REGISTRY.get_sample_value("job_queue_dwell_seconds_sum", lane) >= 2
+
+
+def test_new_document_is_merged_into_request_evidence():
+    repo = FakeRepo(status="queued", attempts=0, doc=SAMPLE_NOTE)
+    setup_globals(repo, FakeQueue())
+    asyncio.run(main.process_message({"job_id": "job-1", "request_id": "req-1"}))
+
+    repo.job.update(job_id="job-2", status="queued", attempts=0)
+    repo.doc = "Follow-up visit\nCompleted 6 weeks of physical therapy."
+    asyncio.run(main.process_message({"job_id": "job-2", "request_id": "req-1"}))
+
+    assert repo.packs == ["NEEDS_MORE_INFO", "APPROVE"]
+    assert repo.metadata["merged_from"] == repo.pack_ids[0]
+    sources = json.loads(repo.pool.priors[0]["prior_sources"])
+    assert sources["conservative_therapy"] == {"line": 2, "text": "Completed 6 weeks of physical therapy."}
+    assert sources["diagnosis"]["pack_id"] == repo.pack_ids[0]
+
+
+def test_retry_is_scheduled_without_sleeping():
+    repo = FakeRepo(status="queued", attempts=0, doc="FAIL_OCR")
+    queue = FakeQueue()
+    setup_globals(repo, queue)
+    asyncio.run(main.process_message({"job_id": "job-1", "request_id": "req-1"}))
+    assert repo.job["status"] == "queued"
+    assert queue.delayed == [({"job_id": "job-1", "request_id": "req-1"}, main.BACKOFF_BASE_SECONDS)]
+    assert queue.sent == []
+
+
+def test_promote_due_moves_only_due_retries():
+    client = QueueClient(FakeRedis())
+
+    async def run():
+        await client.schedule_retry({"job_id": "due"}, delay=-1)
+        await client.schedule_retry({"job_id": "later"}, delay=60)
+        moved = await client.promote_due()
+        return moved, await client.pop_batch(10, timeout=0)
+
+    moved, payloads = asyncio.run(run())
+    assert moved == 1
+    assert [p["job_id"] for p in payloads] == ["due"]
+
+
+def test_token_bucket_waits_instead_of_rejecting():
+    bucket = TokenBucket(rate=50, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() > 0
+
+    async def run():
+        start = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) > 0.005
+
+
+def test_reliable_pop_keeps_payload_in_flight_until_ack():
+    client = QueueClient(FakeRedis(), reliable=True, worker_id="w1")
+
+    async def run():
+        await client.push({"job_id": "job-1"})
+        payload = await client.pop(timeout=0)
+        in_flight = list(client.redis.lists[client.processing_name])
+        await client.ack(payload)
+        return payload, in_flight, client.redis.lists[client.processing_name]
+
+    payload, in_flight, after_ack = asyncio.run(run())
+    assert payload["job_id"] == "job-1"
+    assert payload["enqueued_at"] <= time.time()
+    assert len(in_flight) == 1
+    assert after_ack == []
+
+
+def test_prefetch_buffer_is_bounded_and_returns_unstarted_jobs_on_stop():
+    client = QueueClient(FakeRedis(), reliable=True, worker_id="w1")
+    prefetcher = Prefetcher(client, max_buffer=2, lead_seconds=10, batch_size=10, wait_seconds=0)
+
+    async def settle():
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def run():
+        for idx in range(6):
+            await client.push({"job_id": f"job-{idx}"})
+        prefetcher.start()
+        await settle()
+        # No throughput seen yet: one payload ahead, the rest stays in Redis for other workers.
+        first_fill = len(prefetcher.buffer)
+        taken = [(await prefetcher.get())["job_id"] for _ in range(3)]
+        await settle()
+        buffered = [payload["job_id"] for payload in prefetcher.buffer]
+        returned = await prefetcher.stop()
+        processing = [json.loads(raw)["job_id"] for raw in client.redis.lists[client.processing_name]]
+        following = [(await client.pop(timeout=0))["job_id"] for _ in range(3)]
+        return first_fill, taken, buffered, returned, processing, following
+
+    first_fill, taken, buffered, returned, processing, following = asyncio.run(run())
+    assert first_fill == 1
+    assert taken == ["job-0", "job-1", "job-2"]
+    assert buffered == ["job-3", "job-4"]  # capped at max_buffer
+    assert returned == 2
+    # Requeued payloads left the processing list (taken ones stay until acked) and come out next, in order.
+    assert sorted(processing) == ["job-0", "job-1", "job-2"]
+    assert following == ["job-3", "job-4", "job-5"]
+
+
+def test_prefetch_stop_lets_a_pop_in_progress_land_and_returns_it():
+    class SlowQueue:
+        def __init__(self):
+            self.pops = 0
+            self.requeued = []
+
+        async def pop_batch(self, count, timeout):
+            self.pops += 1
+            await asyncio.sleep(0.05)
+            return [{"job_id": f"job-{self.pops}"}]
+
+        async def requeue_unstarted(self, payloads):
+            self.requeued.extend(payload["job_id"] for payload in payloads)
+
+    queue = SlowQueue()
+    prefetcher = Prefetcher(queue, max_buffer=4, lead_seconds=10, batch_size=1, wait_seconds=1)
+
+    async def run():
+        prefetcher.start()
+        await asyncio.sleep(0.01)  # the first pop is in progress
+        return await prefetcher.stop()
+
+    assert asyncio.run(run()) == 1
+    assert queue.pops == 1 and queue.requeued == ["job-1"]
+
+
+def test_shutdown_stops_prefetching_before_draining(monkeypatch):
+    calls = []
+
+    class Stub:
+        async def stop(self):
+            calls.append("prefetcher.stop")
+
+        def shutdown(self):
+            calls.append("executor.shutdown")
+
+    async def drain():
+        calls.append("drain")
+
+    for name in ("worker_task", "promoter_task", "maintenance_task", "redrive_task", "queue", "repo", "redis", "pool"):
+        monkeypatch.setattr(main, name, None)
+    monkeypatch.setattr(main, "prefetcher", Stub())
+    monkeypatch.setattr(main, "pipeline_executor", Stub())
+    monkeypatch.setattr(main, "drain_in_flight", drain)
+    asyncio.run(main.shutdown_event())
+    assert calls == ["prefetcher.stop", "drain", "executor.shutdown"]
+
+
+def test_shutdown_hands_back_only_jobs_that_never_finished(monkeypatch):
+    client = QueueClient(FakeRedis(), reliable=True, worker_id="w1")
+    monkeypatch.setattr(main, "queue", client)
+    monkeypatch.setattr(main, "limiter", AdaptiveLimiter(2, 2, 2))
+    monkeypatch.setattr(main, "in_flight", set())
+
+    async def fake_process(payload):
+        if payload["job_id"] == "slow":
+            await asyncio.sleep(10)
+        return "completed"
+
+    monkeypatch.setattr(main, "process_message", fake_process)
+
+    async def run():
+        for job_id in ("fast", "slow"):
+            await client.push({"job_id": job_id})
+        for payload in await client.pop_batch(2, timeout=0):
+            await main.limiter.acquire()
+            task = asyncio.create_task(main.handle_payload(payload))
+            main.in_flight.add(task)
+            task.add_done_callback(main.in_flight.discard)
+        await main.drain_in_flight(timeout=0.1)
+        await client.release()
+        return client.redis.lists[client.processing_name], client.redis.lists[client.queue_name]
+
+    processing, queued = asyncio.run(run())
+    assert processing == []
+    assert [json.loads(raw)["job_id"] for raw in queued] == ["slow"]
+    assert main.limiter.in_flight == 0
+
+
+def test_streaming_pipeline_matches_in_memory_and_stops_early():
+    filler = "Vitals stable, afebrile.\r\n" * 2000
+    note = SAMPLE_NOTE.replace("No documented physical therapy.", "Completed 6 weeks of physical therapy.") + "\n" + filler
+    windows = [note[i : i + 97] for i in range(0, len(note), 97)]
+    served = []
+
+    async def chunks():
+        for window in windows:
+            served.append(window)
+            yield window
+
+    plan = policy_registry.get("tka")
+    streamed = asyncio.run(run_streaming_pipeline(chunks(), plan))
+    assert streamed[:5] == run_pipeline(note)[:5]
+    assert streamed[3] == "APPROVE"
+    assert len(served) < len(windows) // 10
+
+
+def test_streaming_pipeline_scans_windows_off_the_event_loop(monkeypatch):
+    note = SAMPLE_NOTE + "\n" + "Vitals stable, afebrile.\n" * 500
+    windows = [note[i : i + 1000] for i in range(0, len(note), 1000)]
+    threads = []
+    scan_window = processor.scan_window
+
+    def recording_scan_window(*args):
+        threads.append(threading.current_thread())
+        return scan_window(*args)
+
+    monkeypatch.setattr(processor, "scan_window", recording_scan_window)
+
+    async def chunks():
+        for window in windows:
+            yield window
+
+    plan = policy_registry.get("tka")
+    executor = PipelineExecutor("thread", 1, inline_max_chars=10**9)
+    executor.start()
+    try:
+        for pool in (executor, None):
+            threads.clear()
+            streamed = asyncio.run(run_streaming_pipeline(chunks(), plan, executor=pool))
+            assert streamed[:5] == run_pipeline(note)[:5]
+            assert threads and threading.main_thread() not in threads
+    finally:
+        executor.shutdown()
+
+
+def test_extraction_stops_once_fields_resolved_and_reports_lines_scanned():
+    note = (
+        "Dx: right knee osteoarthritis.\n"
+        "Completed 8 weeks of physical therapy.\n"
+        "MRI confirms tricompartmental disease.\n"
+        "Cannot climb stairs.\n"
+        "NSAIDs previously.\n"
+    ) + "Routine follow-up, no changes.\n" * 20000
+    stats = {}
+    evidence, _, missing = extract_evidence(note, policy_registry.get("tka"), stats)
+    assert missing == []
+    assert evidence["conservative_therapy"]["attempted"] is True
+    assert stats["lines_read"] < 20000
+    assert stats["lines_scanned"]["conservative_therapy"] == 2
+    # the PT hit makes the NSAID fallback irrelevant, so it stops there too
+    assert stats["lines_scanned"]["conservative_therapy:fallback"] == 2
+
+
+def test_adaptive_limiter_grows_when_saturated_and_backs_off_on_errors():
+    pool_wait = [0.0]
+    limiter = AdaptiveLimiter(2, 1, 8, pool_wait=lambda: pool_wait[0])
+
+    async def run():
+        await limiter.acquire()
+        await limiter.acquire()
+        blocked = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        was_blocked = not blocked.done()
+        limiter.release(0.01)
+        await blocked
+        for _ in range(20):
+            limiter.release(0.01)
+            await limiter.acquire()
+        grown = limiter.limit
+        limiter.release(0.01, failed=True)
+        after_error = limiter.limit
+        await limiter.acquire()
+        limiter._last_decrease = 0.0
+        pool_wait[0] = 1.0
+        limiter.release(0.01)
+        return was_blocked, grown, after_error, limiter.limit
+
+    was_blocked, grown, after_error, after_pool_wait = asyncio.run(run())
+    assert was_blocked
+    assert grown > 3
+    assert after_error == grown * 0.9
+    assert after_pool_wait == after_error * 0.9
+
+
+def test_buffered_logger_filters_samples_and_drops_when_full(capsys):
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_encode(record):
+        if record["message"] == "first":
+            entered.set()
+            release.wait(5)
+        return json.dumps(record)
+
+    log = Logger(level="info", sample_rate=0.0, writer=LogWriter(1, encode=slow_encode))
+    log.debug("below level")
+    log.info("sampled out", sample=True)
+    log.info("first")
+    assert entered.wait(5)
+    log.warn("buffered")
+    log.error("dropped")
+    release.set()
+    log.flush()
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line["message"] for line in lines] == ["first", "buffered", "Log records dropped"]
+    assert lines[-1]["count"] == 1
+
+
+def test_lane_scheduler_shares_by_weight_and_rescues_starving_lanes():
+    scheduler = LaneScheduler([("urgent", 3), ("bulk", 1)], starvation_seconds=30)
+    served = []
+    for _ in range(8):
+        take = scheduler.allocate({"urgent": 100, "bulk": 100}, {}, 1)
+        served.extend(lane for lane, n in take.items() for _ in range(n))
+    assert served == ["urgent"] * 3 + ["bulk"] + ["urgent"] * 3 + ["bulk"]
+
+    assert scheduler.allocate({"urgent": 0, "bulk": 5}, {}, 4) == {"urgent": 0, "bulk": 4}
+    take = scheduler.allocate({"urgent": 100, "bulk": 100}, {"bulk": 45.0}, 2)
+    assert take["bulk"] >= 1
+
+
+def test_pop_batch_routes_lanes_and_retries():
+    client = QueueClient(FakeRedis(), lanes="urgent:3,standard:1", default_lane="standard")
+
+    async def run():
+        for idx in range(3):
+            await client.push({"job_id": f"std-{idx}"})
+            await client.push({"job_id": f"urg-{idx}", "lane": "urgent"})
+        first = await client.pop_batch(4, timeout=0)
+        await client.schedule_retry(first[0], delay=-1)
+        moved = await client.promote_due()
+        return first, moved, client.redis.lists
+
+    first, moved, lists = asyncio.run(run())
+    assert [p["job_id"] for p in first] == ["urg-0", "urg-1", "urg-2", "std-0"]
+    assert [p["lane"] for p in first] == ["urgent"] * 3 + ["standard"]
+    assert moved == 1
+    assert json.loads(lists["document_uploaded:urgent"][0])["job_id"] == "urg-0"
+
+
+class FakeDLQ:
+    def __init__(self, payloads):
+        self.dlq = [json.dumps(p) for p in reversed(payloads)]  # consuming end is the tail
+        self.queued = []
+        self.lock = None
+        self.refreshes = 0
+        self.depths = []
+
+    @property
+    def locked(self):
+        return self.lock is not None
+
+    async def lock_redrive(self, ttl):
+        if self.lock is not None:
+            return None
+        self.lock = f"token-{len(self.queued)}-{len(self.dlq)}"
+        return self.lock
+
+    async def refresh_redrive_lock(self, token, ttl):
+        self.refreshes += 1
+        return self.lock == token
+
+    async def unlock_redrive(self, token):
+        if self.lock == token:
+            self.lock = None
+
+    async def restore_redrive(self):
+        return 0
+
+    async def dlq_depth(self):
+        return len(self.dlq)
+
+    async def queue_depth(self):
+        if self.depths:
+            return self.depths.pop(0)
+        return len(self.queued)
+
+    async def take_dlq(self, count):
+        taken = self.dlq[-count:][::-1]
+        del self.dlq[-count:]
+        return taken
+
+    async def finish_redrive(self, requeue, keep):
+        self.queued.extend(requeue)
+        self.dlq[:0] = keep
+
+    def _decode(self, raw):
+        return json.loads(raw)
+
+
+class FakeRedriveRepo:
+    def __init__(self, states):
+        self.states = states
+        self.resets = []
+
+    async def job_states(self, job_ids):
+        return {job_id: self.states[job_id] for job_id in job_ids if job_id in self.states}
+
+    async def reset_for_redrive(self, job_ids, request_ids):
+        self.resets.append(list(job_ids))
+
+
+def test_reclaimed_and_redriven_payloads_keep_their_lane():
+    client = QueueClient(
+        FakeRedis(), reliable=True, worker_id="w1", lanes="urgent:3,standard:1", default_lane="standard"
+    )
+    urgent_key = client.lane_key("urgent")
+
+    async def run():
+        await client.push({"job_id": "u1", "lane": "urgent"})
+        await client.push({"job_id": "s1"})
+        popped = await client.pop_batch(2, timeout=0)
+        await client.release()
+        reclaimed = {key: [json.loads(raw)["job_id"] for raw in client.redis.lists.get(key, [])]
+                     for key in (urgent_key, client.queue_name)}
+        client.redis.lists.clear()
+        await client.finish_redrive([{"job_id": "u2", "lane": "urgent"}, {"job_id": "s2"}], keep=[])
+        redriven = {key: [json.loads(raw)["job_id"] for raw in client.redis.lists.get(key, [])]
+                    for key in (urgent_key, client.queue_name)}
+        return len(popped), reclaimed, redriven
+
+    popped, reclaimed, redriven = asyncio.run(run())
+    assert popped == 2
+    assert reclaimed == {urgent_key: ["u1"], client.queue_name: ["s1"]}
+    assert redriven == {urgent_key: ["u2"], client.queue_name: ["s2"]}
+
+
+def test_redrive_replays_matching_failures_in_batches():
+    ids = [f"00000000-0000-0000-0000-00000000000{idx}" for idx in range(6)]
+    states = {
+        ids[0]: {"request_id": "r0", "status": "failed", "attempts": 3, "last_error": "ocr_failed"},
+        ids[1]: {"request_id": "r1", "status": "failed", "attempts": 3, "last_error": "llm_invalid_output"},
+        ids[2]: {"request_id": "r2", "status": "completed", "attempts": 1, "last_error": None},
+        ids[3]: {"request_id": "r3", "status": "failed", "attempts": 3, "last_error": "ocr_timeout"},
+        ids[4]: {"request_id": "r4", "status": "failed", "attempts": 3, "last_error": "ocr_failed"},
+    }
+    queue = FakeDLQ([{"job_id": job_id} for job_id in ids] + [{"job_id": "not-a-uuid"}])
+    repo = FakeRedriveRepo(states)
+    redriver = Redriver(queue, repo, rate=1000, batch_size=3, max_queue_depth=0)
+
+    progress = asyncio.run(redriver.run(errors=["ocr_*"]))
+    assert progress.status == "completed"
+    assert [p["job_id"] for p in queue.queued] == [ids[0], ids[3], ids[4]]
+    assert repo.resets == [[ids[0]], [ids[3], ids[4]]]
+    assert [json.loads(raw)["job_id"] for raw in queue.dlq] == [ids[1]]
+    assert (progress.scanned, progress.requeued, progress.kept, progress.discarded) == (7, 3, 1, 3)
+    assert progress.by_error == {"ocr_failed": 2, "ocr_timeout": 1}
+    assert not queue.locked
+
+
+def test_redrive_lock_is_refreshed_while_throttled_and_never_released_by_a_stale_run(monkeypatch):
+    monkeypatch.setattr(redrive, "REDRIVE_LOCK_REFRESH_SECONDS", 0.01)
+    sleep = asyncio.sleep
+
+    async def fast_sleep(seconds):
+        await sleep(min(seconds, 0.02))
+
+    monkeypatch.setattr(redrive.asyncio, "sleep", fast_sleep)
+    job_id = "00000000-0000-0000-0000-000000000001"
+    states = {job_id: {"request_id": "r0", "status": "failed", "attempts": 3, "last_error": "ocr_failed"}}
+
+    queue = FakeDLQ([{"job_id": job_id}])
+    queue.depths = [5] * 5  # the main queue stays deep for a while
+    progress = asyncio.run(Redriver(queue, FakeRedriveRepo(states), rate=1000, max_queue_depth=5).run())
+    assert progress.status == "completed"
+    assert queue.refreshes >= 2
+    assert not queue.locked
+
+    # Another run takes the lock while this one waits: it stops before requeueing the staged batch
+    # and leaves the other run's lock in place.
+    queue = FakeDLQ([{"job_id": job_id}])
+    queue.depths = [5] * 5
+    repo = FakeRedriveRepo(states)
+    redriver = Redriver(queue, repo, rate=1000, max_queue_depth=5)
+
+    async def run():
+        task = asyncio.create_task(redriver.run())
+        await sleep(0)
+        queue.lock = "other-run"
+        return await task
+
+    progress = asyncio.run(run())
+    assert (progress.status, progress.error) == ("failed", "redrive_lock_lost")
+    assert queue.queued == [] and repo.resets == []
+    assert queue.lock == "other-run"
+
+
+class FakeBackfillRepo:
+    def __init__(self, rows):
+        self.rows = rows
+        self.writes = []
+        self.fail_writes = False
+        self.latest = {row["request_id"]: row["latest_pack_id"] for row in rows}
+        self.streamed = []
+
+    async def iter_request_documents(self, after, prefetch, stream_threshold):
+        self.prefetch = prefetch
+        for row in self.rows:
+            if after is None or row["request_id"] > after:
+                size = len(row["content"].encode("utf-8"))
+                content = row["content"] if stream_threshold <= 0 or size <= stream_threshold else None
+                yield dict(row, content=content, content_bytes=size)
+
+    async def iter_document(self, job_id):
+        content = next(row["content"] for row in self.rows if row["job_id"] == job_id)
+        self.streamed.append(job_id)
+        for start in range(0, len(content), 100):
+            yield content[start : start + 100]
+
+    async def write_backfill(self, packs, audit_metadata, promote, seen_packs):
+        if self.fail_writes:
+            raise RuntimeError("db down")
+        self.writes.append([(pack[1], pack[2], json.loads(pack[5])) for pack in packs])
+        promoted = 0
+        for pack, seen in zip(packs, seen_packs):
+            if promote and self.latest.get(pack[1]) == seen:
+                self.latest[pack[1]] = str(pack[0])
+                promoted += 1
+        return promoted
+
+
+def test_backfill_rescores_requests_and_resumes_from_checkpoint(tmp_path):
+    therapy = SAMPLE_NOTE.replace("No documented physical therapy.", "Completed 6 weeks of physical therapy.")
+    follow_up = "Follow-up: completed physical therapy x8 weeks."
+    rows = [
+        {"request_id": "r1", "job_id": "j1", "content": SAMPLE_NOTE, "latest_pack_id": "p1"},
+        {"request_id": "r2", "job_id": "j2", "content": SAMPLE_NOTE, "latest_pack_id": None},
+        {"request_id": "r2", "job_id": "j3", "content": follow_up, "latest_pack_id": None},
+        {"request_id": "r3", "job_id": "j4", "content": "FAIL_OCR", "latest_pack_id": None},
+        {"request_id": "r4", "job_id": "j5", "content": therapy, "latest_pack_id": "p4"},
+    ]
+    repo = FakeBackfillRepo(rows)
+    # The live worker writes a newer pack for r4 after its documents were read.
+    repo.latest["r4"] = "p4-live"
+    checkpoint = str(tmp_path / "backfill.json")
+    plan = policy_registry.get("tka")
+
+    repo.fail_writes = True
+    failed = asyncio.run(Backfiller(repo, plan, checkpoint, batch_size=2).run())
+    assert failed.status == "failed"
+
+    repo.fail_writes = False
+    progress = asyncio.run(Backfiller(repo, plan, checkpoint, batch_size=2).run())
+    assert progress.status == "completed"
+    # Batches hold whole requests: r2's two documents are merged into one pack.
+    assert [[(request, decision) for request, decision, _ in batch] for batch in repo.writes] == [
+        [("r1", "NEEDS_MORE_INFO"), ("r2", "APPROVE")],
+        [("r4", "APPROVE")],
+    ]
+    assert repo.writes[0][1][2]["conservative_therapy"]["attempted"] is True
+    assert (progress.requests, progress.documents, progress.written, progress.failed) == (4, 5, 3, 1)
+    # r4 keeps the live worker's pack; the others point at their re-scored ones.
+    assert progress.superseded == 1
+    assert repo.latest["r4"] == "p4-live" and repo.latest["r1"] not in ("p1", None)
+    assert progress.by_error == {"ocr_failed": 1}
+    assert json.loads((tmp_path / "backfill.json").read_text())["after"] == "r4"
+
+    rows.append({"request_id": "r5", "job_id": "j6", "content": therapy, "latest_pack_id": None})
+    resumed = asyncio.run(Backfiller(repo, plan, checkpoint, batch_size=2).run())
+    assert (resumed.requests, resumed.run_id) == (1, progress.run_id)
+    assert [request for request, _, _ in repo.writes[-1]] == ["r5"]
+
+
+def test_backfill_caps_batches_by_bytes_and_streams_large_documents(tmp_path):
+    therapy = SAMPLE_NOTE.replace("No documented physical therapy.", "Completed 6 weeks of physical therapy.")
+    large = therapy + "\n" + "Vitals stable, afebrile.\n" * 100
+    rows = [
+        {"request_id": "r1", "job_id": "j1", "content": SAMPLE_NOTE, "latest_pack_id": None},
+        {"request_id": "r2", "job_id": "j2", "content": SAMPLE_NOTE, "latest_pack_id": None},
+        {"request_id": "r3", "job_id": "j3", "content": large, "latest_pack_id": None},
+        {"request_id": "r3", "job_id": "j4", "content": "FAIL_OCR", "latest_pack_id": None},
+        {"request_id": "r4", "job_id": "j5", "content": large, "latest_pack_id": None},
+    ]
+    repo = FakeBackfillRepo(rows)
+    plan = policy_registry.get("tka")
+    backfiller = Backfiller(
+        repo,
+        plan,
+        str(tmp_path / "backfill.json"),
+        batch_size=100,
+        batch_bytes=len(SAMPLE_NOTE) + 1,
+        stream_threshold=len(large) - 1,
+    )
+    progress = asyncio.run(backfiller.run())
+    assert progress.status == "completed"
+    assert repo.prefetch == 1
+    # Two small documents exceed the byte cap; streamed documents do not count towards it.
+    assert [[request for request, _, _ in batch] for batch in repo.writes] == [["r1", "r2"], ["r4"]]
+    assert repo.streamed == ["j3", "j5"]
+    # r3's large document was streamed, its small one failed OCR in the pool.
+    assert progress.by_error == {"ocr_failed": 1}
+    assert repo.writes[1][0][1] == "APPROVE"
+
+
+def test_backfill_read_reopens_its_snapshot_between_whole_requests():
+    documents = [
+        {"request_id": request_id, "job_id": job_id, "content": "", "latest_pack_id": None}
+        for request_id, job_id in [("r1", "j1"), ("r2", "j2"), ("r2", "j3"), ("r3", "j4"), ("r4", "j5"), ("r4", "j6")]
+    ]
+    pool = FakePool(documents=documents)
+    repo = Repository(pool, write_flush_interval_ms=0)
+
+    async def run():
+        return [row["job_id"] async for row in repo.iter_request_documents(None, prefetch=10, window=2)]
+
+    assert asyncio.run(run()) == ["j1", "j2", "j3", "j4", "j5", "j6"]
+    # A fresh transaction and cursor for every two requests, resuming after the last whole one.
+    assert [args for kind, _, args in pool.statements if kind == "cursor"] == [(None,), ("r2",)]
+    assert pool.transactions == 2
+
+
+def test_page_ocr_recognizes_pages_in_parallel_in_order_and_caches():
+    class CountingBackend(FakeBackend):
+        def __init__(self, page_seconds):
+            super().__init__(page_seconds)
+            self.calls = []
+
+        def recognize(self, page):
+            self.calls.append(page)
+            return super().recognize(page).upper()
+
+    backend = CountingBackend(page_seconds=0.05)
+    ocr = PageOCR(backend, workers=4, timeout=5, cache_size=16)
+    started = time.perf_counter()
+    assert ocr.recognize("one\ftwo\fthree\ffour") == "ONE\fTWO\fTHREE\fFOUR"
+    assert time.perf_counter() - started < 0.15
+    assert ocr.recognize("four\ffive") == "FOUR\fFIVE"
+    assert sorted(backend.calls) == ["five", "four", "one", "three", "two"]
+
+    with pytest.raises(RetryableError, match="ocr_failed"):
+        ocr.recognize("page\fFAIL_OCR")
+
+    slow = PageOCR(FakeBackend(page_seconds=0.5), workers=2, timeout=0.05, cache_size=0)
+    with pytest.raises(RetryableError, match="ocr_timeout"):
+        slow.recognize("a\fb")
+
+
+def test_extraction_is_not_slower_than_the_baseline_line_scan(tmp_path):
+    from benchmarks.bench_worker import main_cli
+
+    output = tmp_path / "bench.json"
+    argv = ["--sizes", "200000", "--placements", "middle,end", "--repeat", "3", "--output", str(output)]
+    assert main_cli(argv + ["--benchmarks", "extract_evidence,extract_line_scan", "--compare"]) == 0
+    names = {result["name"] for result in json.loads(output.read_text())["results"]}
+    assert names == {"extract_evidence", "extract_line_scan"}
+
+
+def test_load_harness_drives_worker_loop_and_reports(monkeypatch):
+    from benchmarks.load_test import run_load
+
+    for name in ("repo", "queue", "prefetcher", "result_cache", "rate_limiter", "limiter", "pipeline_executor"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    report = asyncio.run(
+        run_load(
+            rate=100, duration=0.3, doc_chars=2000, concurrency=4, db_latency=0.001, fatal_rate=0.2, sample_interval=0.1
+        )
+    )
+    assert report["submitted"] == 30
+    assert report["completed"] + report["failed"] == 30
+    assert report["failed"] == report["dead_lettered"] > 0
+    assert report["unfinished"] == 0
+    assert report["latency_ms"]["p50"] is not None
+    assert report["queue_depth"]
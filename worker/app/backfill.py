@@ -0,0 +1,334 @@
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from .config import (
+    BACKFILL_BATCH_BYTES,
+    BACKFILL_BATCH_SIZE,
+    BACKFILL_CHECKPOINT_FILE,
+    BACKFILL_WORKERS,
+    DATABASE_URL,
+    DOCUMENT_STREAM_THRESHOLD_BYTES,
+)
+from .errors import FatalError, RetryableError
+from .evidence import dumps
+from .logger import logger
+from .policy import PolicyPlan, policy_registry
+from .processor import PipelineResult, run_pipeline, run_streaming_pipeline
+from .repository import Repository
+
+# (request_id, latest_pack_id when read, [(job_id, content), ...] in upload order). Content is
+# None for a document over the streaming threshold.
+RequestDocuments = Tuple[str, Optional[str], List[Tuple[str, Optional[str]]]]
+# job_id -> pipeline result of a streamed document, or the error it failed with.
+Streamed = Dict[str, Any]
+
+
+def rescore_requests(
+    batch: List[RequestDocuments], policy_id: str, policy_version: int, streamed: Optional[Streamed] = None
+) -> List[Tuple[str, Optional[Tuple[Any, ...]], Optional[str]]]:
+    # Runs in a pool process: every document of a request goes through the pipeline and is
+    # merged in upload order, as the live worker would have, then the policy is evaluated once.
+    # Documents without content were streamed by the parent; their results come in `streamed`.
+    # Returns (request_id, (decision, explanation, evidence, sources, missing, job_ids), error).
+    plan = policy_registry.get(policy_id, policy_version)
+    streamed = streamed or {}
+    results = []
+    for request_id, _, documents in batch:
+        try:
+            evidence: Dict[str, Any] = {}
+            sources: Dict[str, Any] = {}
+            missing: list[str] = []
+            for job_id, content in documents:
+                if content is None:
+                    result = streamed[job_id]
+                    if isinstance(result, str):
+                        raise FatalError(result)
+                else:
+                    result = run_pipeline(content, policy_id, policy_version)
+                doc_evidence, doc_sources, missing = result[:3]
+                if len(documents) > 1:
+                    doc_sources = {name: dict(source, job_id=str(job_id)) for name, source in doc_sources.items()}
+                evidence, sources, missing = plan.merge(doc_evidence, doc_sources, evidence, sources)
+            decision, explanation, missing = plan.evaluate(evidence, missing)
+        except (RetryableError, FatalError) as err:
+            results.append((request_id, None, str(err)))
+            continue
+        job_ids = [str(job_id) for job_id, _ in documents]
+        results.append((request_id, (decision, explanation, evidence, sources, missing, job_ids), None))
+    return results
+
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path: str, state: Dict[str, Any]):
+    # Write-then-rename so a crash mid-write never leaves a torn checkpoint.
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+class BackfillProgress:
+    def __init__(self, policy: str, run_id: str, dry_run: bool):
+        self.policy = policy
+        self.run_id = run_id
+        self.dry_run = dry_run
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.after: Optional[str] = None
+        self.requests = 0
+        self.documents = 0
+        self.written = 0
+        self.superseded = 0
+        self.failed = 0
+        self.by_decision: Dict[str, int] = {}
+        self.by_error: Dict[str, int] = {}
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "status": self.status,
+            "error": self.error,
+            "policy": self.policy,
+            "run_id": self.run_id,
+            "dry_run": self.dry_run,
+            "after": self.after,
+            "requests": self.requests,
+            "documents": self.documents,
+            "written": self.written,
+            "superseded": self.superseded,
+            "failed": self.failed,
+            "by_decision": self.by_decision,
+            "by_error": self.by_error,
+            "elapsed_seconds": round(elapsed, 3),
+            "documents_per_second": round(self.documents / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+class Backfiller:
+    # Re-scores stored documents under a policy outside the live queue. Documents stream from a
+    # server-side cursor in request order and are cut into batches of whole requests (about
+    # `batch_size` documents or `batch_bytes` of content each, whichever comes first). Documents
+    # over `stream_threshold` bytes are never loaded whole: they are read in windows through
+    # the streaming pipeline in this process, and only their results go to the pool. Batches are
+    # re-scored on `executor` (inline when None), at
+    # most `max_in_flight` at a time, and their packs are COPY'd back in submission order. A
+    # request is promoted only if its latest pack is unchanged since its documents were read;
+    # others keep the live worker's newer pack and count as superseded. After each write the last
+    # request id goes to the checkpoint file, so a restarted run resumes after it. Requests whose
+    # documents fail the pipeline are counted and skipped.
+
+    def __init__(
+        self,
+        repo: Repository,
+        plan: PolicyPlan,
+        checkpoint_path: str = BACKFILL_CHECKPOINT_FILE,
+        batch_size: int = BACKFILL_BATCH_SIZE,
+        executor: Optional[Executor] = None,
+        max_in_flight: int = 2,
+        promote: bool = True,
+        batch_bytes: int = BACKFILL_BATCH_BYTES,
+        stream_threshold: int = DOCUMENT_STREAM_THRESHOLD_BYTES,
+    ):
+        self.repo = repo
+        self.plan = plan
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = max(1, batch_size)
+        self.executor = executor
+        self.max_in_flight = max(1, max_in_flight)
+        self.promote = promote
+        self.batch_bytes = max(1, batch_bytes)
+        self.stream_threshold = stream_threshold
+
+    async def run(self, dry_run: bool = False) -> BackfillProgress:
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        if checkpoint is not None and checkpoint.get("policy") != self.plan.key:
+            progress = BackfillProgress(self.plan.key, "", dry_run)
+            progress.status = "failed"
+            progress.error = f"checkpoint belongs to {checkpoint.get('policy')}"
+            progress.finished_at = time.time()
+            return progress
+        progress = BackfillProgress(self.plan.key, (checkpoint or {}).get("run_id") or str(uuid.uuid4()), dry_run)
+        progress.after = (checkpoint or {}).get("after")
+        if progress.after:
+            logger.info("Resuming backfill", {"after": progress.after, "run_id": progress.run_id})
+
+        in_flight: Deque[Tuple[asyncio.Future, List[RequestDocuments]]] = deque()
+        batches = self._batches(progress.after)
+        try:
+            async for batch in batches:
+                if len(in_flight) >= self.max_in_flight:
+                    await self._finish(in_flight.popleft(), progress)
+                in_flight.append((await self._submit(batch), batch))
+            while in_flight:
+                await self._finish(in_flight.popleft(), progress)
+            progress.status = "completed"
+        except Exception as err:
+            progress.status = "failed"
+            progress.error = str(err)
+            logger.error("Backfill failed", progress.as_dict())
+        finally:
+            # Closing the generator ends the cursor's transaction and returns its connection.
+            await batches.aclose()
+            for future, _ in in_flight:
+                future.cancel()
+            progress.finished_at = time.time()
+        logger.info("Backfill finished", progress.as_dict())
+        return progress
+
+    async def _batches(self, after: Optional[str]):
+        batch: List[RequestDocuments] = []
+        documents = size = 0
+        current: Optional[RequestDocuments] = None
+        # The cursor's read-ahead is capped at about one batch's worth of loadable content too.
+        prefetch = self.batch_size
+        if self.stream_threshold > 0:
+            prefetch = max(1, min(prefetch, self.batch_bytes // self.stream_threshold))
+        rows = self.repo.iter_request_documents(after, prefetch=prefetch, stream_threshold=self.stream_threshold)
+        try:
+            async for row in rows:
+                request_id = str(row["request_id"])
+                if current is None or current[0] != request_id:
+                    if documents >= self.batch_size or size >= self.batch_bytes:
+                        yield batch
+                        batch, documents, size = [], 0, 0
+                    seen = row["latest_pack_id"]
+                    current = (request_id, str(seen) if seen is not None else None, [])
+                    batch.append(current)
+                current[2].append((str(row["job_id"]), row["content"]))
+                documents += 1
+                if row["content"] is not None:
+                    size += row["content_bytes"] or 0
+        finally:
+            await rows.aclose()
+        if batch:
+            yield batch
+
+    async def _stream(self, batch: List[RequestDocuments]) -> Streamed:
+        # Runs the streaming pipeline over the batch's documents that were too large to load.
+        streamed: Streamed = {}
+        for _, _, documents in batch:
+            for job_id, content in documents:
+                if content is not None:
+                    continue
+                try:
+                    result: PipelineResult = await run_streaming_pipeline(self.repo.iter_document(job_id), self.plan)
+                    streamed[job_id] = result
+                except (RetryableError, FatalError) as err:
+                    streamed[job_id] = str(err)
+        return streamed
+
+    async def _submit(self, batch: List[RequestDocuments]) -> asyncio.Future:
+        streamed = await self._stream(batch)
+        call = functools.partial(rescore_requests, batch, self.plan.policy_id, self.plan.version, streamed)
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            future = loop.create_future()
+            future.set_result(call())
+            return future
+        return asyncio.ensure_future(loop.run_in_executor(self.executor, call))
+
+    async def _finish(self, entry: Tuple[asyncio.Future, List[RequestDocuments]], progress: BackfillProgress):
+        future, batch = entry
+        results = await future
+        last_request = batch[-1][0]
+        documents = sum(len(docs) for _, _, docs in batch)
+        seen = {request_id: pack_id for request_id, pack_id, _ in batch}
+        packs = []
+        audit_metadata = []
+        for request_id, result, error in results:
+            if error is not None:
+                progress.failed += 1
+                progress.by_error[error] = progress.by_error.get(error, 0) + 1
+                continue
+            decision, explanation, evidence, sources, missing, job_ids = result
+            progress.by_decision[decision] = progress.by_decision.get(decision, 0) + 1
+            pack_id = uuid.uuid4()
+            metadata = {"policy": self.plan.key, "backfill_run": progress.run_id, "documents": job_ids}
+            packs.append(
+                (
+                    pack_id,
+                    request_id,
+                    decision,
+                    explanation,
+                    dumps(metadata),
+                    dumps(evidence),
+                    dumps(sources),
+                    missing,
+                )
+            )
+            audit_metadata.append(dumps({"pack_id": str(pack_id), "backfill_run": progress.run_id}))
+        if packs and not progress.dry_run:
+            seen_packs = [seen[pack[1]] for pack in packs]
+            promoted = await self.repo.write_backfill(packs, audit_metadata, self.promote, seen_packs)
+            progress.written += len(packs)
+            if self.promote:
+                progress.superseded += len(packs) - promoted
+        progress.requests += len(results)
+        progress.documents += documents
+        progress.after = last_request
+        if not progress.dry_run:
+            save_checkpoint(
+                self.checkpoint_path, {"policy": self.plan.key, "run_id": progress.run_id, "after": last_request}
+            )
+        logger.info("Backfill progress", progress.as_dict())
+
+
+async def _main(args: argparse.Namespace) -> int:
+    plan = policy_registry.get(args.policy, args.policy_version)
+    pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=2)
+    workers = args.workers or os.cpu_count() or 1
+    # spawn: see PipelineExecutor; each process compiles its own policy registry.
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        # Write-behind batching is for the live path; the backfill writes whole batches itself.
+        repo = Repository(pool, write_flush_interval_ms=0)
+        backfiller = Backfiller(
+            repo,
+            plan,
+            args.checkpoint,
+            args.batch_size,
+            executor,
+            max_in_flight=workers * 2,
+            promote=not args.no_promote,
+            batch_bytes=args.batch_bytes,
+        )
+        progress = await backfiller.run(args.dry_run)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        await pool.close()
+    logger.flush()
+    print(json.dumps(progress.as_dict()))
+    return 0 if progress.status == "completed" else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score stored documents under a policy.")
+    parser.add_argument("--policy", help="policy id (default: DEFAULT_POLICY)")
+    parser.add_argument("--policy-version", type=int, help="policy version (default: latest)")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_FILE, help="resume file; delete to start over")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="documents per pool task")
+    parser.add_argument("--batch-bytes", type=int, default=BACKFILL_BATCH_BYTES, help="document bytes per pool task")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="pool processes (0 = one per CPU)")
+    parser.add_argument("--no-promote", action="store_true", help="keep requests' latest_pack_id unchanged")
+    parser.add_argument("--dry-run", action="store_true", help="re-score and count without writing")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
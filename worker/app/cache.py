@@ -0,0 +1,75 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from redis.asyncio import Redis
+
+from .config import EXTRACTION_MODE, RESULT_CACHE_REDIS_TTL_SECONDS, RESULT_CACHE_SIZE
+from .evidence import dumps
+from .logger import logger
+from .policy import PolicyPlan
+
+# Bump the version segment whenever extraction semantics change, so stale Redis entries miss.
+CACHE_PREFIX = "pa_result:v6:"
+
+PipelineResult = Tuple[Any, ...]
+
+
+class ResultCache:
+    # Pipeline results keyed by document content hash + compiled policy + extraction mode. An
+    # in-process LRU sits in front of an optional Redis tier (shared by replicas, with TTL).
+    # Cached results are shared objects and must be treated as read-only.
+
+    def __init__(self, max_entries: int, redis_ttl_seconds: int):
+        self.max_entries = max_entries
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self.redis: Optional[Redis] = None
+        self._entries: "OrderedDict[str, PipelineResult]" = OrderedDict()
+
+    def attach(self, redis: Redis):
+        if self.redis_ttl_seconds > 0:
+            self.redis = redis
+
+    def key(self, text: str, plan: PolicyPlan) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{digest}:{plan.key}:{plan.digest}:{EXTRACTION_MODE.lower()}"
+
+    async def get(self, key: str) -> Tuple[Optional[PipelineResult], Optional[str]]:
+        # Returns (result, tier) where tier is "local" or "redis" on a hit.
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+            return result, "local"
+        if self.redis is None:
+            return None, None
+        try:
+            raw = await self.redis.get(CACHE_PREFIX + key)
+        except Exception as err:
+            logger.warn("Result cache read failed", {"error": str(err)})
+            return None, None
+        if raw is None:
+            return None, None
+        result = tuple(json.loads(raw))
+        self._remember(key, result)
+        return result, "redis"
+
+    async def put(self, key: str, result: PipelineResult):
+        self._remember(key, result)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(CACHE_PREFIX + key, dumps(result), ex=self.redis_ttl_seconds)
+        except Exception as err:
+            logger.warn("Result cache write failed", {"error": str(err)})
+
+    def _remember(self, key: str, result: PipelineResult):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_REDIS_TTL_SECONDS)
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+from .logger import logger
+from .metrics import track_slot
+
+# EWMA weights: the short average follows current latency, the long one is the baseline it is
+# compared against.
+SHORT_ALPHA = 0.2
+LONG_ALPHA = 0.02
+
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit. Each finished job feeds its latency and outcome back: while the
+    # worker is using its whole limit and jobs finish cleanly the limit grows by ~1 per `limit`
+    # jobs; an error, a DB pool wait above `pool_wait_target`, or recent latency drifting above
+    # `latency_tolerance` x the long-run baseline cuts it by `backoff` (at most once per recent
+    # job latency, so one burst of slow jobs counts once). With min == max it is a plain semaphore.
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        latency_tolerance: float = 2.0,
+        backoff: float = 0.9,
+        pool_wait_target: float = 0.05,
+        pool_wait: Optional[Callable[[], float]] = None,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.pool_wait_target = pool_wait_target
+        self.pool_wait = pool_wait or (lambda: 0.0)
+        self.in_flight = 0
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        track_slot(0, int(self.limit))
+
+    @property
+    def adaptive(self) -> bool:
+        return self.min_limit < self.max_limit
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+        self.in_flight += 1
+        track_slot(1, int(self.limit))
+
+    def release(self, latency: Optional[float] = None, failed: bool = False):
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if self.adaptive and (latency is not None or failed):
+            self._adjust(latency, failed, saturated)
+        track_slot(-1, int(self.limit))
+        self._wake()
+
+    def _adjust(self, latency: Optional[float], failed: bool, saturated: bool):
+        if latency is not None:
+            if self.short_latency is None or self.long_latency is None:
+                self.short_latency = self.long_latency = latency
+            else:
+                self.short_latency += SHORT_ALPHA * (latency - self.short_latency)
+                self.long_latency += LONG_ALPHA * (latency - self.long_latency)
+
+        reason = None
+        if failed:
+            reason = "error"
+        elif self.pool_wait() > self.pool_wait_target:
+            reason = "db_pool_wait"
+        elif (
+            self.short_latency is not None
+            and self.long_latency is not None
+            and self.short_latency > self.latency_tolerance * self.long_latency
+        ):
+            reason = "latency"
+
+        now = time.monotonic()
+        if reason is not None:
+            if now - self._last_decrease < (self.short_latency or 0.0):
+                return
+            self._last_decrease = now
+            previous = int(self.limit)
+            self.limit = max(float(self.min_limit), self.limit * self.backoff)
+            if int(self.limit) != previous:
+                logger.info("Concurrency limit decreased", {"limit": int(self.limit), "reason": reason})
+        elif saturated:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+    def _wake(self):
+        # Woken waiters re-check the limit, so waking one per free slot is enough.
+        free = int(self.limit) - self.in_flight
+        while self._waiters and free > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
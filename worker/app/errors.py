@@ -0,0 +1,6 @@
+class RetryableError(Exception):
+    pass
+
+
+class FatalError(Exception):
+    pass
@@ -0,0 +1,20 @@
+import json
+from typing import Any, Callable, Optional
+
+try:  # optional: several times faster than the stdlib encoder
+    import orjson
+
+    def encoder(default: Optional[Callable[[Any], Any]] = None) -> Callable[[Any], str]:
+        def encode(value: Any) -> str:
+            return orjson.dumps(value, default=default).decode("utf-8")
+
+        return encode
+
+except ImportError:
+
+    def encoder(default: Optional[Callable[[Any], Any]] = None) -> Callable[[Any], str]:
+        return json.JSONEncoder(separators=(",", ":"), default=default).encode
+
+
+# The one encoder for evidence, sources and metadata on their way to JSONB or Redis.
+dumps = encoder()
@@ -0,0 +1,61 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from .config import PIPELINE_EXECUTOR, PIPELINE_INLINE_MAX_CHARS, PIPELINE_WORKERS
+from .errors import RetryableError
+from .logger import logger
+
+EXECUTOR_MODES = ("inline", "thread", "process")
+
+
+class PipelineExecutor:
+    # Runs CPU-bound pipeline stages off the event loop. Documents up to `inline_max_chars` stay
+    # inline, where a pool hop (and, for processes, pickling the text) costs more than the work.
+
+    def __init__(self, mode: str, workers: int, inline_max_chars: int):
+        self.mode = mode.lower()
+        if self.mode not in EXECUTOR_MODES:
+            raise ValueError(f"unknown pipeline executor mode: {mode}")
+        self.workers = workers or None
+        self.inline_max_chars = inline_max_chars
+        self._pool: Optional[Executor] = None
+
+    def start(self):
+        if self._pool is not None or self.mode == "inline":
+            return
+        if self.mode == "process":
+            # spawn: forking a process that already runs an event loop and threads is not safe
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pipeline")
+        logger.info("Pipeline executor started", {"mode": self.mode, "workers": self.workers})
+
+    @property
+    def pooled(self) -> bool:
+        return self._pool is not None
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn: Callable[..., Any], text: str, *args: Any, offload: bool = False) -> Any:
+        # `offload` sends small documents to the pool too, for stages that block (e.g. real OCR).
+        if self._pool is None or (len(text) <= self.inline_max_chars and not offload):
+            return fn(text, *args)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, functools.partial(fn, text, *args))
+        except BrokenProcessPool:
+            # A worker process died (e.g. OOM on a huge document); replace the pool and retry the job later.
+            logger.error("Pipeline process pool broken, restarting")
+            self.shutdown()
+            self.start()
+            raise RetryableError("executor_unavailable")
+
+
+pipeline_executor = PipelineExecutor(PIPELINE_EXECUTOR, PIPELINE_WORKERS, PIPELINE_INLINE_MAX_CHARS)
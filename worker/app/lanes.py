@@ -0,0 +1,75 @@
+from typing import Dict, List, Tuple
+
+
+def parse_lanes(spec: str, default_lane: str) -> List[Tuple[str, int]]:
+    # "urgent:8,standard:3,bulk:1" -> [("urgent", 8), ("standard", 3), ("bulk", 1)]; the default
+    # lane is always present (weight 1 unless given).
+    lanes: List[Tuple[str, int]] = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition(":")
+        name = name.strip()
+        if not name:
+            raise ValueError(f"invalid queue lane: {part!r}")
+        if name in dict(lanes):
+            raise ValueError(f"duplicate queue lane: {name}")
+        lanes.append((name, max(1, int(weight or 1))))
+    if default_lane not in dict(lanes):
+        lanes.append((default_lane, 1))
+    return lanes
+
+
+class LaneScheduler:
+    # Deficit round robin: each turn a lane is credited its weight and serves that many payloads
+    # (carried over between calls) before the next lane's turn, so over time lanes are served in
+    # proportion to their weights whenever they have work. Before that, any lane whose oldest
+    # payload has waited `starvation_seconds` gets one slot, so no lane starves even with
+    # lopsided weights.
+
+    def __init__(self, lanes: List[Tuple[str, int]], starvation_seconds: float):
+        self.weights = dict(lanes)
+        self.order = [name for name, _ in lanes]
+        self.starvation_seconds = starvation_seconds
+        self.deficit = {name: 0.0 for name in self.order}
+        self._turn = 0
+        self._credited = False
+
+    def allocate(self, depths: Dict[str, int], oldest_age: Dict[str, float], count: int) -> Dict[str, int]:
+        take = {name: 0 for name in self.order}
+        left = {name: depths.get(name, 0) for name in self.order}
+        remaining = count
+
+        if self.starvation_seconds > 0:
+            starving = [n for n in self.order if left[n] and oldest_age.get(n, 0.0) >= self.starvation_seconds]
+            for name in sorted(starving, key=lambda n: -oldest_age[n]):
+                if not remaining:
+                    break
+                take[name] += 1
+                left[name] -= 1
+                remaining -= 1
+
+        while remaining and any(left.values()):
+            name = self.order[self._turn]
+            if left[name] <= 0:
+                self.deficit[name] = 0.0
+                self._next_turn()
+                continue
+            if not self._credited:
+                self.deficit[name] += self.weights[name]
+                self._credited = True
+            served = min(int(self.deficit[name]), left[name], remaining)
+            take[name] += served
+            left[name] -= served
+            remaining -= served
+            self.deficit[name] -= served
+            if left[name] == 0:
+                self.deficit[name] = 0.0
+                self._next_turn()
+            elif self.deficit[name] < 1:
+                self._next_turn()
+        return take
+
+    def _next_turn(self):
+        self._turn = (self._turn + 1) % len(self.order)
+        self._credited = False
@@ -1,29 +1,132 @@
-import json
+import atexit
+import queue
+import random
 import sys
+import threading
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Optional
 
+from .config import LOG_ASYNC, LOG_BUFFER_SIZE, LOG_LEVEL, LOG_SAMPLE_RATE
+from .evidence import encoder
 
-def log(level: str, message: str, meta: Dict[str, Any] | None = None):
+_dumps = encoder(default=str)
+
+LEVELS = {"debug": 10, "info": 20, "warn": 30, "error": 40}
+# Most records a writer pass joins into one write + flush.
+WRITE_BATCH = 512
+
+
+class LogWriter:
+    # Background writer: the event loop only builds the record dict and enqueues it; encoding,
+    # stdout writes and flushes happen on a daemon thread, one flush per drained batch. When
+    # the buffer is full records are dropped (and counted) rather than blocking the caller.
+
+    def __init__(self, max_buffer: int, encode: Callable[[Dict[str, Any]], str] = _dumps):
+        self.encode = encode
+        self.records: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max(1, max_buffer))
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, record: Dict[str, Any]):
+        if self._thread is None:
+            self._start()
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self.records.task_done()
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            batch = batch + [_record("warn", "Log records dropped", {"count": dropped})]
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.encode(record))
+            except (TypeError, ValueError) as err:
+                lines.append(self.encode(_record("error", "Unencodable log record", {"error": str(err)})))
+        try:
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+        except (OSError, ValueError):
+            pass
+
+    def flush(self):
+        # Blocks until everything submitted so far has been written.
+        if self._thread is not None:
+            self.records.join()
+
+
+def _record(level: str, message: str, meta: Dict[str, Any] | None) -> Dict[str, Any]:
     payload = {"level": level, "message": message, "timestamp": datetime.utcnow().isoformat() + "Z"}
     if meta:
         payload.update(meta)
-    sys.stdout.write(json.dumps(payload) + "\n")
-    sys.stdout.flush()
+    return payload
+
+
+def log(level: str, message: str, meta: Dict[str, Any] | None = None):
+    logger.log(level, message, meta)
 
 
 class Logger:
-    def info(self, message: str, meta: Dict[str, Any] | None = None):
-        log("info", message, meta)
+    # `sample=True` marks high-volume messages (one per job); only LOG_SAMPLE_RATE of them are kept.
+
+    def __init__(
+        self, level: str = LOG_LEVEL, sample_rate: float = LOG_SAMPLE_RATE, writer: Optional[LogWriter] = None
+    ):
+        self.threshold = LEVELS.get(level.lower(), LEVELS["info"])
+        self.sample_rate = sample_rate
+        self.writer = writer
+
+    def log(self, level: str, message: str, meta: Dict[str, Any] | None = None, sample: bool = False):
+        if LEVELS[level] < self.threshold:
+            return
+        if sample and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        record = _record(level, message, meta)
+        if self.writer is not None:
+            self.writer.submit(record)
+            return
+        sys.stdout.write(_dumps(record) + "\n")
+        sys.stdout.flush()
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def info(self, message: str, meta: Dict[str, Any] | None = None, sample: bool = False):
+        self.log("info", message, meta, sample)
 
     def error(self, message: str, meta: Dict[str, Any] | None = None):
-        log("error", message, meta)
+        self.log("error", message, meta)
 
     def warn(self, message: str, meta: Dict[str, Any] | None = None):
-        log("warn", message, meta)
+        self.log("warn", message, meta)
 
-    def debug(self, message: str, meta: Dict[str, Any] | None = None):
-        log("debug", message, meta)
+    def debug(self, message: str, meta: Dict[str, Any] | None = None, sample: bool = False):
+        self.log("debug", message, meta, sample)
 
 
-logger = Logger()
+logger = Logger(writer=LogWriter(LOG_BUFFER_SIZE) if LOG_ASYNC else None)
+atexit.register(logger.flush)
@@ -1,91 +1,199 @@
 import asyncio
+import json
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Set
 
 import asyncpg
-from fastapi import FastAPI, Response
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from fastapi import FastAPI, HTTPException, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from pydantic import BaseModel
 from redis.asyncio import Redis
 
+from .cache import result_cache
+from .concurrency import AdaptiveLimiter
 from .config import (
+    ADAPTIVE_CONCURRENCY,
     BACKOFF_BASE_SECONDS,
+    CONCURRENCY_LATENCY_TOLERANCE,
+    CONCURRENCY_MAX,
+    CONCURRENCY_MIN,
+    CONCURRENCY_POOL_WAIT_MS,
     DATABASE_URL,
     DLQ_NAME,
     MAX_ATTEMPTS,
     MAX_CONCURRENCY,
+    MAX_RATE_PER_SEC,
+    QUEUE_BATCH_SIZE,
     QUEUE_NAME,
+    SHUTDOWN_DRAIN_SECONDS,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_KEY,
     REDIS_URL,
+    REDRIVE_RATE_PER_SEC,
+    RETRY_PROMOTE_INTERVAL_SECONDS,
 )
+from .executor import pipeline_executor
 from .logger import logger
-from .processor import FatalError, RetryableError, evaluate_policy, extract_with_guardrails, rate_limiter, stage_ocr
-from .queue import QueueClient, backoff_sleep
-from .repository import Repository
+from .metrics import (
+    JobTrace,
+    cache_hits,
+    jobs_failed,
+    jobs_processed,
+    jobs_retried,
+    latency_hist,
+    queue_dwell,
+    stage_latency,
+)
+from .ocr import ocr_engine
+from .policy import policy_registry
+from .prefetch import Prefetcher
+from .processor import FatalError, RetryableError, run_streaming_pipeline, run_timed_pipeline
+from .queue import QueueClient, backoff_delay
+from .ratelimit import RedisTokenBucket
+from .redrive import RedriveProgress, Redriver
+from .repository import Merge, Repository
 
 app = FastAPI(title="PA Worker", version="0.1.0")
 
-jobs_processed = Counter("jobs_processed_total", "Jobs processed successfully")
-jobs_failed = Counter("jobs_failed_total", "Jobs failed")
-jobs_retried = Counter("jobs_retried_total", "Jobs retried")
-latency_hist = Histogram("job_latency_seconds", "End to end latency", buckets=[0.5, 1, 2, 5, 10, 30])
-
 redis: Optional[Redis] = None
 queue: Optional[QueueClient] = None
 repo: Optional[Repository] = None
 pool: Optional[asyncpg.Pool] = None
+rate_limiter: Optional[RedisTokenBucket] = None
+prefetcher: Optional[Prefetcher] = None
 worker_task: Optional[asyncio.Task] = None
-semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+promoter_task: Optional[asyncio.Task] = None
+maintenance_task: Optional[asyncio.Task] = None
+redrive_task: Optional[asyncio.Task] = None
+redrive_progress: Optional[RedriveProgress] = None
+# handle_payload tasks still running, so shutdown can let them finish.
+in_flight: Set[asyncio.Task] = set()
+# Outcomes that tell the concurrency limiter to back off; fatal (bad document) failures do not.
+OVERLOAD_OUTCOMES = ("retried", "dead_lettered", "error")
+
+
+def _pool_wait() -> float:
+    return repo.pool_wait_seconds if repo is not None else 0.0
+
+
+limiter = AdaptiveLimiter(
+    MAX_CONCURRENCY,
+    CONCURRENCY_MIN if ADAPTIVE_CONCURRENCY else MAX_CONCURRENCY,
+    CONCURRENCY_MAX if ADAPTIVE_CONCURRENCY else MAX_CONCURRENCY,
+    latency_tolerance=CONCURRENCY_LATENCY_TOLERANCE,
+    pool_wait_target=CONCURRENCY_POOL_WAIT_MS / 1000,
+    pool_wait=_pool_wait,
+)
+
 
+def prior_state(prior_row: Any, policy_id: str) -> Optional[tuple]:
+    # (evidence, sources, pack_id) of the request's latest evidence pack, when one exists and was
+    # built by the same policy (any version; fields are matched by name).
+    raw = prior_row.get("prior_evidence")
+    policy = prior_row.get("prior_policy")
+    if not raw or not policy or policy.split("@")[0] != policy_id:
+        return None
+    sources = prior_row.get("prior_sources")
+    return json.loads(raw), json.loads(sources) if sources else {}, str(prior_row["prior_pack_id"])
 
-async def process_message(payload: Dict[str, Any]):
+
+def request_merge(plan: Any, evidence: Dict[str, Any], sources: Dict[str, Any], missing: List[str]) -> Merge:
+    # Only this document was extracted; at write time, under the request lock, fold it into the
+    # request's evidence so far and re-run just the policy step.
+    def merge(prior_row: Any) -> Optional[tuple]:
+        prior = prior_state(prior_row, plan.policy_id)
+        if prior is None:
+            return None
+        merged, merged_sources, merged_missing = plan.merge(evidence, sources, *prior)
+        decision, explanation, merged_missing = plan.evaluate(merged, merged_missing)
+        return merged, merged_sources, merged_missing, decision, explanation, prior[2]
+
+    return merge
+
+
+async def process_message(payload: Dict[str, Any]) -> Optional[str]:
+    # Returns the job outcome, or None when the job was missing or already completed.
     global repo, queue
     assert repo is not None
     assert queue is not None
     job_id = payload.get("job_id")
     request_id = payload.get("request_id")
     start_time = time.time()
+    enqueued_at = payload.get("enqueued_at")
+    if isinstance(enqueued_at, (int, float)):
+        # Clamped: API and worker clocks can disagree slightly.
+        queue_dwell.labels(queue.lane_of(payload)).observe(max(0.0, start_time - enqueued_at))
+    trace = JobTrace(job_id)
 
-    job_row = await repo.get_job(job_id)
+    with trace.stage("claim"):
+        job_row = await repo.claim_job(job_id, request_id)
     if not job_row:
         logger.warn("Job not found", {"job_id": job_id})
         return
 
     if job_row["status"] == "completed":
-        logger.info("Skipping already completed job", {"job_id": job_id})
+        logger.info("Skipping already completed job", {"job_id": job_id}, sample=True)
         return
 
-    await repo.ensure_request_processing(request_id)
-    await repo.increment_attempt(job_id)
-
+    trace.trace_id = str(job_row["trace_id"])
+    outcome = "failed"
     try:
-        rate_limiter.check()
-        doc_text = await repo.load_document(job_id)
-        if not doc_text:
-            raise FatalError("document_missing")
-
-        ocr_text = stage_ocr(doc_text)
-        evidence, sources, missing = extract_with_guardrails(ocr_text)
-        decision, explanation, missing = evaluate_policy(evidence, missing)
+        plan = policy_registry.get(payload.get("policy_id"), payload.get("policy_version"))
+        doc_text = job_row["content"]
+        cache_tier = None
+        timings: Dict[str, float] = {}
+        if doc_text is None and job_row["content_bytes"]:
+            # Too large to load whole: stream windows through the extractor (no result cache).
+            with trace.stage("pipeline"):
+                result = await run_streaming_pipeline(repo.iter_document(job_id), plan, timings, pipeline_executor)
+        else:
+            if not doc_text:
+                raise FatalError("document_missing")
+            with trace.stage("cache_lookup"):
+                cache_key = result_cache.key(doc_text, plan)
+                result, cache_tier = await result_cache.get(cache_key)
+            if result is None:
+                with trace.stage("pipeline"):
+                    result, timings = await pipeline_executor.run(
+                        run_timed_pipeline,
+                        doc_text,
+                        plan.policy_id,
+                        plan.version,
+                        offload=not ocr_engine.backend.inline,
+                    )
+                await result_cache.put(cache_key, result)
+            else:
+                cache_hits.labels(cache_tier).inc()
+        for stage, seconds in timings.items():
+            trace.record(stage, seconds)
+        evidence, sources, missing, decision, explanation, scan = result
 
         metadata = {
             "attempts": job_row["attempts"] + 1,
             "trace_id": str(job_row["trace_id"]),
+            "policy": plan.key,
+            "cache_hit": cache_tier is not None,
+            "merged_from": None,
+            "scan": scan,
             "latency_ms": int((time.time() - start_time) * 1000),
         }
 
-        await repo.write_evidence_pack(
-            request_id=request_id,
-            decision=decision,
-            explanation=explanation,
-            metadata=metadata,
-            evidence=evidence,
-            sources=sources,
-            missing_fields=missing,
-        )
-        await repo.mark_completed(job_id)
-        await repo.append_audit(request_id, "worker", "EVIDENCE_PACK_CREATED", {"job_id": job_id})
+        with trace.stage("write"):
+            await repo.complete_job(
+                job_id=job_id,
+                request_id=request_id,
+                decision=decision,
+                explanation=explanation,
+                metadata=metadata,
+                evidence=evidence,
+                sources=sources,
+                missing_fields=missing,
+                merge=request_merge(plan, evidence, sources, missing),
+            )
         jobs_processed.inc()
         latency_hist.observe(time.time() - start_time)
-        logger.info("Job processed", {"job_id": job_id, "decision": decision})
+        outcome = "completed"
+        logger.info("Job processed", {"job_id": job_id, "decision": decision}, sample=True)
     except RetryableError as err:
         jobs_retried.inc()
         if job_row["attempts"] + 1 >= MAX_ATTEMPTS:
@@ -93,12 +201,15 @@ async def process_message(payload: Dict[str, Any]):
             await repo.set_request_status(request_id, "failed")
             await queue.push_dlq(payload)  # type: ignore
             jobs_failed.inc()
+            outcome = "dead_lettered"
             logger.error("Job sent to DLQ", {"job_id": job_id, "error": str(err)})
-            return
+            return outcome
         await repo.reset_to_queue(job_id, str(err))
-        await backoff_sleep(job_row["attempts"] + 1, BACKOFF_BASE_SECONDS)
-        await queue.push(payload)  # type: ignore
-        logger.warn("Job retried", {"job_id": job_id, "error": str(err)})
+        # Park the retry in the delayed set instead of sleeping, so the concurrency slot frees up now.
+        delay = backoff_delay(job_row["attempts"] + 1, BACKOFF_BASE_SECONDS)
+        await queue.schedule_retry(payload, delay)  # type: ignore
+        outcome = "retried"
+        logger.warn("Job retried", {"job_id": job_id, "error": str(err), "delay_seconds": delay})
     except FatalError as err:
         jobs_failed.inc()
         await repo.mark_failed(job_id, str(err))
@@ -107,50 +218,175 @@ async def process_message(payload: Dict[str, Any]):
         logger.error("Fatal error, job to DLQ", {"job_id": job_id, "error": str(err)})
     except Exception as err:  # unexpected
         jobs_failed.inc()
+        outcome = "error"
         await repo.mark_failed(job_id, str(err))
         await repo.set_request_status(request_id, "failed")
         await queue.push_dlq(payload)  # type: ignore
         logger.error("Unexpected failure", {"job_id": job_id, "error": str(err)})
+    finally:
+        trace.emit(outcome)
+    return outcome
 
 
 async def worker_loop():
+    global queue, rate_limiter, prefetcher
+    assert queue is not None
+    assert rate_limiter is not None
+    if prefetcher is None:
+        prefetcher = Prefetcher(queue)
+    prefetcher.start()
+    while True:
+        payload = await prefetcher.get()
+        waited = time.perf_counter()
+        try:
+            await limiter.acquire()
+        except asyncio.CancelledError:
+            # Shutdown while waiting for a slot: the job never started, so it goes back.
+            prefetcher.unget(payload)
+            raise
+        slot_taken = time.perf_counter()
+        stage_latency.labels("slot_wait").observe(slot_taken - waited)
+        try:
+            # Wait for a shared token before the job is claimed instead of failing it mid-flight.
+            await rate_limiter.acquire()
+        except asyncio.CancelledError:
+            limiter.release()
+            prefetcher.unget(payload)
+            raise
+        stage_latency.labels("rate_limit_wait").observe(time.perf_counter() - slot_taken)
+        task = asyncio.create_task(handle_payload(payload))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+
+async def drain_in_flight(timeout: float = SHUTDOWN_DRAIN_SECONDS) -> int:
+    # Lets running jobs finish while the write batcher, executor and pool are still up; jobs still
+    # running after `timeout` are cancelled. Returns how many were cancelled.
+    if not in_flight:
+        return 0
+    _, pending = await asyncio.wait(set(in_flight), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if pending:
+        logger.warn("Cancelled jobs still running at shutdown", {"count": len(pending)})
+    return len(pending)
+
+
+async def retry_promoter():
+    global queue
+    assert queue is not None
+    while True:
+        try:
+            moved = await queue.promote_due()
+        except Exception as err:
+            logger.error("Retry promotion failed", {"error": str(err)})
+            moved = 0
+        if moved == 0:
+            await asyncio.sleep(RETRY_PROMOTE_INTERVAL_SECONDS)
+
+
+async def queue_maintenance():
+    # Reliable mode only: keep this worker's heartbeat alive and requeue payloads held by dead workers.
     global queue
     assert queue is not None
     while True:
-        payload = await queue.pop(timeout=5)
-        if not payload:
-            continue
-        await semaphore.acquire()
-        asyncio.create_task(handle_payload(payload))
+        try:
+            await queue.heartbeat()
+            await queue.reclaim_stale()
+        except Exception as err:
+            logger.error("Queue maintenance failed", {"error": str(err)})
+        await asyncio.sleep(queue.visibility_timeout / 3)
 
 
 async def handle_payload(payload: Dict[str, Any]):
+    global queue
+    started = time.perf_counter()
+    outcome: Optional[str] = "error"
+    cancelled = False
     try:
-        await process_message(payload)
+        outcome = await process_message(payload)
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
     finally:
-        semaphore.release()
+        # Skipped jobs say nothing about load; processed ones feed their latency back.
+        latency = time.perf_counter() - started if outcome is not None and not cancelled else None
+        limiter.release(latency, failed=outcome in OVERLOAD_OUTCOMES and not cancelled)
+        try:
+            if cancelled:
+                # Cut off at shutdown without finishing: never acked, straight back on the queue.
+                await queue.requeue_unstarted([payload])  # type: ignore
+            else:
+                await queue.ack(payload)  # type: ignore
+        except Exception as err:
+            logger.error("Failed to ack job", {"job_id": payload.get("job_id"), "error": str(err)})
 
 
 @app.on_event("startup")
 async def startup_event():
-    global redis, queue, pool, repo, worker_task
+    global redis, queue, pool, repo, rate_limiter, prefetcher, worker_task, promoter_task, maintenance_task
     redis = Redis.from_url(REDIS_URL, decode_responses=True)
     queue = QueueClient(redis)
+    prefetcher = Prefetcher(queue)
+    result_cache.attach(redis)
+    rate_limiter = RedisTokenBucket(redis, RATE_LIMIT_KEY, MAX_RATE_PER_SEC, RATE_LIMIT_BURST)
     pool = await asyncpg.create_pool(DATABASE_URL)
     repo = Repository(pool)
+    repo.start()
+    pipeline_executor.start()
+    if queue.reliable:
+        # A restart under the same WORKER_ID first hands back what the previous run left unacked.
+        await queue.release()
+        await queue.heartbeat()
+        maintenance_task = asyncio.create_task(queue_maintenance())
     worker_task = asyncio.create_task(worker_loop())
-    logger.info("Worker started", {"queue": QUEUE_NAME, "dlq": DLQ_NAME})
+    promoter_task = asyncio.create_task(retry_promoter())
+    logger.info(
+        "Worker started",
+        {
+            "queue": QUEUE_NAME,
+            "dlq": DLQ_NAME,
+            "batch_size": QUEUE_BATCH_SIZE,
+            "prefetch_max": prefetcher.max_buffer,
+            "reliable": queue.reliable,
+            "lanes": dict(queue.lanes),
+            "concurrency": {"limit": int(limiter.limit), "min": limiter.min_limit, "max": limiter.max_limit},
+        },
+    )
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global redis, pool, worker_task
+    global redis, queue, pool, repo, prefetcher, worker_task, promoter_task, maintenance_task, redrive_task
     if worker_task:
         worker_task.cancel()
+        await asyncio.gather(worker_task, return_exceptions=True)
+    if prefetcher:
+        # Stop popping before the drain, so no new batch is taken while jobs finish, and hand the
+        # popped but never started payloads back to the front of the queue for the next worker.
+        await prefetcher.stop()
+    # Before anything they depend on stops; heartbeats keep this worker's payloads from being reclaimed.
+    await drain_in_flight()
+    if promoter_task:
+        promoter_task.cancel()
+    if maintenance_task:
+        maintenance_task.cancel()
+    if redrive_task:
+        # The staging list survives; the next redrive puts the interrupted batch back first.
+        redrive_task.cancel()
+    if queue:
+        # Only after the drain: every finished job is acked by now, so what is left in the
+        # processing list was never acked and is safe to hand back.
+        await queue.release()
+    if repo:
+        await repo.close()
+    pipeline_executor.shutdown()
     if redis:
         await redis.close()
     if pool:
         await pool.close()
+    logger.flush()
 
 
 @app.get("/health")
@@ -158,6 +394,38 @@ async def health():
     return {"status": "ok", "queue": QUEUE_NAME}
 
 
+@app.get("/policies")
+async def policies():
+    policy_registry.refresh(force=True)
+    return {"default": policy_registry.default_policy, "policies": policy_registry.keys()}
+
+
+class RedriveRequest(BaseModel):
+    errors: Optional[List[str]] = None  # last_error globs, e.g. ["ocr_*"]; all errors when omitted
+    limit: Optional[int] = None
+    rate: float = REDRIVE_RATE_PER_SEC
+    dry_run: bool = False
+
+
+@app.post("/dlq/redrive", status_code=202)
+async def start_redrive(body: RedriveRequest):
+    global redrive_task, redrive_progress
+    if redrive_task is not None and not redrive_task.done():
+        raise HTTPException(status_code=409, detail="redrive already running")
+    assert queue is not None and repo is not None
+    redrive_progress = RedriveProgress(body.errors, body.limit, body.dry_run)
+    redriver = Redriver(queue, repo, rate=body.rate)
+    redrive_task = asyncio.create_task(redriver.run(body.errors, body.limit, body.dry_run, redrive_progress))
+    return redrive_progress.as_dict()
+
+
+@app.get("/dlq/redrive")
+async def redrive_status():
+    if redrive_progress is None:
+        return {"status": "idle"}
+    return redrive_progress.as_dict()
+
+
 @app.get("/metrics")
 async def metrics():
     data = generate_latest()
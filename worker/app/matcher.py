@@ -0,0 +1,170 @@
+import re
+from bisect import bisect_right
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Pattern, Tuple
+
+# (1-based line number, line, match start, match end) with the span relative to the line.
+Hit = Tuple[int, str, int, int]
+# accept(field, line, match start, match end) -> False rejects the hit as negated.
+Accept = Callable[[str, str, int, int], bool]
+# What MatchScan.state returns: pending fields, hits, negated hits, lines seen, settled-at lines.
+ScanState = Tuple[FrozenSet[str], Dict[str, Hit], Dict[str, Hit], int, Dict[str, int]]
+
+
+# Alphanumeric patterns up to this long are abbreviations ("pt", "ct", "mri") and only match as
+# whole words (plural "s" allowed), so "pt" does not fire inside "symptoms". They stay plain
+# literals in the alternation (a \b anchor would cost the regex its literal prefix scan) and the
+# word boundary is checked on each hit instead.
+ABBREVIATION_MAX_LEN = 3
+
+
+def _is_abbreviation(pattern: str) -> bool:
+    return len(pattern) <= ABBREVIATION_MAX_LEN and pattern.isalnum()
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _word_end(text: str, start: int, end: int) -> Optional[int]:
+    # `\b<text[start:end]>s?\b` checked on a literal hit: the end of the whole word (past a plural
+    # "s"), or None when the hit is part of a longer word.
+    if start > 0 and _is_word(text[start - 1]):
+        return None
+    if end < len(text) and text[end] == "s":
+        end += 1
+    if end < len(text) and _is_word(text[end]):
+        return None
+    return end
+
+
+def _alternation(patterns: Iterable[str]) -> Pattern[str]:
+    # Longest first so a shorter pattern never shadows a longer one at the same offset. No inline
+    # flags: patterns are lowercase and so is the text they run on.
+    ordered = sorted(set(patterns), key=len, reverse=True)
+    return re.compile("|".join(re.escape(p) for p in ordered))
+
+
+def _lower_in_place(line: str) -> str:
+    # line.lower() for the few lines where that changes the length ("İ" -> "i̇"): characters whose
+    # lowercase is longer are kept as they are, so offsets still index the original line.
+    lowered = line.lower()
+    if len(lowered) == len(line):
+        return lowered
+    return "".join(low if len(low) == 1 else char for char, low in ((char, char.lower()) for char in line))
+
+
+class PatternMatcher:
+    # Case-insensitive substring matcher (abbreviations match whole words): the lines are joined
+    # into a single buffer and lowercased once, and a combined regex over the still-unresolved
+    # fields jumps straight to the next candidate offset, so the scan is linear in document size
+    # rather than fields x patterns x lines. Lowercasing keeps every line's length (see
+    # _lower_in_place), so match offsets are offsets into the original lines.
+
+    def __init__(self, fields: Dict[str, List[str]]):
+        self.fields = {name: [p.lower() for p in patterns if p] for name, patterns in fields.items()}
+        self._field_res = {name: _alternation(patterns) for name, patterns in self.fields.items() if patterns}
+        self._abbreviations = frozenset(p for patterns in self.fields.values() for p in patterns if _is_abbreviation(p))
+        self._combined: Dict[FrozenSet[str], Pattern[str]] = {}
+
+    def _combined_for(self, names: FrozenSet[str]) -> Pattern[str]:
+        regex = self._combined.get(names)
+        if regex is None:
+            regex = _alternation(p for name in names for p in self.fields[name])
+            self._combined[names] = regex
+        return regex
+
+    def scan(self, obsoletes: Optional[Dict[str, List[str]]] = None, accept: Optional[Accept] = None) -> "MatchScan":
+        return MatchScan(self, obsoletes, accept)
+
+    def first_hits(self, lines: List[str]) -> Dict[str, Hit]:
+        # Returns {field: Hit} for every field with a match in `lines`.
+        scan = self.scan()
+        scan.feed(lines)
+        return scan.hits
+
+
+class MatchScan:
+    # Incremental state of one document scan; feed consecutive blocks of lines and stop as soon as
+    # `feed` reports every field resolved. Line numbers keep counting across blocks. `obsoletes`
+    # maps a field to fields whose result stops mattering once it has a hit; those are dropped
+    # from the scan at that point. A hit `accept` rejects is kept in `negated` (first one per
+    # field) and still drops the field's obsoletes, but the field stays pending for a later hit.
+
+    def __init__(
+        self,
+        matcher: PatternMatcher,
+        obsoletes: Optional[Dict[str, List[str]]] = None,
+        accept: Optional[Accept] = None,
+    ):
+        self.matcher = matcher
+        self.obsoletes = obsoletes or {}
+        self.accept = accept
+        self.pending = frozenset(matcher._field_res)
+        self.hits: Dict[str, Hit] = {}
+        self.negated: Dict[str, Hit] = {}
+        self.lines_seen = 0
+        self._settled_at: Dict[str, int] = {}
+
+    @property
+    def done(self) -> bool:
+        return not self.pending
+
+    def state(self) -> ScanState:
+        # Everything a scan carries between blocks, small enough to send to a pool process that
+        # feeds the next block into a scan of the same plan (see restore).
+        return self.pending, self.hits, self.negated, self.lines_seen, self._settled_at
+
+    def restore(self, state: ScanState):
+        self.pending, self.hits, self.negated, self.lines_seen, self._settled_at = state
+
+    def lines_scanned(self) -> Dict[str, int]:
+        # Lines each field was matched against before it was resolved, dropped, or the scan ended.
+        return {name: self._settled_at.get(name, self.lines_seen) for name in self.matcher._field_res}
+
+    def feed(self, lines: List[str]) -> bool:
+        if self.pending and lines:
+            self._scan_block(lines)
+        self.lines_seen += len(lines)
+        return self.done
+
+    def _scan_block(self, lines: List[str]):
+        starts: List[int] = []
+        offset = 0
+        for line in lines:
+            starts.append(offset)
+            offset += len(line) + 1
+        buffer = "\n".join(lines).lower()
+        if len(buffer) != offset - 1:
+            buffer = "\n".join(_lower_in_place(line) for line in lines)
+
+        field_res = self.matcher._field_res
+        abbreviations = self.matcher._abbreviations
+        pos = 0
+        while self.pending:
+            match: Optional[re.Match[str]] = self.matcher._combined_for(self.pending).search(buffer, pos)
+            if match is None:
+                break
+            at = match.start()
+            idx = bisect_right(starts, at) - 1
+            line_no = self.lines_seen + idx + 1
+            settled = set()
+            for name in self.pending:
+                hit = field_res[name].match(buffer, at)
+                if hit is None:
+                    continue
+                end = hit.end()
+                if hit.group() in abbreviations:
+                    end = _word_end(buffer, at, end)
+                    if end is None:
+                        continue
+                settled.update(self.obsoletes.get(name, ()))
+                start, end = at - starts[idx], end - starts[idx]
+                if self.accept is None or self.accept(name, lines[idx], start, end):
+                    self.hits[name] = (line_no, lines[idx], start, end)
+                    settled.add(name)
+                elif name not in self.negated:
+                    self.negated[name] = (line_no, lines[idx], start, end)
+            for name in settled.intersection(self.pending):
+                self._settled_at[name] = line_no
+            self.pending = self.pending.difference(settled)
+            pos = at + 1
@@ -0,0 +1,89 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .config import MAX_CONCURRENCY, TRACE_SPANS
+from .logger import logger
+
+# Sub-millisecond DB calls up to multi-minute queue waits.
+STAGE_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+jobs_processed = Counter("jobs_processed_total", "Jobs processed successfully")
+jobs_failed = Counter("jobs_failed_total", "Jobs failed")
+jobs_retried = Counter("jobs_retried_total", "Jobs retried")
+cache_hits = Counter("result_cache_hits_total", "Pipeline results served from cache", ["tier"])
+latency_hist = Histogram("job_latency_seconds", "End to end latency", buckets=STAGE_BUCKETS)
+stage_latency = Histogram("job_stage_seconds", "Time spent per job stage", ["stage"], buckets=STAGE_BUCKETS)
+queue_dwell = Histogram(
+    "job_queue_dwell_seconds", "Time from enqueue (or retry due time) to claim", ["lane"], buckets=STAGE_BUCKETS
+)
+lane_depth = Gauge("queue_lane_depth", "Payloads waiting per queue lane", ["lane"])
+lane_oldest_age = Gauge("queue_lane_oldest_age_seconds", "Wait of the oldest payload per queue lane", ["lane"])
+lane_dequeued = Counter("queue_lane_dequeued_total", "Payloads taken per queue lane", ["lane"])
+db_roundtrips = Counter("db_roundtrips_total", "Database round-trips", ["method"])
+db_latency = Histogram("db_call_seconds", "Database call latency", ["method"], buckets=STAGE_BUCKETS)
+db_pool_wait = Histogram("db_pool_wait_seconds", "Time waiting for a pooled DB connection", buckets=STAGE_BUCKETS)
+jobs_in_flight = Gauge("jobs_in_flight", "Jobs holding a concurrency slot")
+concurrency_saturation = Gauge("worker_concurrency_saturation", "Share of concurrency slots in use")
+concurrency_limit = Gauge("worker_concurrency_limit", "Concurrency slots available to this worker")
+concurrency_limit.set(MAX_CONCURRENCY)
+prefetch_buffered = Gauge("worker_prefetch_buffered", "Payloads popped and waiting in the local prefetch buffer")
+prefetch_capacity = Gauge("worker_prefetch_capacity", "Current size limit of the local prefetch buffer")
+
+_in_flight = 0
+
+
+def track_slot(delta: int, limit: int = MAX_CONCURRENCY):
+    # Called with +1/-1 as a job takes or frees a concurrency slot.
+    global _in_flight
+    _in_flight += delta
+    jobs_in_flight.set(_in_flight)
+    concurrency_limit.set(limit)
+    concurrency_saturation.set(_in_flight / max(1, limit))
+
+
+@contextmanager
+def db_call(method: str, roundtrips: int = 1) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        db_roundtrips.labels(method).inc(roundtrips)
+        db_latency.labels(method).observe(time.perf_counter() - started)
+
+
+class JobTrace:
+    # Stage timer for one job: every stage feeds `job_stage_seconds`; with TRACE_SPANS on the
+    # spans are also kept and logged once per job under its trace_id.
+
+    def __init__(self, job_id: Optional[str], enabled: bool = TRACE_SPANS):
+        self.job_id = job_id
+        self.trace_id: Optional[str] = None
+        self.enabled = enabled
+        self.spans: List[Dict[str, Any]] = []
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, started)
+
+    def record(self, name: str, seconds: float, started: Optional[float] = None):
+        stage_latency.labels(name).observe(seconds)
+        if self.enabled:
+            # Stages timed elsewhere (e.g. in a pool process) are placed just before now.
+            offset = (started if started is not None else time.perf_counter() - seconds) - self._started
+            self.spans.append({"stage": name, "start_ms": round(offset * 1000, 3), "ms": round(seconds * 1000, 3)})
+
+    def emit(self, outcome: str):
+        if self.enabled and self.spans:
+            logger.info(
+                "Job trace",
+                {"trace_id": self.trace_id, "job_id": self.job_id, "outcome": outcome, "spans": self.spans},
+                sample=True,
+            )
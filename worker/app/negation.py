@@ -0,0 +1,161 @@
+import re
+from functools import lru_cache
+from typing import Iterable, Pattern, Tuple
+
+# NegEx-style trigger tables. Pre-negation triggers negate a finding that follows them, post-
+# negation triggers one that precedes them; either reaches at most SCOPE_WORDS words and never
+# past a termination term or clause break. A label separator ("PT: none", "PT - declined") ends a
+# pre-negation scope, but a post-negation trigger reaches back across one to the label before it.
+# Pseudo-triggers contain a trigger but do not negate ("no change", "not only") and are blanked
+# out before triggers are looked for.
+PRE_TRIGGERS = (
+    "no",
+    "not",
+    "denies",
+    "denied",
+    "without",
+    "never",
+    "no evidence of",
+    "no documented",
+    "no history of",
+    "no prior",
+    "negative for",
+    "did not",
+    "has not",
+    "have not",
+    "had not",
+    "not tried",
+    "declined",
+    "refused",
+    "absence of",
+    "free of",
+    "ruled out",
+)
+POST_TRIGGERS = (
+    "not documented",
+    "not done",
+    "not tried",
+    "not attempted",
+    "not completed",
+    "was declined",
+    "were declined",
+    "declined",
+    "refused",
+    "ruled out",
+    "unlikely",
+    "is negative",
+    "was negative",
+    "none",
+)
+PSEUDO_TRIGGERS = (
+    # Failed therapy is still attempted therapy: "no relief with PT" documents PT.
+    "no relief",
+    "no improvement",
+    "no benefit",
+    "no significant relief",
+    "no significant improvement",
+    "not relieved",
+    "not improved",
+    "not helpful",
+    "did not improve",
+    "did not help",
+    "did not relieve",
+    "has not improved",
+    "have not improved",
+    "without relief",
+    "without improvement",
+    "without benefit",
+    "no change",
+    "no increase",
+    "no further",
+    "not only",
+    "not necessarily",
+    "not certain if",
+    "gram negative",
+)
+TERMINATIONS = (
+    "but",
+    "however",
+    "although",
+    "though",
+    "except",
+    "aside from",
+    "apart from",
+    "yet",
+    "still",
+    "because",
+    "which",
+    "who",
+    "reports",
+    "reported",
+    "presents",
+    "complains of",
+)
+# Clause breaks (including commas) end a scope like a termination term.
+CLAUSE_BREAK = re.compile(r"[.,;!?]")
+LABEL_SEPARATOR = re.compile(r":|\s-\s")
+SCOPE_WORDS = 5
+WORD = re.compile(r"[a-z0-9']+", re.IGNORECASE)
+
+Span = Tuple[int, int]
+
+
+def _table(phrases: Iterable[str]) -> Pattern[str]:
+    ordered = sorted(set(phrases), key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(re.escape(p) for p in ordered) + r")\b", re.IGNORECASE)
+
+
+class NegationDetector:
+    # Triggers are compiled once into one case-insensitive regex per table; the negated scopes of
+    # a line are computed once per distinct line and memoized, so boilerplate lines repeated
+    # across notes and fields cost a cache lookup. Offsets are into the line as given.
+
+    def __init__(
+        self,
+        pre: Iterable[str] = PRE_TRIGGERS,
+        post: Iterable[str] = POST_TRIGGERS,
+        pseudo: Iterable[str] = PSEUDO_TRIGGERS,
+        terminations: Iterable[str] = TERMINATIONS,
+        scope_words: int = SCOPE_WORDS,
+        cache_size: int = 65536,
+    ):
+        self._pre = _table(pre)
+        self._post = _table(post)
+        self._pseudo = _table(pseudo)
+        self._terminations = _table(terminations)
+        self.scope_words = scope_words
+        self.scopes = lru_cache(maxsize=cache_size)(self._scopes)
+
+    def is_negated(self, line: str, start: int, end: int) -> bool:
+        # [start, end) is the matched finding within `line`.
+        return any(lo < end and start < hi for lo, hi in self.scopes(line))
+
+    def _scopes(self, line: str) -> Tuple[Span, ...]:
+        # Pseudo-triggers are blanked (same length, so offsets hold) before trigger lookup.
+        masked = self._pseudo.sub(lambda m: " " * len(m.group()), line)
+        breaks = sorted(
+            {m.start() for m in CLAUSE_BREAK.finditer(masked)} | {m.start() for m in self._terminations.finditer(masked)}
+        )
+        labels = [m.start() for m in LABEL_SEPARATOR.finditer(masked)]
+        scopes = []
+        for trigger in self._pre.finditer(masked):
+            limit = next((b for b in sorted(breaks + labels) if b >= trigger.end()), len(masked))
+            scopes.append((trigger.end(), self._word_limit(masked, trigger.end(), limit, forward=True)))
+        for trigger in self._post.finditer(masked):
+            limit = max((b for b in breaks if b < trigger.start()), default=-1)
+            crossed = [b for b in labels if limit < b < trigger.start()]
+            if len(crossed) > 1:
+                limit = crossed[-2]
+            scopes.append((self._word_limit(masked, limit + 1, trigger.start(), forward=False), trigger.start()))
+        return tuple(scope for scope in scopes if scope[0] < scope[1])
+
+    def _word_limit(self, text: str, lo: int, hi: int, forward: bool) -> int:
+        # End (forward) or start (backward) of the scope: SCOPE_WORDS words from the trigger,
+        # clipped to the clause [lo, hi).
+        words = list(WORD.finditer(text, lo, hi))
+        if len(words) <= self.scope_words:
+            return hi if forward else lo
+        return words[self.scope_words - 1].end() if forward else words[-self.scope_words].start()
+
+
+negation_detector = NegationDetector()
@@ -0,0 +1,169 @@
+import hashlib
+import shlex
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional
+
+from .config import (
+    OCR_BACKEND,
+    OCR_CACHE_SIZE,
+    OCR_COMMAND,
+    OCR_FAKE_PAGE_SECONDS,
+    OCR_TIMEOUT_SECONDS,
+    OCR_WORKERS,
+)
+from .errors import RetryableError
+
+PAGE_BREAK = "\f"
+
+
+class OCRBackend:
+    # Recognizes one page. `inline` backends are cheap enough to run on the calling thread over
+    # the whole document, uncached; the others go through the page pool, where `timeout` applies.
+    name = "base"
+    inline = False
+
+    def recognize(self, page: str) -> str:
+        raise NotImplementedError
+
+
+class PassthroughBackend(OCRBackend):
+    # Stored documents are already text; keeps the failure hook of the original mock stage.
+    name = "passthrough"
+    inline = True
+
+    def recognize(self, page: str) -> str:
+        if "FAIL_OCR" in page:
+            raise RetryableError("ocr_failed")
+        return page
+
+
+class FakeBackend(PassthroughBackend):
+    # Passthrough that takes `page_seconds` per page, standing in for a real engine in tests
+    # and benchmarks.
+    name = "fake"
+    inline = False
+
+    def __init__(self, page_seconds: float = 0.0):
+        self.page_seconds = page_seconds
+
+    def recognize(self, page: str) -> str:
+        if self.page_seconds > 0:
+            time.sleep(self.page_seconds)
+        return super().recognize(page)
+
+
+class CommandBackend(OCRBackend):
+    # Runs a local OCR command per page: page on stdin, text on stdout (e.g. "tesseract - -").
+    # The process is killed once `timeout` passes.
+    name = "command"
+
+    def __init__(self, command: str, timeout: float):
+        self.argv = shlex.split(command)
+        if not self.argv:
+            raise ValueError("OCR_COMMAND is required for the command backend")
+        self.timeout = timeout
+
+    def recognize(self, page: str) -> str:
+        try:
+            done = subprocess.run(
+                self.argv, input=page.encode("utf-8"), capture_output=True, timeout=self.timeout, check=False
+            )
+        except subprocess.TimeoutExpired:
+            raise RetryableError("ocr_timeout")
+        except OSError:
+            raise RetryableError("ocr_unavailable")
+        if done.returncode != 0:
+            raise RetryableError("ocr_failed")
+        return done.stdout.decode("utf-8", errors="replace")
+
+
+class PageOCR:
+    # Splits a document into pages on form feeds, recognizes the pages not already cached in
+    # parallel on `workers` threads (the engines run out of process or release the GIL), and
+    # reassembles them in order. Recognized pages are cached by content hash, so re-uploads
+    # and shared cover sheets are recognized once. A page that takes longer than `timeout`
+    # fails the document with a RetryableError; its thread is left to finish on its own.
+
+    def __init__(self, backend: OCRBackend, workers: int, timeout: float, cache_size: int):
+        self.backend = backend
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def recognize(self, text: str) -> str:
+        if self.backend.inline:
+            return self.backend.recognize(text)
+        pages = text.split(PAGE_BREAK)
+        keys = [self._key(page) for page in pages]
+        results: Dict[int, str] = {}
+        todo: List[int] = []
+        for idx, key in enumerate(keys):
+            cached = self._get(key)
+            if cached is None:
+                todo.append(idx)
+            else:
+                results[idx] = cached
+        if todo:
+            pool = self._executor()
+            futures = {idx: pool.submit(self.backend.recognize, pages[idx]) for idx in todo}
+            deadline = time.monotonic() + self.timeout
+            try:
+                for idx, future in futures.items():
+                    results[idx] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                raise RetryableError("ocr_timeout")
+            finally:
+                for future in futures.values():
+                    future.cancel()
+        for idx in todo:
+            self._put(keys[idx], results[idx])
+        return PAGE_BREAK.join(results[idx] for idx in range(len(pages)))
+
+    def _key(self, page: str) -> str:
+        return hashlib.sha256(page.encode("utf-8")).hexdigest()
+
+    def _get(self, key: str) -> Optional[str]:
+        if self.cache_size <= 0:
+            return None
+        with self._lock:
+            page = self._cache.get(key)
+            if page is not None:
+                self._cache.move_to_end(key)
+            return page
+
+    def _put(self, key: str, page: str):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = page
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+        return self._pool
+
+
+def make_backend(name: str) -> OCRBackend:
+    name = name.lower()
+    if name == "passthrough":
+        return PassthroughBackend()
+    if name == "fake":
+        return FakeBackend(OCR_FAKE_PAGE_SECONDS)
+    if name == "command":
+        return CommandBackend(OCR_COMMAND, OCR_TIMEOUT_SECONDS)
+    raise ValueError(f"unknown OCR backend: {name}")
+
+
+ocr_engine = PageOCR(make_backend(OCR_BACKEND), OCR_WORKERS, OCR_TIMEOUT_SECONDS, OCR_CACHE_SIZE)
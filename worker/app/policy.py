@@ -0,0 +1,273 @@
+import glob
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import DEFAULT_POLICY, POLICY_DIR, POLICY_REFRESH_SECONDS
+from .errors import FatalError, RetryableError
+from .logger import logger
+from .matcher import Hit, MatchScan, PatternMatcher
+from .negation import negation_detector
+
+FIELD_TYPES = ("label", "flag", "attempt")
+FALLBACK_SUFFIX = ":fallback"
+
+
+class PolicyError(ValueError):
+    pass
+
+
+class FieldRule:
+    def __init__(self, spec: Dict[str, Any]):
+        self.name: str = spec["name"]
+        self.type: str = spec.get("type", "flag")
+        if self.type not in FIELD_TYPES:
+            raise PolicyError(f"field {self.name}: unknown type {self.type}")
+        self.value = spec.get("value", self.name)
+        self.patterns = [p.lower() for p in spec.get("patterns", []) if p]
+        if not self.patterns:
+            raise PolicyError(f"field {self.name}: no patterns")
+        self.negations = tuple(p.lower() for p in spec.get("negations", []) if p)
+        # NegEx-style scope detection on top of the explicit phrases; "negex": false turns it off.
+        self.negex = bool(spec.get("negex", True))
+        self.fallback_patterns = [p.lower() for p in spec.get("fallback_patterns", []) if p]
+        self.missing_message: Optional[str] = spec.get("missing_message")
+
+    def is_negated(self, line: str, start: int, end: int) -> bool:
+        # [start, end) is the pattern match within `line`.
+        if self.negations:
+            lowered = line.lower()
+            if any(phrase in lowered for phrase in self.negations):
+                return True
+        return self.negex and negation_detector.is_negated(line, start, end)
+
+    def satisfied(self, value: Any) -> bool:
+        if self.type == "label":
+            return value == self.value
+        if self.type == "attempt":
+            return bool((value or {}).get("attempted", False))
+        return bool(value)
+
+
+class PolicyPlan:
+    # A rule file compiled once: one matcher over every field (and fallback) pattern plus the
+    # requirement logic resolved to field lists, so per-job work is a single scan and a lookup.
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.policy_id: str = spec["policy_id"]
+        self.version = int(spec.get("version", 1))
+        self.procedure: Optional[str] = spec.get("procedure")
+        # Changes whenever the rule file content does, even if the version was not bumped.
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.fields = [FieldRule(field) for field in spec["fields"]]
+        names = [field.name for field in self.fields]
+        if len(set(names)) != len(names):
+            raise PolicyError(f"policy {self.policy_id}: duplicate field names")
+
+        requirements = spec.get("requirements") or {"all_of": names}
+        self.all_of = set(requirements.get("all_of", []))
+        self.any_of = [list(group) for group in requirements.get("any_of", [])]
+        referenced = self.all_of.union(*self.any_of)
+        unknown = referenced.difference(names)
+        if unknown:
+            raise PolicyError(f"policy {self.policy_id}: unknown fields in requirements {sorted(unknown)}")
+
+        self.approve_decision = spec.get("approve_decision", "APPROVE")
+        self.pending_decision = spec.get("pending_decision", "NEEDS_MORE_INFO")
+        self.approve_message = spec.get("approve_message", "All required evidence present.")
+
+        patterns: Dict[str, List[str]] = {}
+        # A fallback only fills in detail when its field has no hit at all, so the field's first
+        # hit (negated or not) ends the fallback search. Negated hits do not resolve the field:
+        # every candidate line is checked until a non-negated one turns up.
+        self.obsoletes: Dict[str, List[str]] = {}
+        self._rules = {field.name: field for field in self.fields}
+        for field in self.fields:
+            patterns[field.name] = field.patterns
+            if field.fallback_patterns:
+                patterns[field.name + FALLBACK_SUFFIX] = field.fallback_patterns
+                self.obsoletes[field.name] = [field.name + FALLBACK_SUFFIX]
+        self.matcher = PatternMatcher(patterns)
+
+    @property
+    def key(self) -> str:
+        return f"{self.policy_id}@v{self.version}"
+
+    def scan(self) -> MatchScan:
+        return self.matcher.scan(self.obsoletes, self._accepts)
+
+    def _accepts(self, name: str, line: str, start: int, end: int) -> bool:
+        rule = self._rules.get(name)
+        return rule is None or not rule.is_negated(line, start, end)
+
+    def extract(self, lines: List[str]) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
+        scan = self.scan()
+        scan.feed(lines)
+        return self.build(scan.hits, scan.negated)
+
+    def build(
+        self, hits: Dict[str, Hit], negated: Optional[Dict[str, Hit]] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
+        evidence: Dict[str, Any] = {}
+        sources: Dict[str, Any] = {}
+        missing: list[str] = []
+        negated = negated or {}
+
+        for field in self.fields:
+            hit = hits.get(field.name)
+            if field.type == "attempt":
+                if hit:
+                    evidence[field.name] = {"attempted": True, "detail": hit[1]}
+                    sources[field.name] = {"line": hit[0], "text": hit[1]}
+                    continue
+                # Keep the negated or fallback mention as detail; it does not satisfy the field.
+                hit = negated.get(field.name) or hits.get(field.name + FALLBACK_SUFFIX)
+                evidence[field.name] = {"attempted": False, "detail": hit[1] if hit else None}
+                if hit:
+                    sources[field.name] = {"line": hit[0], "text": hit[1]}
+                missing.append(field.name)
+            elif hit:
+                evidence[field.name] = field.value if field.type == "label" else True
+                sources[field.name] = {"line": hit[0], "text": hit[1]}
+            else:
+                evidence[field.name] = None if field.type == "label" else False
+                missing.append(field.name)
+
+        # Basic schema validation
+        for field in self.fields:
+            if field.name not in evidence:
+                raise RetryableError("schema_missing_field")
+
+        return evidence, sources, missing
+
+    def merge(
+        self,
+        evidence: Dict[str, Any],
+        sources: Dict[str, Any],
+        prior_evidence: Dict[str, Any],
+        prior_sources: Dict[str, Any],
+        prior_pack_id: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
+        # Folds one new document's extraction into the request's accumulated evidence: a field
+        # satisfied by the new document takes its value and citation; otherwise an earlier
+        # satisfied value (and its citation, tagged with the pack it came from) is kept.
+        merged: Dict[str, Any] = {}
+        merged_sources: Dict[str, Any] = {}
+        missing: list[str] = []
+        for field in self.fields:
+            name = field.name
+            if not field.satisfied(evidence.get(name)) and field.satisfied(prior_evidence.get(name)):
+                merged[name] = prior_evidence[name]
+                if name in prior_sources:
+                    source = dict(prior_sources[name])
+                    if prior_pack_id and "pack_id" not in source:
+                        source["pack_id"] = prior_pack_id
+                    merged_sources[name] = source
+                continue
+            merged[name] = evidence.get(name)
+            if name in sources:
+                merged_sources[name] = sources[name]
+            if not field.satisfied(merged[name]):
+                missing.append(name)
+        return merged, merged_sources, missing
+
+    def evaluate(self, evidence: Dict[str, Any], missing: list[str]) -> Tuple[str, str, list[str]]:
+        ok = {field.name: field.satisfied(evidence.get(field.name)) for field in self.fields}
+        failing = {name for name in self.all_of if not ok[name]}
+        for group in self.any_of:
+            if not any(ok[name] for name in group):
+                failing.update(group)
+
+        decision = self.approve_decision
+        explanation_parts = []
+        for field in self.fields:
+            if field.name not in failing:
+                continue
+            decision = self.pending_decision
+            if field.name not in missing:
+                missing.append(field.name)
+            if field.missing_message:
+                explanation_parts.append(field.missing_message)
+
+        if decision == self.approve_decision:
+            explanation_parts.append(self.approve_message)
+
+        explanation = " ".join(explanation_parts) if explanation_parts else "Evidence evaluated."
+        return decision, explanation, missing
+
+
+class PolicyRegistry:
+    # Compiled plans for every rule file in a directory, keyed by policy id and version. The
+    # directory is re-stat'ed at most every `refresh_seconds`, so dropping a new file in onboards
+    # a procedure without a redeploy; a broken edit keeps the previously loaded catalog.
+
+    def __init__(self, directory: str, default_policy: str, refresh_seconds: float):
+        self.directory = directory
+        self.default_policy = default_policy
+        self.refresh_seconds = refresh_seconds
+        self.plans: Dict[str, Dict[int, PolicyPlan]] = {}
+        self._fingerprint: List[Tuple[str, int, int]] = []
+        self._checked_at = 0.0
+        self.load()
+
+    def _scan(self) -> List[Tuple[str, int, int]]:
+        entries = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json"))):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_mtime_ns, stat.st_size))
+        return entries
+
+    def load(self):
+        entries = self._scan()
+        plans: Dict[str, Dict[int, PolicyPlan]] = {}
+        errors = 0
+        for path, _, _ in entries:
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    plan = PolicyPlan(json.load(fh))
+            except (OSError, ValueError, KeyError, TypeError) as err:
+                errors += 1
+                logger.error("Failed to load policy", {"file": os.path.basename(path), "error": str(err)})
+                continue
+            plans.setdefault(plan.policy_id, {})[plan.version] = plan
+
+        self._fingerprint = entries
+        self._checked_at = time.monotonic()
+        if errors and self.plans:
+            logger.warn("Keeping previous policy catalog", {"errors": errors})
+            return
+        self.plans = plans
+        logger.info("Policies loaded", {"policies": self.keys()})
+
+    def refresh(self, force: bool = False) -> bool:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_seconds:
+            return False
+        self._checked_at = now
+        if self._scan() == self._fingerprint:
+            return False
+        self.load()
+        return True
+
+    def keys(self) -> List[str]:
+        return sorted(plan.key for versions in self.plans.values() for plan in versions.values())
+
+    def get(self, policy_id: Optional[str] = None, version: Optional[int] = None) -> PolicyPlan:
+        self.refresh()
+        versions = self.plans.get(policy_id or self.default_policy)
+        if not versions:
+            raise FatalError("unknown_policy")
+        if version is None:
+            return versions[max(versions)]
+        plan = versions.get(int(version))
+        if plan is None:
+            raise FatalError("unknown_policy_version")
+        return plan
+
+
+policy_registry = PolicyRegistry(POLICY_DIR, DEFAULT_POLICY, POLICY_REFRESH_SECONDS)
@@ -0,0 +1,115 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from .config import PREFETCH_MAX, PREFETCH_SECONDS, QUEUE_BATCH_SIZE, QUEUE_BATCH_WAIT_SECONDS
+from .logger import logger
+from .metrics import prefetch_buffered, prefetch_capacity
+from .queue import QueueClient
+
+# Seconds of recent takes the throughput estimate is based on.
+RATE_WINDOW_SECONDS = 10.0
+
+
+class Prefetcher:
+    # Keeps popped payloads buffered ahead of the worker loop, so the next Redis round-trip runs
+    # while jobs execute instead of after a slot frees up. The buffer holds about `lead_seconds`
+    # of the recent take rate (at least 1, at most `max_buffer`); while it is full the filler
+    # stops popping, leaving the rest in Redis for other replicas. `stop` lets a pop in progress
+    # finish, then hands unstarted payloads back to the front of the queue.
+
+    def __init__(
+        self,
+        queue: QueueClient,
+        max_buffer: int = PREFETCH_MAX,
+        lead_seconds: float = PREFETCH_SECONDS,
+        batch_size: int = QUEUE_BATCH_SIZE,
+        wait_seconds: float = QUEUE_BATCH_WAIT_SECONDS,
+    ):
+        self.queue = queue
+        self.max_buffer = max(1, max_buffer)
+        self.lead_seconds = lead_seconds
+        self.batch_size = max(1, batch_size)
+        self.wait_seconds = wait_seconds
+        self.buffer: Deque[Dict[str, Any]] = deque()
+        self._takes: Deque[float] = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def capacity(self) -> int:
+        now = time.monotonic()
+        while self._takes and now - self._takes[0] > RATE_WINDOW_SECONDS:
+            self._takes.popleft()
+        rate = len(self._takes) / RATE_WINDOW_SECONDS
+        return max(1, min(self.max_buffer, math.ceil(rate * self.lead_seconds)))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._fill())
+
+    async def stop(self) -> int:
+        # Stops popping and returns the number of unstarted payloads handed back. A pop blocks
+        # for at most `wait_seconds`; cancelling it could drop payloads Redis already handed
+        # out, so it is given that long to land in the buffer before the filler is cancelled.
+        if self._task is not None:
+            self._stopping = True
+            self._space.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), self.wait_seconds + 1)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._stopping = False
+        unstarted: List[Dict[str, Any]] = list(self.buffer)
+        self.buffer.clear()
+        self._observe()
+        if unstarted:
+            await self.queue.requeue_unstarted(unstarted)
+            logger.info("Returned prefetched jobs to queue", {"count": len(unstarted)})
+        return len(unstarted)
+
+    async def get(self) -> Dict[str, Any]:
+        while not self.buffer:
+            self._ready.clear()
+            await self._ready.wait()
+        payload = self.buffer.popleft()
+        self._takes.append(time.monotonic())
+        self._space.set()
+        self._observe()
+        return payload
+
+    def unget(self, payload: Dict[str, Any]):
+        # For a payload taken but not started (e.g. the loop was cancelled while it waited).
+        self.buffer.appendleft(payload)
+        self._ready.set()
+        self._observe()
+
+    async def _fill(self):
+        while not self._stopping:
+            room = self.capacity - len(self.buffer)
+            if room <= 0:
+                self._space.clear()
+                await self._space.wait()
+                continue
+            try:
+                payloads = await self.queue.pop_batch(min(room, self.batch_size), timeout=self.wait_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error("Queue pop failed", {"error": str(err)})
+                await asyncio.sleep(1)
+                continue
+            if payloads:
+                self.buffer.extend(payloads)
+                self._ready.set()
+                self._observe()
+
+    def _observe(self):
+        prefetch_buffered.set(len(self.buffer))
+        prefetch_capacity.set(self.capacity)
@@ -1,163 +1,86 @@
+import asyncio
+import re
 import time
-from collections import deque
-from typing import Any, Dict, Tuple
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
 
-from .config import MAX_RATE_PER_SEC, EXTRACTION_MODE
+from .config import EXTRACTION_MODE
+from .errors import FatalError, RetryableError
+from .executor import PipelineExecutor
 from .logger import logger
+from .matcher import MatchScan, ScanState
+from .ocr import ocr_engine
+from .policy import PolicyPlan, policy_registry
 
+SCAN_BLOCK_CHARS = 65536
+LINE_BREAK = re.compile(r"[\r\n]")
 
-class RetryableError(Exception):
-    pass
+PipelineResult = Tuple[Dict[str, Any], Dict[str, Any], list[str], str, str, Dict[str, Any]]
 
 
-class FatalError(Exception):
-    pass
-
-
-class RateLimiter:
-    def __init__(self, max_per_sec: int):
-        self.max_per_sec = max_per_sec
-        self.events = deque()
-
-    def check(self):
-        if self.max_per_sec <= 0:
-            return
-        now = time.time()
-        while self.events and now - self.events[0] > 1:
-            self.events.popleft()
-        if len(self.events) >= self.max_per_sec:
-            raise RetryableError("rate_limited")
-        self.events.append(now)
-
+def stage_ocr(text: str) -> str:
+    # Page-parallel OCR through the configured backend (OCR_BACKEND; passthrough by default).
+    return ocr_engine.recognize(text)
 
-rate_limiter = RateLimiter(MAX_RATE_PER_SEC)
 
+def split_lines(text: str) -> list[str]:
+    return [ln.strip() for ln in text.splitlines() if ln.strip()]
 
-def stage_ocr(text: str) -> str:
-    # In this mock, OCR simply passes through, but we keep the hook for errors/timeouts.
-    if "FAIL_OCR" in text:
-        raise RetryableError("ocr_failed")
-    return text
-
-
-def extract_evidence(text: str) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    evidence: Dict[str, Any] = {}
-    sources: Dict[str, Any] = {}
-    missing: list[str] = []
-
-    def find_line(patterns):
-        for idx, line in enumerate(lines):
-            for pat in patterns:
-                if pat in line.lower():
-                    return idx + 1, line
-        return None, None
-
-    # Diagnosis
-    diag_line, diag_text = find_line(["osteoarthritis", "knee pain"])
-    evidence["diagnosis"] = "osteoarthritis" if diag_line else None
-    if diag_line:
-        sources["diagnosis"] = {"line": diag_line, "text": diag_text}
-    else:
-        missing.append("diagnosis")
-
-    # Conservative therapy: require PT; NSAIDs alone are insufficient
-    pt_line, pt_text = find_line(["physical therapy", "pt"])
-    nsaid_line, nsaid_text = find_line(["nsaid", "nsaids"])
-
-    def is_pt_negated(text: str) -> bool:
-        lowered = text.lower()
-        return any(
-            phrase in lowered
-            for phrase in [
-                "no documented physical therapy",
-                "no physical therapy",
-                "without physical therapy",
-                "did not do physical therapy",
-            ]
-        )
-
-    pt_ok = bool(pt_line and not is_pt_negated(pt_text or ""))
-    if pt_ok:
-        evidence["conservative_therapy"] = {"attempted": True, "detail": pt_text}
-        sources["conservative_therapy"] = {"line": pt_line, "text": pt_text}
-    else:
-        # Record NSAID detail if present, but it does not satisfy PT requirement
-        detail_text = pt_text if pt_text else (nsaid_text if nsaid_line else None)
-        evidence["conservative_therapy"] = {"attempted": False, "detail": detail_text}
-        if detail_text:
-            sources["conservative_therapy"] = {"line": pt_line or nsaid_line, "text": detail_text}
-        missing.append("conservative_therapy")
-
-    # Imaging
-    imaging_line, imaging_text = find_line(["x-ray", "xray", "mri", "ct", "imaging"])
-    if imaging_line:
-        evidence["imaging_evidence"] = True
-        sources["imaging_evidence"] = {"line": imaging_line, "text": imaging_text}
-    else:
-        evidence["imaging_evidence"] = False
-        missing.append("imaging_evidence")
-
-    # Functional limitation
-    func_line, func_text = find_line(["difficulty", "cannot", "limited", "adl", "activities of daily living"])
-    if func_line:
-        evidence["functional_limitation"] = True
-        sources["functional_limitation"] = {"line": func_line, "text": func_text}
-    else:
-        evidence["functional_limitation"] = False
-        missing.append("functional_limitation")
-
-    # Basic schema validation
-    for key in ["diagnosis", "conservative_therapy", "imaging_evidence", "functional_limitation"]:
-        if key not in evidence:
-            raise RetryableError("schema_missing_field")
 
-    return evidence, sources, missing
+def iter_text_blocks(text: str, block_chars: int = SCAN_BLOCK_CHARS) -> Iterator[str]:
+    # Whole-line slices of an in-memory document, so a scan that finishes early never splits,
+    # strips or lowercases the rest of it.
+    start = 0
+    size = len(text)
+    while start < size:
+        end = start + block_chars
+        if end < size:
+            cut = max(text.rfind("\n", start, end), text.rfind("\r", start, end))
+            if cut >= start:
+                end = cut + 1
+            else:
+                line_break = LINE_BREAK.search(text, end)
+                end = line_break.end() if line_break else size
+        yield text[start:end]
+        start = end
 
 
-def evaluate_policy(evidence: Dict[str, Any], missing: list[str]) -> Tuple[str, str, list[str]]:
-    decision = "APPROVE"
-    explanation_parts = []
+def scan_text(text: str, plan: PolicyPlan) -> MatchScan:
+    scan = plan.scan()
+    for block in iter_text_blocks(text):
+        if scan.feed(split_lines(block)):
+            break
+    return scan
 
-    if evidence.get("diagnosis") != "osteoarthritis":
-        decision = "NEEDS_MORE_INFO"
-        if "diagnosis" not in missing:
-            missing.append("diagnosis")
 
-    therapy = evidence.get("conservative_therapy") or {}
-    therapy_attempted = therapy.get("attempted", False)
-    if not therapy_attempted:
-        decision = "NEEDS_MORE_INFO"
-        if "conservative_therapy" not in missing:
-            missing.append("conservative_therapy")
-        explanation_parts.append("Need physical therapy documentation.")
+def scan_stats(scan: MatchScan) -> Dict[str, Any]:
+    return {"lines_read": scan.lines_seen, "lines_scanned": scan.lines_scanned()}
 
-    if not evidence.get("imaging_evidence"):
-        decision = "NEEDS_MORE_INFO"
-        if "imaging_evidence" not in missing:
-            missing.append("imaging_evidence")
-        explanation_parts.append("Imaging evidence missing.")
 
-    if not evidence.get("functional_limitation"):
-        decision = "NEEDS_MORE_INFO"
-        if "functional_limitation" not in missing:
-            missing.append("functional_limitation")
-        explanation_parts.append("Functional limitation affecting ADLs missing.")
+def extract_evidence(
+    text: str, plan: Optional[PolicyPlan] = None, stats: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
+    # Stops reading as soon as every field that can still change the result is resolved;
+    # per-field scan counters are written into `stats` when given.
+    plan = plan or policy_registry.get()
+    scan = scan_text(text, plan)
+    if stats is not None:
+        stats.update(scan_stats(scan))
+    return plan.build(scan.hits, scan.negated)
 
-    if decision == "APPROVE":
-        explanation_parts.append("All required evidence present for TKA.")
 
-    explanation = " ".join(explanation_parts) if explanation_parts else "Evidence evaluated."
-    return decision, explanation, missing
+def evaluate_policy(
+    evidence: Dict[str, Any], missing: list[str], plan: Optional[PolicyPlan] = None
+) -> Tuple[str, str, list[str]]:
+    plan = plan or policy_registry.get()
+    return plan.evaluate(evidence, missing)
 
 
 def guardrails(evidence: Dict[str, Any], sources: Dict[str, Any]):
     # Require citation for each field present
     for key, value in evidence.items():
-        if key == "conservative_therapy":
-            # Only require citation if attempted is True
-            if isinstance(value, dict) and value.get("attempted") is False:
-                continue
+        # Only require citation for attempt-style fields if attempted is True
+        if isinstance(value, dict) and value.get("attempted") is False:
+            continue
         if value and key not in sources:
             raise RetryableError("missing_citation")
     # Basic type checks
@@ -165,22 +88,130 @@ def guardrails(evidence: Dict[str, Any], sources: Dict[str, Any]):
         raise RetryableError("invalid_sources")
 
 
-def llm_extract(text: str) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
+def llm_extract(
+    text: str, plan: Optional[PolicyPlan] = None, stats: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
     # Placeholder LLM extractor: reuses heuristic extraction but can be swapped for real LLM.
     # Guardrail hook: simulate invalid output trigger
     if "FAIL_LLM" in text:
         raise RetryableError("llm_invalid_output")
-    return extract_evidence(text)
+    return extract_evidence(text, plan, stats)
 
 
-def extract_with_guardrails(text: str) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
+def extract_with_guardrails(
+    text: str, plan: Optional[PolicyPlan] = None, stats: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any], list[str]]:
     if EXTRACTION_MODE.lower() == "hybrid":
         try:
-            evidence, sources, missing = llm_extract(text)
+            evidence, sources, missing = llm_extract(text, plan, stats)
             guardrails(evidence, sources)
             return evidence, sources, missing
         except RetryableError:
             logger.warn("LLM extraction failed, falling back to heuristics")
-    evidence, sources, missing = extract_evidence(text)
+    evidence, sources, missing = extract_evidence(text, plan, stats)
     guardrails(evidence, sources)
     return evidence, sources, missing
+
+
+def run_pipeline(
+    text: str,
+    policy_id: Optional[str] = None,
+    policy_version: Optional[int] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> PipelineResult:
+    # OCR -> extraction -> policy as one picklable call so it can run in a pool worker; the
+    # plan is looked up by id there because each process holds its own compiled registry.
+    # Per-stage seconds are written into `timings` when given.
+    plan = policy_registry.get(policy_id, policy_version)
+    started = time.perf_counter()
+    ocr_text = stage_ocr(text)
+    ocr_done = time.perf_counter()
+    stats: Dict[str, Any] = {}
+    evidence, sources, missing = extract_with_guardrails(ocr_text, plan, stats)
+    extract_done = time.perf_counter()
+    decision, explanation, missing = evaluate_policy(evidence, missing, plan)
+    if timings is not None:
+        timings["ocr"] = ocr_done - started
+        timings["extract"] = extract_done - ocr_done
+        timings["policy"] = time.perf_counter() - extract_done
+    return evidence, sources, missing, decision, explanation, stats
+
+
+def run_timed_pipeline(
+    text: str, policy_id: Optional[str] = None, policy_version: Optional[int] = None
+) -> Tuple[PipelineResult, Dict[str, float]]:
+    # run_pipeline returning its stage timings alongside the result, since a pool worker's own
+    # metrics are never scraped; the caller records them.
+    timings: Dict[str, float] = {}
+    return run_pipeline(text, policy_id, policy_version, timings), timings
+
+
+async def iter_line_blocks(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    # Re-cuts arbitrary text windows at the last line break so every block holds whole lines.
+    # A "\r\n" split across windows only produces an empty line, which split_lines drops.
+    carry = ""
+    async for chunk in chunks:
+        buffer = carry + chunk
+        cut = max(buffer.rfind("\n"), buffer.rfind("\r"))
+        if cut < 0:
+            carry = buffer
+            continue
+        yield buffer[: cut + 1]
+        carry = buffer[cut + 1 :]
+    if carry:
+        yield carry
+
+
+def scan_window(
+    block: str, policy_id: str, policy_version: int, state: ScanState
+) -> Tuple[ScanState, float, float]:
+    # OCR and scan of one streamed window, off the event loop: the scan state travels with the
+    # window, so a pool process picks up where the previous window left off. Returns the new
+    # state plus OCR and extraction seconds.
+    started = time.perf_counter()
+    ocr_block = stage_ocr(block)
+    ocr_done = time.perf_counter()
+    scan = policy_registry.get(policy_id, policy_version).scan()
+    scan.restore(state)
+    scan.feed(split_lines(ocr_block))
+    return scan.state(), ocr_done - started, time.perf_counter() - ocr_done
+
+
+async def run_streaming_pipeline(
+    chunks: AsyncIterator[str],
+    plan: PolicyPlan,
+    timings: Optional[Dict[str, float]] = None,
+    executor: Optional[PipelineExecutor] = None,
+) -> PipelineResult:
+    # Heuristic extraction over a document too large to hold in memory: only one window of
+    # lines is alive at a time, and reading stops once every field has its first citation.
+    # Each window is OCR'd and scanned on `executor` (a thread without one, or when it runs
+    # inline), never on the event loop. `timings` gets OCR and extraction seconds summed over
+    # windows (reads are not included).
+    ocr_seconds = extract_seconds = 0.0
+    scan = plan.scan()
+    blocks = iter_line_blocks(chunks)
+    try:
+        async for block in blocks:
+            args = (plan.policy_id, plan.version, scan.state())
+            if executor is not None and executor.pooled:
+                state, ocr, extract = await executor.run(scan_window, block, *args, offload=True)
+            else:
+                state, ocr, extract = await asyncio.to_thread(scan_window, block, *args)
+            scan.restore(state)
+            ocr_seconds += ocr
+            extract_seconds += extract
+            if scan.done:
+                break
+    finally:
+        await blocks.aclose()
+    started = time.perf_counter()
+    evidence, sources, missing = plan.build(scan.hits, scan.negated)
+    guardrails(evidence, sources)
+    extract_done = time.perf_counter()
+    decision, explanation, missing = evaluate_policy(evidence, missing, plan)
+    if timings is not None:
+        timings["ocr"] = ocr_seconds
+        timings["extract"] = extract_seconds + extract_done - started
+        timings["policy"] = time.perf_counter() - extract_done
+    return evidence, sources, missing, decision, explanation, scan_stats(scan)
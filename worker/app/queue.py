@@ -1,24 +1,340 @@
-import asyncio
 import json
-from typing import Any, Dict, Optional
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
 
 from redis.asyncio import Redis
 
-from .config import QUEUE_NAME, DLQ_NAME
+from .config import (
+    DLQ_NAME,
+    QUEUE_DEFAULT_LANE,
+    QUEUE_LANES,
+    QUEUE_NAME,
+    QUEUE_RELIABLE,
+    QUEUE_STARVATION_SECONDS,
+    QUEUE_VISIBILITY_TIMEOUT_SECONDS,
+    RETRY_SET_NAME,
+    WORKER_ID,
+)
+from .lanes import LaneScheduler, parse_lanes
 from .logger import logger
+from .metrics import lane_depth, lane_dequeued, lane_oldest_age
+
+# Reliable mode cannot block on several lists at once; with lanes it blocks on the heaviest lane
+# for at most this long before re-checking the others.
+LANE_POLL_SECONDS = 1.0
+
+
+# Atomically moves retries whose due time has passed from the sorted set onto the main queue,
+# so promoters on several replicas never double-deliver.
+PROMOTE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #due == 0 then
+  return 0
+end
+for _, member in ipairs(due) do
+  redis.call('LPUSH', KEYS[2], member)
+end
+redis.call('ZREM', KEYS[1], unpack(due))
+return #due
+"""
+
+# Returns a dead worker's in-flight payloads to the consuming end of their lanes, oldest first,
+# and unregisters it. Skipped while the worker's heartbeat key exists unless forced. KEYS[2] is
+# the default lane; KEYS[5..] are the other lanes, named by ARGV[3..] in the same order. A
+# payload goes to the lane in its "lane" field, or to the default lane when that is unknown.
+RECLAIM_SCRIPT = """
+if ARGV[2] ~= '1' and redis.call('EXISTS', KEYS[3]) == 1 then
+  return -1
+end
+local lane_keys = {}
+for i = 3, #ARGV do
+  lane_keys[ARGV[i]] = KEYS[i + 2]
+end
+local moved = 0
+while true do
+  local item = redis.call('LPOP', KEYS[1])
+  if not item then
+    break
+  end
+  local target = KEYS[2]
+  local ok, payload = pcall(cjson.decode, item)
+  if ok and type(payload) == 'table' and type(payload['lane']) == 'string' and lane_keys[payload['lane']] then
+    target = lane_keys[payload['lane']]
+  end
+  redis.call('RPUSH', target, item)
+  moved = moved + 1
+end
+redis.call('SREM', KEYS[4], ARGV[1])
+return moved
+"""
+
+
+# Moves up to ARGV[1] payloads from the consuming end of the DLQ into the redrive staging list
+# and returns them, so a redrive that dies mid-batch can put them back instead of losing them.
+TAKE_DLQ_SCRIPT = """
+local taken = {}
+for _ = 1, tonumber(ARGV[1]) do
+  local item = redis.call('LMOVE', KEYS[1], KEYS[2], 'RIGHT', 'LEFT')
+  if not item then
+    break
+  end
+  taken[#taken + 1] = item
+end
+return taken
+"""
+
+# Extend or delete the redrive lock only while it still holds the caller's token, so a run whose
+# lock lapsed cannot extend or release the lock of a run that took it over.
+REFRESH_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Returns everything left in the staging list to the consuming end of the DLQ, oldest last.
+RESTORE_DLQ_SCRIPT = """
+local moved = 0
+while redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT') do
+  moved = moved + 1
+end
+return moved
+"""
 
 
 class QueueClient:
-    def __init__(self, redis: Redis):
+    def __init__(
+        self,
+        redis: Redis,
+        reliable: bool = QUEUE_RELIABLE,
+        worker_id: str = WORKER_ID,
+        lanes: str = QUEUE_LANES,
+        default_lane: str = QUEUE_DEFAULT_LANE,
+    ):
         self.redis = redis
         self.queue_name = QUEUE_NAME
         self.dlq_name = DLQ_NAME
+        self.retry_name = RETRY_SET_NAME
+        self._promote = redis.register_script(PROMOTE_DUE_SCRIPT)
+        # Priority lanes: the default lane is QUEUE_NAME itself (so plain producers keep working),
+        # other lanes are "<QUEUE_NAME>:<lane>" with their own retry sets; a payload picks its lane
+        # with a "lane" field. With more than one lane, pops are shared out by LaneScheduler.
+        self.default_lane = default_lane
+        self.lanes = parse_lanes(lanes, default_lane)
+        self.scheduler = LaneScheduler(self.lanes, QUEUE_STARVATION_SECONDS)
+        self.lane_keys = {name: self.lane_key(name) for name, _ in self.lanes}
+        # Reliable mode: payloads are moved (not popped) into a per-worker processing list and
+        # only removed on ack; a worker whose heartbeat lapses for the visibility timeout has
+        # its processing list pushed back onto the queue by any live worker.
+        self.reliable = reliable
+        self.worker_id = worker_id
+        self.visibility_timeout = QUEUE_VISIBILITY_TIMEOUT_SECONDS
+        self.workers_name = f"{self.queue_name}:workers"
+        self.processing_name = self._processing_key(worker_id)
+        self._inflight: Dict[int, str] = {}
+        self._reclaim = redis.register_script(RECLAIM_SCRIPT) if reliable else None
+        self.redrive_name = f"{self.dlq_name}:redrive"
+        self.redrive_lock_name = f"{self.dlq_name}:redrive:lock"
+        self._take_dlq = redis.register_script(TAKE_DLQ_SCRIPT)
+        self._restore_dlq = redis.register_script(RESTORE_DLQ_SCRIPT)
+        self._refresh_lock = redis.register_script(REFRESH_LOCK_SCRIPT)
+        self._release_lock = redis.register_script(RELEASE_LOCK_SCRIPT)
+
+    def lane_of(self, payload: Dict[str, Any]) -> str:
+        lane = payload.get("lane")
+        return lane if lane in self.weights_by_lane else self.default_lane
+
+    @property
+    def weights_by_lane(self) -> Dict[str, int]:
+        return self.scheduler.weights
+
+    def lane_key(self, lane: str) -> str:
+        return self.queue_name if lane == self.default_lane else f"{self.queue_name}:{lane}"
+
+    def _retry_key(self, lane: str) -> str:
+        return self.retry_name if lane == self.default_lane else f"{self.retry_name}:{lane}"
+
+    def _processing_key(self, worker_id: str) -> str:
+        return f"{self.queue_name}:processing:{worker_id}"
+
+    def _heartbeat_key(self, worker_id: str) -> str:
+        return f"{self.queue_name}:heartbeat:{worker_id}"
 
     async def pop(self, timeout: int = 5) -> Optional[Dict[str, Any]]:
-        item = await self.redis.brpop(self.queue_name, timeout=timeout)
+        payloads = await self.pop_batch(1, timeout=timeout)
+        return payloads[0] if payloads else None
+
+    async def pop_batch(self, count: int, timeout: float = 5) -> List[Dict[str, Any]]:
+        lanes: List[Optional[str]] = []
+        if len(self.lanes) > 1:
+            popped = await self._pop_lanes(count, timeout)
+            raw_payloads = [raw for _, raw in popped]
+            lanes = [lane for lane, _ in popped]
+        elif self.reliable:
+            raw_payloads = await self._move_batch(count, timeout)
+        elif count <= 1:
+            item = await self.redis.brpop(self.queue_name, timeout=timeout)
+            raw_payloads = [item[1]] if item else []
+        else:
+            # One BLMPOP round-trip returns up to `count` payloads as soon as at least one is queued.
+            item = await self.redis.blmpop(timeout, 1, self.queue_name, direction="RIGHT", count=count)
+            raw_payloads = item[1] if item else []
+
+        payloads = []
+        for idx, raw in enumerate(raw_payloads):
+            payload = self._decode(raw)
+            if not isinstance(payload, dict):
+                if self.reliable:
+                    await self.redis.lrem(self.processing_name, 1, raw)
+                continue
+            if lanes:
+                payload["lane"] = lanes[idx]
+                lane_dequeued.labels(lanes[idx]).inc()
+            if self.reliable:
+                self._inflight[id(payload)] = raw
+            payloads.append(payload)
+        return payloads
+
+    async def _pop_lanes(self, count: int, timeout: float) -> List[Tuple[str, str]]:
+        # One pipelined round-trip reads every lane's depth and oldest payload, the scheduler
+        # splits `count` between lanes, and a second round-trip pops exactly that. Only when all
+        # lanes are empty does it block.
+        pipe = self.redis.pipeline(transaction=False)
+        for key in self.lane_keys.values():
+            pipe.llen(key)
+            pipe.lindex(key, -1)
+        replies = await pipe.execute()
+        now = time.time()
+        depths: Dict[str, int] = {}
+        ages: Dict[str, float] = {}
+        for idx, lane in enumerate(self.lane_keys):
+            depths[lane] = int(replies[2 * idx] or 0)
+            ages[lane] = _age(replies[2 * idx + 1], now)
+            lane_depth.labels(lane).set(depths[lane])
+            lane_oldest_age.labels(lane).set(ages[lane])
+
+        take = self.scheduler.allocate(depths, ages, count)
+        if not any(take.values()):
+            return await self._wait_lanes(timeout)
+
+        pipe = self.redis.pipeline(transaction=False)
+        order: List[str] = []
+        for lane, n in take.items():
+            if not n:
+                continue
+            if self.reliable:
+                for _ in range(n):
+                    pipe.lmove(self.lane_keys[lane], self.processing_name, "RIGHT", "LEFT")
+                    order.append(lane)
+            else:
+                pipe.rpop(self.lane_keys[lane], n)
+                order.append(lane)
+        popped: List[Tuple[str, str]] = []
+        for lane, reply in zip(order, await pipe.execute()):
+            if reply is None:
+                continue
+            for raw in reply if isinstance(reply, list) else [reply]:
+                popped.append((lane, raw))
+        return popped
+
+    async def _wait_lanes(self, timeout: float) -> List[Tuple[str, str]]:
+        by_weight = sorted(self.lanes, key=lambda lane: -lane[1])
+        if self.reliable:
+            lane = by_weight[0][0]
+            raw = await self.redis.blmove(
+                self.lane_keys[lane], self.processing_name, min(timeout, LANE_POLL_SECONDS), "RIGHT", "LEFT"
+            )
+            return [(lane, raw)] if raw is not None else []
+        keys = [self.lane_keys[lane] for lane, _ in by_weight]
+        item = await self.redis.brpop(keys, timeout=timeout)
         if not item:
-            return None
-        _, payload = item
+            return []
+        lanes_by_key = {key: lane for lane, key in self.lane_keys.items()}
+        return [(lanes_by_key[item[0]], item[1])]
+
+    async def _move_batch(self, count: int, timeout: float) -> List[str]:
+        raw = await self.redis.blmove(self.queue_name, self.processing_name, timeout, "RIGHT", "LEFT")
+        if raw is None:
+            return []
+        raw_payloads = [raw]
+        if count > 1:
+            pipe = self.redis.pipeline(transaction=False)
+            for _ in range(count - 1):
+                pipe.lmove(self.queue_name, self.processing_name, "RIGHT", "LEFT")
+            raw_payloads.extend(item for item in await pipe.execute() if item is not None)
+        return raw_payloads
+
+    async def ack(self, payload: Dict[str, Any]):
+        raw = self._inflight.pop(id(payload), None)
+        if raw is not None:
+            await self.redis.lrem(self.processing_name, 1, raw)
+
+    async def requeue_unstarted(self, payloads: List[Dict[str, Any]]):
+        # Puts popped-but-unstarted payloads back on the consuming end of their lanes in one MULTI,
+        # first payload next out, keeping their enqueued_at so dwell and lane aging stay honest.
+        if not payloads:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        for payload in reversed(payloads):
+            raw = self._inflight.pop(id(payload), None)
+            if raw is not None:
+                pipe.lrem(self.processing_name, 1, raw)
+            pipe.rpush(self.lane_key(self.lane_of(payload)), raw if raw is not None else json.dumps(payload))
+        await pipe.execute()
+
+    async def heartbeat(self):
+        if not self.reliable:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(self._heartbeat_key(self.worker_id), "1", ex=max(1, int(self.visibility_timeout)))
+        pipe.sadd(self.workers_name, self.worker_id)
+        await pipe.execute()
+
+    async def reclaim_stale(self) -> int:
+        if not self.reliable:
+            return 0
+        moved = 0
+        for worker_id in await self.redis.smembers(self.workers_name):
+            if worker_id == self.worker_id:
+                continue
+            moved += max(0, await self._reclaim_worker(worker_id, force=False))
+        if moved:
+            logger.warn("Reclaimed in-flight jobs from stale workers", {"count": moved})
+        return moved
+
+    async def release(self):
+        # Graceful shutdown: hand unacked payloads back right away instead of waiting out the
+        # timeout. Everything in the processing list goes back, so call it only once no job is
+        # still running (or at startup, for what a previous run under this WORKER_ID left).
+        if not self.reliable:
+            return
+        moved = await self._reclaim_worker(self.worker_id, force=True)
+        await self.redis.delete(self._heartbeat_key(self.worker_id))
+        self._inflight.clear()
+        if moved:
+            logger.info("Returned in-flight jobs to queue", {"count": moved})
+
+    async def _reclaim_worker(self, worker_id: str, force: bool) -> int:
+        assert self._reclaim is not None
+        other_lanes = [lane for lane, _ in self.lanes if lane != self.default_lane]
+        keys = [
+            self._processing_key(worker_id),
+            self.queue_name,
+            self._heartbeat_key(worker_id),
+            self.workers_name,
+            *(self.lane_keys[lane] for lane in other_lanes),
+        ]
+        args = [worker_id, "1" if force else "0", *other_lanes]
+        return int(await self._reclaim(keys=keys, args=args))
+
+    def _decode(self, payload: str) -> Optional[Dict[str, Any]]:
         try:
             return json.loads(payload)
         except json.JSONDecodeError:
@@ -26,13 +342,93 @@ class QueueClient:
             return None
 
     async def push(self, payload: Dict[str, Any]):
-        await self.redis.lpush(self.queue_name, json.dumps(payload))
+        key = self.lane_key(self.lane_of(payload))
+        await self.redis.lpush(key, json.dumps({**payload, "enqueued_at": time.time()}))
+
+    async def schedule_retry(self, payload: Dict[str, Any], delay: float):
+        # Stamped with the due time, so queue dwell for a retry excludes its deliberate backoff.
+        due = time.time() + delay
+        key = self._retry_key(self.lane_of(payload))
+        await self.redis.zadd(key, {json.dumps({**payload, "enqueued_at": due}): due})
+
+    async def promote_due(self, limit: int = 100) -> int:
+        now = time.time()
+        moved = 0
+        for lane, _ in self.lanes:
+            keys = [self._retry_key(lane), self.lane_key(lane)]
+            moved += int(await self._promote(keys=keys, args=[now, limit]))
+        return moved
 
     async def push_dlq(self, payload: Dict[str, Any]):
         await self.redis.lpush(self.dlq_name, json.dumps(payload))
         logger.warn("Sent job to DLQ", {"job_id": payload.get("job_id")})
 
+    async def queue_depth(self) -> int:
+        # Across all lanes.
+        if len(self.lanes) == 1:
+            return int(await self.redis.llen(self.queue_name))
+        pipe = self.redis.pipeline(transaction=False)
+        for key in self.lane_keys.values():
+            pipe.llen(key)
+        return sum(int(depth or 0) for depth in await pipe.execute())
+
+    async def dlq_depth(self) -> int:
+        return int(await self.redis.llen(self.dlq_name))
+
+    async def peek_dlq(self, offset: int, count: int) -> List[str]:
+        # Raw DLQ payloads `offset` from the consuming end, without removing them.
+        return await self.redis.lrange(self.dlq_name, -(offset + count), -(offset + 1))
+
+    async def take_dlq(self, count: int) -> List[str]:
+        return list(await self._take_dlq(keys=[self.dlq_name, self.redrive_name], args=[count]))
+
+    async def finish_redrive(self, requeue: List[Dict[str, Any]], keep: List[str]):
+        # One MULTI: redriven payloads onto their own lanes, filtered-out ones back behind the rest
+        # of the DLQ, and the staging list cleared.
+        pipe = self.redis.pipeline(transaction=True)
+        if requeue:
+            now = time.time()
+            by_lane: Dict[str, List[str]] = {}
+            for payload in requeue:
+                key = self.lane_key(self.lane_of(payload))
+                by_lane.setdefault(key, []).append(json.dumps({**payload, "enqueued_at": now}))
+            for key, raw_payloads in by_lane.items():
+                pipe.lpush(key, *raw_payloads)
+        if keep:
+            pipe.lpush(self.dlq_name, *keep)
+        pipe.delete(self.redrive_name)
+        await pipe.execute()
+
+    async def restore_redrive(self) -> int:
+        return int(await self._restore_dlq(keys=[self.redrive_name, self.dlq_name]))
+
+    async def lock_redrive(self, ttl_seconds: int) -> Optional[str]:
+        # Returns this run's lock token, or None while another run holds the lock.
+        token = f"{self.worker_id}:{uuid.uuid4().hex}"
+        if await self.redis.set(self.redrive_lock_name, token, nx=True, ex=ttl_seconds):
+            return token
+        return None
+
+    async def refresh_redrive_lock(self, token: str, ttl_seconds: int) -> bool:
+        # False once the lock no longer holds `token`.
+        return bool(await self._refresh_lock(keys=[self.redrive_lock_name], args=[token, ttl_seconds]))
+
+    async def unlock_redrive(self, token: str):
+        await self._release_lock(keys=[self.redrive_lock_name], args=[token])
+
+
+def _age(raw: Optional[str], now: float) -> float:
+    # Seconds the payload has waited according to its enqueued_at stamp (0 if unknown).
+    if not raw:
+        return 0.0
+    try:
+        enqueued_at = json.loads(raw).get("enqueued_at")
+    except (ValueError, AttributeError):
+        return 0.0
+    if not isinstance(enqueued_at, (int, float)):
+        return 0.0
+    return max(0.0, now - enqueued_at)
+
 
-async def backoff_sleep(attempt: int, base: float):
-    delay = base * (2 ** (attempt - 1))
-    await asyncio.sleep(delay)
+def backoff_delay(attempt: int, base: float) -> float:
+    return base * (2 ** (attempt - 1))
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from redis.asyncio import Redis
+
+from .logger import logger
+
+# Token bucket shared by every replica. Refill uses the Redis server clock so replicas with skewed
+# clocks agree; returns 0 when a token was taken, otherwise the milliseconds until one is available.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait_ms = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait_ms = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return wait_ms
+"""
+
+
+class TokenBucket:
+    # Per-process bucket; also the fallback when Redis is unreachable.
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        # Returns 0 when a token was taken, otherwise seconds until the next one.
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self.take()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class RedisTokenBucket:
+    def __init__(self, redis: Redis, key: str, rate: float, burst: int):
+        self.key = key
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._take = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self._fallback = TokenBucket(rate, burst)
+
+    async def acquire(self):
+        # Waits for a token rather than failing the job, so callers check this before claiming work.
+        if self.rate <= 0:
+            return
+        while True:
+            try:
+                wait_ms = int(await self._take(keys=[self.key], args=[self.rate, self.burst]))
+            except Exception as err:
+                logger.warn("Shared rate limiter unavailable, using local bucket", {"error": str(err)})
+                await self._fallback.acquire()
+                return
+            if wait_ms <= 0:
+                return
+            await asyncio.sleep(wait_ms / 1000)
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from fnmatch import fnmatchcase
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+from redis.asyncio import Redis
+
+from .config import (
+    DATABASE_URL,
+    REDIS_URL,
+    REDRIVE_BATCH_SIZE,
+    REDRIVE_MAX_QUEUE_DEPTH,
+    REDRIVE_RATE_PER_SEC,
+)
+from .logger import logger
+from .queue import QueueClient
+from .repository import Repository
+
+# Lock TTL. A heartbeat refreshes it every REDRIVE_LOCK_REFRESH_SECONDS for as long as the run
+# lasts, including while it waits on a deep queue, so it expires only if the process stops.
+REDRIVE_LOCK_SECONDS = 60
+REDRIVE_LOCK_REFRESH_SECONDS = REDRIVE_LOCK_SECONDS / 3
+
+
+def matches_error(last_error: Optional[str], patterns: Optional[List[str]]) -> bool:
+    # Patterns are shell-style globs over core.document_jobs.last_error, e.g. "ocr_*".
+    if not patterns:
+        return True
+    return any(fnmatchcase(last_error or "", pattern) for pattern in patterns)
+
+
+class RedriveProgress:
+    def __init__(self, errors: Optional[List[str]], limit: Optional[int], dry_run: bool):
+        self.errors = errors
+        self.limit = limit
+        self.dry_run = dry_run
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.total = 0
+        self.scanned = 0
+        self.requeued = 0
+        self.kept = 0
+        self.discarded = 0
+        self.by_error: Dict[str, int] = {}
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "error": self.error,
+            "dry_run": self.dry_run,
+            "errors": self.errors,
+            "limit": self.limit,
+            "total": self.total,
+            "scanned": self.scanned,
+            "requeued": self.requeued,
+            "kept": self.kept,
+            "discarded": self.discarded,
+            "by_error": self.by_error,
+            "elapsed_seconds": round((self.finished_at or time.time()) - self.started_at, 3),
+        }
+
+
+class Redriver:
+    # Replays dead-lettered jobs in bulk. Each pass over the DLQ takes a batch into a staging
+    # list, looks the jobs up in one query, resets attempts for the ones to replay in one
+    # transaction and requeues them in one MULTI; payloads whose error does not match go back
+    # behind the rest of the DLQ, and ones whose job is gone, completed or already back in
+    # flight are dropped. Requeueing is paced at `rate` jobs/s and pauses while the main queue
+    # holds `max_queue_depth` or more payloads.
+
+    def __init__(
+        self,
+        queue: QueueClient,
+        repo: Repository,
+        rate: float = REDRIVE_RATE_PER_SEC,
+        batch_size: int = REDRIVE_BATCH_SIZE,
+        max_queue_depth: int = REDRIVE_MAX_QUEUE_DEPTH,
+    ):
+        self.queue = queue
+        self.repo = repo
+        self.rate = rate
+        # Keep a batch within about one second's worth of requeues so pacing stays smooth.
+        self.batch_size = max(1, min(batch_size, int(rate)) if rate > 0 else batch_size)
+        self.max_queue_depth = max_queue_depth
+        self._next_at = 0.0
+        self._lock_lost = False
+
+    async def run(
+        self,
+        errors: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        dry_run: bool = False,
+        progress: Optional[RedriveProgress] = None,
+    ) -> RedriveProgress:
+        progress = progress or RedriveProgress(errors, limit, dry_run)
+        token = await self.queue.lock_redrive(REDRIVE_LOCK_SECONDS)
+        if not token:
+            progress.status = "failed"
+            progress.error = "redrive_in_progress"
+            progress.finished_at = time.time()
+            return progress
+        self._lock_lost = False
+        keeper = asyncio.create_task(self._keep_lock(token))
+        try:
+            restored = 0 if dry_run else await self.queue.restore_redrive()
+            if restored:
+                logger.warn("Restored payloads from an interrupted redrive", {"count": restored})
+            # One pass: payloads put back during this run sit behind this many.
+            progress.total = await self.queue.dlq_depth()
+            while progress.scanned < progress.total and (limit is None or progress.requeued < limit):
+                count = min(self.batch_size, progress.total - progress.scanned)
+                self._check_lock()
+                if dry_run:
+                    raws = await self.queue.peek_dlq(progress.scanned, count)
+                else:
+                    raws = await self.queue.take_dlq(count)
+                if not raws:
+                    break
+                await self._redrive_batch(raws, progress)
+                logger.info("DLQ redrive progress", progress.as_dict())
+            progress.status = "completed"
+        except Exception as err:
+            progress.status = "failed"
+            progress.error = str(err)
+            logger.error("DLQ redrive failed", progress.as_dict())
+        finally:
+            progress.finished_at = time.time()
+            keeper.cancel()
+            await asyncio.gather(keeper, return_exceptions=True)
+            await self.queue.unlock_redrive(token)
+        logger.info("DLQ redrive finished", progress.as_dict())
+        return progress
+
+    async def _redrive_batch(self, raws: List[str], progress: RedriveProgress):
+        progress.scanned += len(raws)
+        candidates = []
+        for raw in raws:
+            payload = self.queue._decode(raw)
+            job_id = payload.get("job_id") if isinstance(payload, dict) else None
+            if not _is_uuid(job_id):
+                progress.discarded += 1
+                continue
+            candidates.append((raw, payload))
+
+        states = {}
+        if candidates:
+            states = await self.repo.job_states([payload["job_id"] for _, payload in candidates])
+        requeue: List[Dict[str, Any]] = []
+        requests: List[str] = []
+        keep: List[str] = []
+        for raw, payload in candidates:
+            state = states.get(str(uuid.UUID(payload["job_id"])))
+            # "queued" with no attempts is a job this tool reset before an interrupted requeue.
+            replayable = state is not None and (
+                state["status"] == "failed" or (state["status"] == "queued" and state["attempts"] == 0)
+            )
+            if not replayable:
+                progress.discarded += 1
+            elif not matches_error(state["last_error"], progress.errors) or (
+                progress.limit is not None and progress.requeued + len(requeue) >= progress.limit
+            ):
+                keep.append(raw)
+            else:
+                requeue.append(payload)
+                requests.append(str(state["request_id"]))
+                error_class = state["last_error"] or "unknown"
+                progress.by_error[error_class] = progress.by_error.get(error_class, 0) + 1
+
+        progress.kept += len(keep)
+        if progress.dry_run:
+            progress.requeued += len(requeue)
+            return
+        if requeue:
+            await self._throttle(len(requeue))
+        # A run that lost the lock leaves its batch staged for the run that holds it to restore.
+        self._check_lock()
+        if requeue:
+            await self.repo.reset_for_redrive([payload["job_id"] for payload in requeue], requests)
+        await self.queue.finish_redrive(requeue, keep)
+        progress.requeued += len(requeue)
+
+    async def _keep_lock(self, token: str):
+        while True:
+            await asyncio.sleep(REDRIVE_LOCK_REFRESH_SECONDS)
+            try:
+                held = await self.queue.refresh_redrive_lock(token, REDRIVE_LOCK_SECONDS)
+            except Exception as err:
+                logger.error("Redrive lock refresh failed", {"error": str(err)})
+                continue
+            if not held:
+                self._lock_lost = True
+                logger.error("Redrive lock lost")
+                return
+
+    def _check_lock(self):
+        if self._lock_lost:
+            raise RuntimeError("redrive_lock_lost")
+
+    async def _throttle(self, count: int):
+        while self.max_queue_depth > 0 and await self.queue.queue_depth() >= self.max_queue_depth:
+            await asyncio.sleep(1)
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        if self._next_at > now:
+            await asyncio.sleep(self._next_at - now)
+        self._next_at = max(now, self._next_at) + count / self.rate
+
+
+def _is_uuid(value: Any) -> bool:
+    try:
+        uuid.UUID(str(value))
+    except ValueError:
+        return False
+    return True
+
+
+async def _main(args: argparse.Namespace) -> int:
+    redis = Redis.from_url(REDIS_URL, decode_responses=True)
+    pool = await asyncpg.create_pool(DATABASE_URL)
+    try:
+        redriver = Redriver(QueueClient(redis), Repository(pool), args.rate, args.batch_size, args.max_queue_depth)
+        progress = await redriver.run(args.errors or None, args.limit, args.dry_run)
+    finally:
+        await redis.close()
+        await pool.close()
+    logger.flush()
+    print(json.dumps(progress.as_dict()))
+    return 0 if progress.status == "completed" else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay dead-lettered document jobs.")
+    parser.add_argument("--errors", nargs="*", help="last_error globs to replay (default: all)")
+    parser.add_argument("--limit", type=int, help="stop after requeueing this many jobs")
+    parser.add_argument("--rate", type=float, default=REDRIVE_RATE_PER_SEC, help="jobs requeued per second")
+    parser.add_argument("--batch-size", type=int, default=REDRIVE_BATCH_SIZE)
+    parser.add_argument("--max-queue-depth", type=int, default=REDRIVE_MAX_QUEUE_DEPTH)
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be replayed")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -1,53 +1,286 @@
-from typing import Any, Dict, Optional, Tuple
+import asyncio
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List, Mapping, Optional, Tuple
 
 import asyncpg
-import json
 
+from .config import (
+    BACKFILL_CURSOR_REQUESTS,
+    DOCUMENT_CHUNK_CHARS,
+    DOCUMENT_STREAM_THRESHOLD_BYTES,
+    WRITE_BATCH_SIZE,
+    WRITE_FLUSH_INTERVAL_MS,
+)
+from .evidence import dumps
 from .logger import logger
+from .metrics import db_call, db_pool_wait
 
+# BEGIN, the request lock and prior-pack read, the five write statements, COMMIT.
+COMPLETION_ROUNDTRIPS = 9
+# EWMA weight of the newest connection wait in Repository.pool_wait_seconds.
+POOL_WAIT_ALPHA = 0.2
 
-class Repository:
-    def __init__(self, pool: asyncpg.Pool):
+
+# merge(prior) folds a job's own extraction into the request's current latest pack, given as a
+# row with prior_pack_id, prior_policy, prior_evidence and prior_sources (all None when there is
+# none). Returns (evidence, sources, missing_fields, decision, explanation, merged_from), or None
+# to write the job's extraction as it is.
+Merge = Callable[[Mapping[str, Any]], Optional[Tuple[Any, ...]]]
+NO_PRIOR: Dict[str, Any] = {"prior_pack_id": None, "prior_policy": None, "prior_evidence": None, "prior_sources": None}
+
+
+class Completion:
+    # Everything a successful job writes: evidence pack + details, request/job status and audit row.
+    def __init__(
+        self,
+        job_id: str,
+        request_id: str,
+        decision: str,
+        explanation: str,
+        metadata: Dict[str, Any],
+        evidence: Dict[str, Any],
+        sources: Dict[str, Any],
+        missing_fields: list[str],
+        audit_action: str,
+        merge: Optional[Merge] = None,
+    ):
+        self.job_id = job_id
+        self.request_id = request_id
+        self.decision = decision
+        self.explanation = explanation
+        self.metadata = metadata
+        self.metadata_json = dumps(metadata) if metadata is not None else None
+        self.evidence_json = dumps(evidence) if evidence is not None else None
+        self.sources_json = dumps(sources) if sources is not None else None
+        self.missing_fields = missing_fields
+        self.audit_action = audit_action
+        self.audit_json = dumps({"job_id": job_id})
+        self.merge = merge
+        self.pack_id = uuid.uuid4()
+
+    def rebase(self, prior: Mapping[str, Any]):
+        # Re-merges against `prior`, read under the request lock; idempotent, so a batch retried
+        # job by job merges again against what is committed by then.
+        merged = self.merge(prior) if self.merge else None
+        if merged is None:
+            return
+        evidence, sources, self.missing_fields, self.decision, self.explanation, merged_from = merged
+        self.metadata = {**self.metadata, "merged_from": merged_from}
+        self.metadata_json = dumps(self.metadata)
+        self.evidence_json = dumps(evidence)
+        self.sources_json = dumps(sources)
+
+    def as_prior(self) -> Dict[str, Any]:
+        return {
+            "prior_pack_id": str(self.pack_id),
+            "prior_policy": (self.metadata or {}).get("policy"),
+            "prior_evidence": self.evidence_json,
+            "prior_sources": self.sources_json,
+        }
+
+
+async def merge_into_latest(conn: asyncpg.Connection, items: List[Completion]):
+    # Locks the requests of mergeable items (in id order, so concurrent batches cannot deadlock),
+    # then reads their latest packs in a second statement: under READ COMMITTED it sees whatever
+    # the transaction we waited on committed. Items of one request in the same batch chain, each
+    # merging into the one before it, so concurrent documents never merge from the same prior.
+    request_ids = sorted({item.request_id for item in items if item.merge})
+    if not request_ids:
+        return
+    await conn.execute(
+        "SELECT 1 FROM core.pa_requests WHERE id = ANY($1::uuid[]) ORDER BY id FOR UPDATE",
+        request_ids,
+    )
+    rows = await conn.fetch(
+        """
+        SELECT r.id AS request_id, ep.id AS prior_pack_id, ep.metadata->>'policy' AS prior_policy,
+               ed.evidence AS prior_evidence, ed.sources AS prior_sources
+        FROM core.pa_requests r
+        LEFT JOIN core.evidence_packs ep ON ep.id = r.latest_pack_id
+        LEFT JOIN phi.evidence_details ed ON ed.pack_id = ep.id
+        WHERE r.id = ANY($1::uuid[])
+        """,
+        request_ids,
+    )
+    latest: Dict[str, Mapping[str, Any]] = {str(row["request_id"]): row for row in rows}
+    for item in items:
+        if item.merge:
+            item.rebase(latest.get(str(item.request_id), NO_PRIOR))
+        latest[str(item.request_id)] = item.as_prior()
+
+
+async def write_completions(conn: asyncpg.Connection, items: List[Completion]):
+    # Multi-row statements for a whole batch; callers run this inside one transaction.
+    await merge_into_latest(conn, items)
+    await conn.execute(
+        """
+        INSERT INTO core.evidence_packs (id, request_id, decision, explanation, metadata)
+        SELECT * FROM UNNEST($1::uuid[], $2::uuid[], $3::text[], $4::text[], $5::jsonb[])
+        """,
+        [item.pack_id for item in items],
+        [item.request_id for item in items],
+        [item.decision for item in items],
+        [item.explanation for item in items],
+        [item.metadata_json for item in items],
+    )
+    # missing_fields is a ragged TEXT[] per row, so details go through pipelined executemany.
+    await conn.executemany(
+        "INSERT INTO phi.evidence_details (pack_id, evidence, sources, missing_fields) VALUES ($1, $2, $3, $4)",
+        [(item.pack_id, item.evidence_json, item.sources_json, item.missing_fields) for item in items],
+    )
+    # Several jobs of one request can share a batch; the last one submitted (which merged the
+    # others) owns latest_pack_id.
+    latest = {item.request_id: item.pack_id for item in items}
+    await conn.execute(
+        """
+        UPDATE core.pa_requests r
+        SET latest_pack_id=u.pack_id, status='completed', updated_at=now()
+        FROM UNNEST($1::uuid[], $2::uuid[]) AS u(request_id, pack_id)
+        WHERE r.id = u.request_id
+        """,
+        list(latest.keys()),
+        list(latest.values()),
+    )
+    await conn.execute(
+        "UPDATE core.document_jobs SET status='completed', updated_at=now() WHERE job_id = ANY($1::uuid[])",
+        [item.job_id for item in items],
+    )
+    await conn.execute(
+        """
+        INSERT INTO core.audit_events (request_id, actor, action, metadata)
+        SELECT * FROM UNNEST($1::uuid[], $2::text[], $3::text[], $4::jsonb[])
+        """,
+        [item.request_id for item in items],
+        ["worker"] * len(items),
+        [item.audit_action for item in items],
+        [item.audit_json for item in items],
+    )
+
+
+class WriteBatcher:
+    # Write-behind buffer: completions from concurrent jobs are flushed together every
+    # `flush_interval` seconds (or as soon as `max_batch` are waiting) in a single transaction.
+    # If a batch fails, each job is retried in its own transaction so one bad row cannot fail
+    # its neighbours; every job's rows still commit or roll back together.
+
+    def __init__(self, pool: asyncpg.Pool, max_batch: int, flush_interval: float):
         self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval
+        self.pending: List[Tuple[Completion, asyncio.Future]] = []
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
 
-    async def get_job(self, job_id: str) -> Optional[asyncpg.Record]:
-        return await self.pool.fetchrow(
-            "SELECT job_id, request_id, status, attempts, trace_id FROM core.document_jobs WHERE job_id=$1",
-            job_id,
-        )
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
 
-    async def increment_attempt(self, job_id: str):
-        await self.pool.execute(
-            "UPDATE core.document_jobs SET attempts = attempts + 1, status='processing', updated_at=now() WHERE job_id=$1",
-            job_id,
-        )
+    async def stop(self):
+        # Let the flusher finish its current batch, then drain whatever is still buffered.
+        self._closing = True
+        self._ready.set()
+        self._full.set()
+        if self._task:
+            await self._task
+            self._task = None
+        while self.pending:
+            await self._flush_next()
 
-    async def mark_failed(self, job_id: str, error: str):
-        await self.pool.execute(
-            "UPDATE core.document_jobs SET status='failed', last_error=$2, updated_at=now() WHERE job_id=$1",
-            job_id,
-            error,
-        )
+    async def submit(self, item: Completion) -> str:
+        if self._closing:
+            # Nothing flushes after stop(); write this one on its own instead of waiting forever.
+            await self._write([item])
+            return str(item.pack_id)
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+        self._ready.set()
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+        return await future
 
-    async def mark_completed(self, job_id: str):
-        await self.pool.execute(
-            "UPDATE core.document_jobs SET status='completed', updated_at=now() WHERE job_id=$1",
-            job_id,
-        )
+    async def _run(self):
+        while not self._closing:
+            await self._ready.wait()
+            if not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush_next()
+
+    async def _flush_next(self):
+        batch = self.pending[: self.max_batch]
+        self.pending = self.pending[self.max_batch :]
+        if not self.pending:
+            self._ready.clear()
+        if len(self.pending) < self.max_batch:
+            self._full.clear()
+        if not batch:
+            return
+        try:
+            await self._write([item for item, _ in batch])
+        except Exception as err:
+            if len(batch) == 1:
+                _settle(batch[0][1], error=err)
+                return
+            logger.warn("Batched write failed, retrying jobs individually", {"size": len(batch), "error": str(err)})
+            for item, future in batch:
+                try:
+                    await self._write([item])
+                except Exception as item_err:
+                    _settle(future, error=item_err)
+                else:
+                    _settle(future, result=str(item.pack_id))
+            return
+        for item, future in batch:
+            _settle(future, result=str(item.pack_id))
+
+    async def _write(self, items: List[Completion]):
+        with db_call("write_batch", COMPLETION_ROUNDTRIPS):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await write_completions(conn, items)
 
-    async def reset_to_queue(self, job_id: str, error: str):
-        await self.pool.execute(
-            "UPDATE core.document_jobs SET status='queued', last_error=$2, updated_at=now() WHERE job_id=$1",
-            job_id,
-            error,
-        )
 
-    async def load_document(self, job_id: str) -> Optional[str]:
-        row = await self.pool.fetchrow("SELECT content FROM phi.documents WHERE job_id=$1", job_id)
-        return row["content"] if row else None
+def _settle(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
 
-    async def write_evidence_pack(
+
+class Repository:
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        write_batch_size: int = WRITE_BATCH_SIZE,
+        write_flush_interval_ms: float = WRITE_FLUSH_INTERVAL_MS,
+    ):
+        self.pool = pool
+        # Smoothed wait for a pooled connection, sampled on every claim; a load signal for the
+        # concurrency limiter.
+        self.pool_wait_seconds = 0.0
+        self.batcher: Optional[WriteBatcher] = None
+        if write_flush_interval_ms > 0 and write_batch_size > 1:
+            self.batcher = WriteBatcher(pool, write_batch_size, write_flush_interval_ms / 1000)
+
+    def start(self):
+        if self.batcher:
+            self.batcher.start()
+
+    async def close(self):
+        if self.batcher:
+            await self.batcher.stop()
+
+    async def complete_job(
         self,
+        job_id: str,
         request_id: str,
         decision: str,
         explanation: str,
@@ -55,62 +288,265 @@ class Repository:
         evidence: Dict[str, Any],
         sources: Dict[str, Any],
         missing_fields: list[str],
-    ) -> Tuple[str, str]:
-        async with self.pool.acquire() as conn:
-            async with conn.transaction():
-                metadata_json = json.dumps(metadata) if metadata is not None else None
-                evidence_json = json.dumps(evidence) if evidence is not None else None
-                sources_json = json.dumps(sources) if sources is not None else None
+        audit_action: str = "EVIDENCE_PACK_CREATED",
+        merge: Optional[Merge] = None,
+    ) -> str:
+        item = Completion(
+            job_id, request_id, decision, explanation, metadata, evidence, sources, missing_fields, audit_action, merge
+        )
+        if self.batcher:
+            return await self.batcher.submit(item)
+        with db_call("complete_job", COMPLETION_ROUNDTRIPS):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await write_completions(conn, [item])
+        return str(item.pack_id)
 
-                pack_row = await conn.fetchrow(
+    async def claim_job(
+        self, job_id: str, request_id: str, stream_threshold: int = DOCUMENT_STREAM_THRESHOLD_BYTES
+    ) -> Optional[asyncpg.Record]:
+        # One round-trip for the whole read path: returns the job row as it was before the claim
+        # (so `attempts` is the pre-increment value) joined with the document content, and, unless
+        # the job is already completed, bumps attempts and marks job and request as processing.
+        # Documents over `stream_threshold` bytes come back with content NULL (only
+        # `content_bytes`) and are read through iter_document instead. The request's evidence so
+        # far is read at write time instead (merge_into_latest), under the request lock.
+        # asyncpg prepares and caches the statement per connection.
+        with db_call("claim_job"):
+            waited = time.perf_counter()
+            async with self.pool.acquire() as conn:
+                self._observe_pool_wait(time.perf_counter() - waited)
+                return await conn.fetchrow(
                     """
-                    INSERT INTO core.evidence_packs (request_id, decision, explanation, metadata)
-                    VALUES ($1, $2, $3, $4)
-                    RETURNING id
+                    WITH job AS (
+                        SELECT job_id, request_id, status, attempts, trace_id
+                        FROM core.document_jobs
+                        WHERE job_id=$1
+                    ), claimed AS (
+                        UPDATE core.document_jobs j
+                        SET attempts = j.attempts + 1, status='processing', updated_at=now()
+                        FROM job
+                        WHERE j.job_id = job.job_id AND job.status <> 'completed'
+                        RETURNING j.job_id
+                    ), request AS (
+                        UPDATE core.pa_requests
+                        SET status='processing', updated_at=now()
+                        WHERE id=$2 AND EXISTS (SELECT 1 FROM claimed)
+                        RETURNING id
+                    )
+                    SELECT job.job_id, job.request_id, job.status, job.attempts, job.trace_id,
+                           CASE WHEN $3 <= 0 OR octet_length(d.content) <= $3 THEN d.content END AS content,
+                           octet_length(d.content) AS content_bytes
+                    FROM job
+                    LEFT JOIN phi.documents d ON d.job_id = job.job_id AND job.status <> 'completed'
                     """,
+                    job_id,
                     request_id,
-                    decision,
-                    explanation,
-                    metadata_json,
-                )
-                pack_id = pack_row["id"]
-                await conn.execute(
-                    """
-                    INSERT INTO phi.evidence_details (pack_id, evidence, sources, missing_fields)
-                    VALUES ($1, $2, $3, $4)
-                    """,
-                    pack_id,
-                    evidence_json,
-                    sources_json,
-                    missing_fields,
+                    stream_threshold,
                 )
-                await conn.execute(
-                    """
-                    UPDATE core.pa_requests
-                    SET latest_pack_id=$2, status='completed', updated_at=now()
-                    WHERE id=$1
-                    """,
-                    request_id,
-                    pack_id,
+
+    def _observe_pool_wait(self, seconds: float):
+        db_pool_wait.observe(seconds)
+        self.pool_wait_seconds += POOL_WAIT_ALPHA * (seconds - self.pool_wait_seconds)
+
+    async def iter_document(self, job_id: str, chunk_chars: int = DOCUMENT_CHUNK_CHARS) -> AsyncIterator[str]:
+        # Reads phi.documents.content in `chunk_chars` windows so only one window is held at a time.
+        position = 1
+        while True:
+            with db_call("iter_document"):
+                chunk = await self.pool.fetchval(
+                    "SELECT substr(content, $2, $3) FROM phi.documents WHERE job_id=$1",
+                    job_id,
+                    position,
+                    chunk_chars,
                 )
-                return pack_id, decision
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_chars:
+                return
+            position += chunk_chars
+
+    async def mark_failed(self, job_id: str, error: str):
+        with db_call("mark_failed"):
+            await self.pool.execute(
+                "UPDATE core.document_jobs SET status='failed', last_error=$2, updated_at=now() WHERE job_id=$1",
+                job_id,
+                error,
+            )
+
+    async def reset_to_queue(self, job_id: str, error: str):
+        with db_call("reset_to_queue"):
+            await self.pool.execute(
+                "UPDATE core.document_jobs SET status='queued', last_error=$2, updated_at=now() WHERE job_id=$1",
+                job_id,
+                error,
+            )
 
     async def append_audit(self, request_id: str, actor: str, action: str, metadata: Dict[str, Any] | None = None):
-        metadata_json = json.dumps(metadata) if metadata is not None else None
-        await self.pool.execute(
-            "INSERT INTO core.audit_events (request_id, actor, action, metadata) VALUES ($1, $2, $3, $4)",
-            request_id,
-            actor,
-            action,
-            metadata_json,
-        )
+        metadata_json = dumps(metadata) if metadata is not None else None
+        with db_call("append_audit"):
+            await self.pool.execute(
+                "INSERT INTO core.audit_events (request_id, actor, action, metadata) VALUES ($1, $2, $3, $4)",
+                request_id,
+                actor,
+                action,
+                metadata_json,
+            )
 
     async def set_request_status(self, request_id: str, status: str):
-        await self.pool.execute(
-            "UPDATE core.pa_requests SET status=$2, updated_at=now() WHERE id=$1",
-            request_id,
-            status,
-        )
+        with db_call("set_request_status"):
+            await self.pool.execute(
+                "UPDATE core.pa_requests SET status=$2, updated_at=now() WHERE id=$1",
+                request_id,
+                status,
+            )
+
+    async def job_states(self, job_ids: List[str]) -> Dict[str, asyncpg.Record]:
+        # job_id -> (request_id, status, attempts, last_error) for a batch of jobs in one round-trip.
+        with db_call("job_states"):
+            rows = await self.pool.fetch(
+                """
+                SELECT job_id, request_id, status, attempts, last_error
+                FROM core.document_jobs
+                WHERE job_id = ANY($1::uuid[])
+                """,
+                job_ids,
+            )
+        return {str(row["job_id"]): row for row in rows}
 
-    async def ensure_request_processing(self, request_id: str):
-        await self.set_request_status(request_id, "processing")
+    async def reset_for_redrive(self, job_ids: List[str], request_ids: List[str]):
+        # Gives redriven jobs a fresh attempt budget, reopens their failed requests and audits the
+        # replay, as one transaction for the whole batch.
+        with db_call("reset_for_redrive", 5):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(
+                        """
+                        UPDATE core.document_jobs
+                        SET status='queued', attempts=0, updated_at=now()
+                        WHERE job_id = ANY($1::uuid[])
+                        """,
+                        job_ids,
+                    )
+                    await conn.execute(
+                        """
+                        UPDATE core.pa_requests
+                        SET status='pending', updated_at=now()
+                        WHERE id = ANY($1::uuid[]) AND status='failed'
+                        """,
+                        list(set(request_ids)),
+                    )
+                    await conn.execute(
+                        """
+                        INSERT INTO core.audit_events (request_id, actor, action, metadata)
+                        SELECT * FROM UNNEST($1::uuid[], $2::text[], $3::text[], $4::jsonb[])
+                        """,
+                        request_ids,
+                        ["worker"] * len(job_ids),
+                        ["DLQ_REDRIVEN"] * len(job_ids),
+                        [dumps({"job_id": job_id}) for job_id in job_ids],
+                    )
+
+    async def iter_request_documents(
+        self,
+        after: Optional[str],
+        prefetch: int,
+        window: int = BACKFILL_CURSOR_REQUESTS,
+        stream_threshold: int = DOCUMENT_STREAM_THRESHOLD_BYTES,
+    ) -> AsyncIterator[asyncpg.Record]:
+        # Documents of completed jobs in request order (request_id, then upload order), after
+        # request `after`, through a server-side cursor: `prefetch` rows per round-trip and only
+        # those held in memory. As in claim_job, documents over `stream_threshold` bytes come back
+        # with content NULL (only `content_bytes`) and are read through iter_document instead.
+        # Each row carries the request's latest_pack_id as of the read. The
+        # read-only transaction is reopened after every `window` requests (keyset on the last
+        # whole request), so no snapshot stays open for the length of the run. One pooled
+        # connection stays checked out until iteration ends.
+        window = max(1, window)
+        async with self.pool.acquire() as conn:
+            while True:
+                last = None
+                requests = 0
+                more = False
+                async with conn.transaction(readonly=True):
+                    cursor = conn.cursor(
+                        """
+                        SELECT d.request_id, d.job_id, r.latest_pack_id,
+                               CASE WHEN $2 <= 0 OR octet_length(d.content) <= $2 THEN d.content END AS content,
+                               octet_length(d.content) AS content_bytes
+                        FROM phi.documents d
+                        JOIN core.document_jobs j ON j.job_id = d.job_id AND j.status = 'completed'
+                        JOIN core.pa_requests r ON r.id = d.request_id
+                        WHERE $1::uuid IS NULL OR d.request_id > $1::uuid
+                        ORDER BY d.request_id, d.created_at, d.job_id
+                        """,
+                        after,
+                        stream_threshold,
+                        prefetch=prefetch,
+                    )
+                    async for row in cursor:
+                        if row["request_id"] != last:
+                            if requests == window:
+                                more = True
+                                break
+                            requests += 1
+                            last = row["request_id"]
+                        yield row
+                if not more:
+                    return
+                after = last
+
+    async def write_backfill(
+        self,
+        packs: List[Tuple[Any, ...]],
+        audit_metadata: List[str],
+        promote: bool,
+        seen_packs: Optional[List[Optional[str]]] = None,
+    ) -> int:
+        # Bulk-loads re-scored packs with COPY: `packs` rows are (pack_id, request_id, decision,
+        # explanation, metadata_json, evidence_json, sources_json, missing_fields). With
+        # `promote`, completed requests point latest_pack_id at their new pack, but only where it
+        # is still `seen_packs` (the latest pack when the request's documents were read); a
+        # request the live worker wrote to since keeps its newer pack. One transaction. Returns
+        # the number of requests promoted.
+        seen_packs = seen_packs if seen_packs is not None else [None] * len(packs)
+        with db_call("write_backfill", 6 if promote else 5):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.copy_records_to_table(
+                        "evidence_packs",
+                        schema_name="core",
+                        columns=["id", "request_id", "decision", "explanation", "metadata"],
+                        records=[pack[:5] for pack in packs],
+                    )
+                    await conn.copy_records_to_table(
+                        "evidence_details",
+                        schema_name="phi",
+                        columns=["pack_id", "evidence", "sources", "missing_fields"],
+                        records=[(pack[0],) + pack[5:] for pack in packs],
+                    )
+                    await conn.copy_records_to_table(
+                        "audit_events",
+                        schema_name="core",
+                        columns=["request_id", "actor", "action", "metadata"],
+                        records=[
+                            (pack[1], "worker", "EVIDENCE_PACK_BACKFILLED", metadata)
+                            for pack, metadata in zip(packs, audit_metadata)
+                        ],
+                    )
+                    if not promote:
+                        return 0
+                    status = await conn.execute(
+                        """
+                        UPDATE core.pa_requests r
+                        SET latest_pack_id=u.pack_id, updated_at=now()
+                        FROM UNNEST($1::uuid[], $2::uuid[], $3::uuid[]) AS u(request_id, pack_id, seen_pack_id)
+                        WHERE r.id = u.request_id AND r.status='completed'
+                          AND r.latest_pack_id IS NOT DISTINCT FROM u.seen_pack_id
+                        """,
+                        [pack[1] for pack in packs],
+                        [pack[0] for pack in packs],
+                        seen_packs,
+                    )
+                    return int(status.split()[-1])